@@ -1,30 +1,94 @@
 import csv
+import hashlib
+import hmac
 import io
+import json
 import os
-from datetime import datetime, timedelta
+import threading
+import time
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+import click
 from dotenv import load_dotenv
 load_dotenv()
-from flask import Flask, Response, render_template, request, redirect, url_for, flash, session
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session, send_file, stream_with_context
+from flask import abort, g, has_request_context, before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_babel import Babel, _, lazy_gettext as _l
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import func
+from sqlalchemy import event, func, inspect as sa_inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session as SASession, joinedload, selectinload
 from flask import make_response
-from xhtml2pdf import pisa
+from cache_rapports import CacheDisque
+from pdf_jobs import FileRapports, EN_COURS, PRET, ERREUR, INCONNU
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "secret")  # nécessaire pour flash()
 
-# Configuration de la base de données SQLite
+# Configuration de la base de données : DATABASE_URL (PostgreSQL en production),
+# fichier SQLite local par défaut
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'stock.db')
+DATABASE_URL = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'stock.db')
+if DATABASE_URL.startswith('postgres://'):
+    # Forme fournie par Render / Heroku, refusée par SQLAlchemy 2
+    DATABASE_URL = 'postgresql://' + DATABASE_URL[len('postgres://'):]
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if not DATABASE_URL.startswith('sqlite'):
+    # Pool par worker : DB_POOL_SIZE connexions permanentes (+ DB_MAX_OVERFLOW en pointe)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+        pool_size=int(os.environ.get('DB_POOL_SIZE', 5)),
+        max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        pool_timeout=int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        pool_recycle=int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        pool_pre_ping=True,
+    )
+
+# PRAGMA appliqués à chaque connexion SQLite
+PRAGMAS_SQLITE = {
+    'journal_mode': 'WAL',      # lectures du tableau de bord et écritures des ventes ne se bloquent plus
+    'synchronous': 'NORMAL',    # sûr en WAL : fsync aux checkpoints seulement
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),  # attente du verrou d'écriture (ms)
+    'cache_size': -64000,       # 64 Mo de cache de pages par connexion (valeur négative : en Kio)
+    'mmap_size': 268435456,     # 256 Mo lus par mmap
+    'temp_store': 'MEMORY',     # tris et tables temporaires en mémoire
+}
+
+# Rapports CSV / PDF générés : cache disque partagé par les workers (voir cache_rapports.py),
+# PDF rendus en arrière-plan (voir pdf_jobs.py)
+app.config['RAPPORTS_DIR'] = os.environ.get('RAPPORTS_DIR', os.path.join(app.instance_path, 'rapports'))
+app.config['RAPPORTS_CACHE_MO'] = int(os.environ.get('RAPPORTS_CACHE_MO', 200))
+app.config['PDF_PROCESSUS'] = int(os.environ.get('PDF_PROCESSUS', 1))
 
 # Initialisation
 db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+
+def _initialiser_migrations():
+    """Flask-Migrate, et donc Alembic (~150 ms d'import), pour les commandes `flask` seulement."""
+    from flask_migrate import Migrate
+    return Migrate(app, db)
+
+# Application chargée par la CLI `flask` (flask db …, flask run) : un contexte click est actif.
+# Les workers gunicorn démarrent sans Alembic.
+migrate = _initialiser_migrations() if click.get_current_context(silent=True) else None
+
+def configurer_sqlite(engine, pragmas=PRAGMAS_SQLITE):
+    """Applique `pragmas` à chaque nouvelle connexion de l'engine (sans effet hors SQLite)."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _appliquer_pragmas(connexion_dbapi, _record):
+        curseur = connexion_dbapi.cursor()
+        for nom, valeur in pragmas.items():
+            curseur.execute(f"PRAGMA {nom}={valeur}")
+        curseur.close()
+
+with app.app_context():
+    configurer_sqlite(db.engine)
 
 
 def get_locale():
@@ -38,6 +102,171 @@ login_manager.login_view = 'login'
 login_manager.login_message = _l("Veuillez vous connecter pour accéder à cette page.")
 login_manager.login_message_category = "warning"
 
+# ========================
+#     INSTRUMENTATION
+# ========================
+
+# Requêtes SQL plus longues que ce seuil (ms) : journalisées avec leur endpoint
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 200))
+# Jeton « Bearer » pour le scraping de /metrics (sinon : session connectée requise)
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+BUCKETS_LATENCE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIQUES = {
+    'stock_http_requests_total': ('counter', "Requêtes HTTP traitées"),
+    'stock_http_request_duration_seconds': ('histogram', "Durée totale des requêtes HTTP (envoi des réponses en flux compris)"),
+    'stock_db_queries_total': ('counter', "Requêtes SQL exécutées"),
+    'stock_db_duration_seconds': ('histogram', "Temps SQL cumulé par requête HTTP"),
+    'stock_db_slow_queries_total': ('counter', "Requêtes SQL au-delà de SLOW_QUERY_MS"),
+    'stock_template_render_seconds': ('histogram', "Temps de rendu Jinja par requête HTTP"),
+    'stock_pdf_render_seconds': ('histogram', "Temps de rendu xhtml2pdf par rapport (pool de processus)"),
+}
+
+
+class Metriques:
+    """
+    Compteurs et histogrammes en mémoire, propres au processus (un jeu par worker
+    gunicorn), exportés au format texte Prometheus. Une seule prise de verrou par
+    requête HTTP : coût négligeable devant le rendu d'une page.
+    """
+
+    def __init__(self):
+        self._verrou = threading.Lock()
+        self._compteurs = {}     # (nom, labels) -> valeur
+        self._histogrammes = {}  # (nom, labels) -> [n par bucket..., n total, somme]
+
+    def _histo(self, nom, labels, valeur):
+        h = self._histogrammes.get((nom, labels))
+        if h is None:
+            h = self._histogrammes[(nom, labels)] = [0] * (len(BUCKETS_LATENCE) + 1) + [0.0]
+        for i, borne in enumerate(BUCKETS_LATENCE):
+            if valeur <= borne:
+                h[i] += 1
+                break
+        h[-2] += 1
+        h[-1] += valeur
+
+    def enregistrer(self, compteurs=(), histogrammes=()):
+        """compteurs : [(nom, labels, incrément)] ; histogrammes : [(nom, labels, valeur)]."""
+        with self._verrou:
+            for nom, labels, n in compteurs:
+                self._compteurs[(nom, labels)] = self._compteurs.get((nom, labels), 0) + n
+            for nom, labels, valeur in histogrammes:
+                self._histo(nom, labels, valeur)
+
+    def exporter(self):
+        """Exposition texte Prometheus (version 0.0.4)."""
+        def fmt(labels, **extra):
+            paires = list(labels) + [('worker', str(os.getpid()))] + list(extra.items())
+            return '{' + ','.join(f'{k}="{v}"' for k, v in paires) + '}'
+
+        with self._verrou:
+            compteurs = dict(self._compteurs)
+            histogrammes = {k: list(v) for k, v in self._histogrammes.items()}
+
+        lignes = []
+        for nom, (genre, aide) in METRIQUES.items():
+            lignes += [f"# HELP {nom} {aide}", f"# TYPE {nom} {genre}"]
+            if genre == 'counter':
+                for (n, labels), valeur in sorted(compteurs.items()):
+                    if n == nom:
+                        lignes.append(f"{nom}{fmt(labels)} {valeur}")
+                continue
+            for (n, labels), h in sorted(histogrammes.items()):
+                if n != nom:
+                    continue
+                cumul = 0
+                for borne, compte in zip(BUCKETS_LATENCE, h):
+                    cumul += compte
+                    lignes.append(f"{nom}_bucket{fmt(labels, le=borne)} {cumul}")
+                lignes.append(f"{nom}_bucket{fmt(labels, le='+Inf')} {h[-2]}")
+                lignes.append(f"{nom}_sum{fmt(labels)} {h[-1]:.6f}")
+                lignes.append(f"{nom}_count{fmt(labels)} {h[-2]}")
+        return '\n'.join(lignes) + '\n'
+
+
+metriques = Metriques()
+
+
+def _endpoint():
+    return request.endpoint or 'inconnu'
+
+
+def _chrono_ajouter(cle, duree):
+    if has_request_context() and 'instrumentation' in g:
+        g.instrumentation[cle] += duree
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _sql_debut(conn, cursor, statement, parameters, context, executemany):
+    context._debut_sql = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _sql_fin(conn, cursor, statement, parameters, context, executemany):
+    duree = time.perf_counter() - context._debut_sql
+    if has_request_context() and 'instrumentation' in g:
+        g.instrumentation['sql_n'] += 1
+        g.instrumentation['sql_s'] += duree
+    if duree * 1000 >= app.config['SLOW_QUERY_MS']:
+        endpoint = _endpoint() if has_request_context() else 'hors-requete'
+        app.logger.warning("Requête SQL lente (%.0f ms) [%s] : %s",
+                           duree * 1000, endpoint, ' '.join(statement.split())[:500])
+        metriques.enregistrer(compteurs=[('stock_db_slow_queries_total', (('endpoint', endpoint),), 1)])
+
+
+@before_render_template.connect_via(app)
+def _rendu_debut(sender, template, context, **extra):
+    if 'instrumentation' in g:
+        g.instrumentation['tpl_debut'] = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def _rendu_fin(sender, template, context, **extra):
+    if 'instrumentation' in g and g.instrumentation['tpl_debut'] is not None:
+        _chrono_ajouter('tpl_s', time.perf_counter() - g.instrumentation['tpl_debut'])
+        g.instrumentation['tpl_debut'] = None
+
+
+@app.before_request
+def _instrumentation_debut():
+    g.instrumentation = dict(debut=time.perf_counter(), sql_n=0, sql_s=0.0,
+                             tpl_debut=None, tpl_s=0.0)
+
+
+@app.after_request
+def _instrumentation_fin(response):
+    mesures = g.get('instrumentation')
+    if mesures is None or request.endpoint in ('static', 'metrics'):
+        return response
+    par_endpoint = (('endpoint', _endpoint()),)
+    statut = (('method', request.method), ('status', str(response.status_code)))
+
+    def enregistrer():
+        # À la fermeture de la réponse : les exports en flux (stream_with_context)
+        # exécutent leurs requêtes pendant l'envoi, après after_request
+        total = time.perf_counter() - mesures['debut']
+        metriques.enregistrer(
+            compteurs=[('stock_http_requests_total', par_endpoint + statut, 1),
+                       ('stock_db_queries_total', par_endpoint, mesures['sql_n'])],
+            histogrammes=[('stock_http_request_duration_seconds', par_endpoint, total),
+                          ('stock_db_duration_seconds', par_endpoint, mesures['sql_s']),
+                          ('stock_template_render_seconds', par_endpoint, mesures['tpl_s'])])
+
+    response.call_on_close(enregistrer)
+
+    # Répartition visible dans l'onglet réseau du navigateur (Server-Timing) ;
+    # pour une réponse en flux, l'en-tête part avant le corps : travail déjà fait seulement
+    total = time.perf_counter() - mesures['debut']
+    response.headers['Server-Timing'] = (
+        f'db;dur={mesures["sql_s"] * 1000:.1f};desc="SQL x{mesures["sql_n"]}", '
+        f'tpl;dur={mesures["tpl_s"] * 1000:.1f}, '
+        f'total;dur={total * 1000:.1f}'
+    )
+    return response
+
+
 # ========================
 #        MODÈLES
 # ========================
@@ -54,15 +283,39 @@ class Recette(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nom = db.Column(db.String(100), nullable=False)
     ingredients = db.relationship('RecetteIngredient', backref='recette', cascade='all, delete-orphan')
+    composants = db.relationship('RecetteComposant', foreign_keys='RecetteComposant.recette_id',
+                                 backref='recette', cascade='all, delete-orphan')
 
 class RecetteIngredient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    recette_id = db.Column(db.Integer, db.ForeignKey('recette.id'), nullable=False)
+    recette_id = db.Column(db.Integer, db.ForeignKey('recette.id'), nullable=False, index=True)
     ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredient.id'), nullable=False)
     quantite = db.Column(db.Float, nullable=False)
     ingredient = db.relationship('Ingredient')
 
+class RecetteComposant(db.Model):
+    """Sous-recette (base : sauce, marinade, pâte…) d'une recette, en portions de base par portion."""
+    id = db.Column(db.Integer, primary_key=True)
+    recette_id = db.Column(db.Integer, db.ForeignKey('recette.id'), nullable=False, index=True)
+    sous_recette_id = db.Column(db.Integer, db.ForeignKey('recette.id'), nullable=False, index=True)
+    quantite = db.Column(db.Float, nullable=False)
+    sous_recette = db.relationship('Recette', foreign_keys=[sous_recette_id])
+
+class FicheAplatie(db.Model):
+    """
+    Fiche technique aplatie : ingrédients d'une portion, sous-recettes développées.
+    Table dérivée de RecetteIngredient et RecetteComposant, tenue à jour par aplatir_fiches().
+    """
+    __tablename__ = "fiche_aplatie"
+    recette_id = db.Column(db.Integer, db.ForeignKey('recette.id'), primary_key=True)
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredient.id'), primary_key=True)
+    quantite = db.Column(db.Float, nullable=False)
+
 class Vente(db.Model):
+    # Index couvrant : filtre sur la période + agrégat par recette sans lire la table
+    __table_args__ = (
+        db.Index('ix_vente_date_recette_id_quantite', 'date', 'recette_id', 'quantite'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     recette_id = db.Column(db.Integer, db.ForeignKey('recette.id'), nullable=False)
     quantite = db.Column(db.Integer, nullable=False, default=1)
@@ -70,6 +323,9 @@ class Vente(db.Model):
     recette = db.relationship('Recette')
 
 class HistoriqueTransfert(db.Model):
+    __table_args__ = (
+        db.Index('ix_historique_transfert_date_ingredient_id', 'date', 'ingredient_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredient.id'), nullable=False)
     quantite = db.Column(db.Float, nullable=False)
@@ -95,7 +351,7 @@ class VenteBoisson(db.Model):
     boisson_id = db.Column(db.Integer, db.ForeignKey('boisson.id'), nullable=False)
     caissier_id = db.Column(db.Integer, db.ForeignKey('caissier.id'), nullable=False)
     quantite = db.Column(db.Float, nullable=False, default=0.0)
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     boisson = db.relationship('Boisson')
     caissier = db.relationship('Caissier')
 
@@ -103,7 +359,7 @@ class VenteBoisson(db.Model):
 class SessionCaisse(db.Model):
     __tablename__ = "session_caisse"
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.Date, nullable=False)  # on enregistre la date de fin de période
+    date = db.Column(db.Date, nullable=False, index=True)  # on enregistre la date de fin de période
     caissier_id = db.Column(db.Integer, db.ForeignKey('caissier.id'), nullable=False)
     montant_reel = db.Column(db.Float, nullable=False, default=0.0)
     montant_attendu = db.Column(db.Float, nullable=False, default=0.0)
@@ -113,8 +369,12 @@ class SessionCaisse(db.Model):
 
 class SessionLigne(db.Model):
     __tablename__ = "session_ligne"
+    # (boisson_id, session_id) : chaînage du SI par boisson ; session_id : chargement des lignes
+    __table_args__ = (
+        db.Index('ix_session_ligne_boisson_id_session_id', 'boisson_id', 'session_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    session_id = db.Column(db.Integer, db.ForeignKey('session_caisse.id'), nullable=False)
+    session_id = db.Column(db.Integer, db.ForeignKey('session_caisse.id'), nullable=False, index=True)
     boisson_id = db.Column(db.Integer, db.ForeignKey('boisson.id'), nullable=False)
 
     stock_initial = db.Column(db.Float, nullable=False, default=0.0)  # SI
@@ -135,10 +395,13 @@ class SessionLigne(db.Model):
 # Entrées (livraisons) quotidiennes de boissons
 class EntreeBoisson(db.Model):
     __tablename__ = "entree_boisson"
+    __table_args__ = (
+        db.Index('ix_entree_boisson_boisson_id_date', 'boisson_id', 'date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     boisson_id = db.Column(db.Integer, db.ForeignKey('boisson.id'), nullable=False)
     quantite = db.Column(db.Float, nullable=False, default=0.0)
-    date = db.Column(db.Date, nullable=False)  # date de la livraison/entrée
+    date = db.Column(db.Date, nullable=False, index=True)  # date de la livraison/entrée
     note = db.Column(db.String(200), nullable=True)
     boisson = db.relationship('Boisson')
 
@@ -162,6 +425,17 @@ class EntreeBoisson(db.Model):
     @staticmethod
     def dernier_stock_final_avant(boisson_id: int, date_pointage):
         """Récupère le SF le plus récent AVANT cette date (pour chaîner SI)."""
+        registre = db.session.get(StockBoisson, boisson_id)
+        if registre is None or registre.date_dernier_sf is None:
+            return 0.0
+        if registre.date_dernier_sf < date_pointage:
+            return float(registre.dernier_sf)
+        # Pointage antidaté : on remonte l'historique
+        return EntreeBoisson._dernier_stock_final_historique(boisson_id, date_pointage)
+
+    @staticmethod
+    def _dernier_stock_final_historique(boisson_id: int, date_pointage):
+        """SF le plus récent avant cette date, lu dans l'historique des sessions."""
         l = (SessionLigne.query
              .join(SessionCaisse, SessionLigne.session_id == SessionCaisse.id)
              .filter(SessionLigne.boisson_id == boisson_id,
@@ -172,6 +446,694 @@ class EntreeBoisson(db.Model):
             return float(l.stock_final or 0.0)
         return 0.0
 
+    @staticmethod
+    def derniers_stocks_finaux_avant(boisson_ids, date_pointage):
+        """Version en lot de dernier_stock_final_avant : sous-requête (boisson_id, stock_final)."""
+        rang = func.row_number().over(
+            partition_by=SessionLigne.boisson_id,
+            order_by=(SessionCaisse.date.desc(), SessionLigne.id.desc())
+        ).label('rang')
+        sq = (db.session.query(SessionLigne.boisson_id, SessionLigne.stock_final, rang)
+              .join(SessionCaisse, SessionLigne.session_id == SessionCaisse.id)
+              .filter(SessionLigne.boisson_id.in_(boisson_ids),
+                      SessionCaisse.date < date_pointage)
+              .subquery())
+        return db.select(sq.c.boisson_id, sq.c.stock_final).where(sq.c.rang == 1).subquery()
+
+    @staticmethod
+    def totaux_entrees_entre(boisson_ids, date_debut, date_fin):
+        """Version en lot de total_entrees_entre : sous-requête (boisson_id, total)."""
+        return (db.session.query(EntreeBoisson.boisson_id,
+                                 func.sum(EntreeBoisson.quantite).label('total'))
+                .filter(EntreeBoisson.boisson_id.in_(boisson_ids),
+                        EntreeBoisson.date >= date_debut,
+                        EntreeBoisson.date <= date_fin)
+                .group_by(EntreeBoisson.boisson_id)
+                .subquery())
+
+    @staticmethod
+    def pointage_auto(boisson_ids, date_debut, date_fin):
+        """
+        SI (dernier SF avant date_debut), ACHAT (entrées sur la période) et P.U courant
+        pour une liste de boissons, en une seule requête : {boisson_id: (si, achat, prix)}.
+        """
+        if not boisson_ids:
+            return {}
+        ach = EntreeBoisson.totaux_entrees_entre(boisson_ids, date_debut, date_fin)
+        rows = (db.session.query(Boisson.id,
+                                 StockBoisson.dernier_sf,
+                                 StockBoisson.date_dernier_sf,
+                                 func.coalesce(ach.c.total, 0.0),
+                                 Boisson.prix_unitaire)
+                .outerjoin(StockBoisson, StockBoisson.boisson_id == Boisson.id)
+                .outerjoin(ach, ach.c.boisson_id == Boisson.id)
+                .filter(Boisson.id.in_(boisson_ids))
+                .all())
+
+        # SI lu dans le registre ; seules les boissons déjà pointées à/après
+        # date_debut (pointage antidaté) repassent par l'historique.
+        antidatees = [bid for bid, _, d, _, _ in rows if d is not None and d >= date_debut]
+        historique = {}
+        if antidatees:
+            sf = EntreeBoisson.derniers_stocks_finaux_avant(antidatees, date_debut)
+            historique = dict(db.session.execute(db.select(sf.c.boisson_id, sf.c.stock_final)).all())
+
+        return {bid: (float(historique.get(bid, 0.0) if bid in antidatees else (si or 0.0)),
+                      float(a or 0.0), float(prix or 0.0))
+                for bid, si, d, a, prix in rows}
+
+# Registre de stock par boisson : dernier SF connu + livraisons reçues depuis.
+# Tenu à jour à chaque pointage et à chaque livraison ;
+# reconstruction / contrôle : flask reconstruire-stock-bar
+class StockBoisson(db.Model):
+    __tablename__ = "stock_boisson"
+    boisson_id = db.Column(db.Integer, db.ForeignKey('boisson.id'), primary_key=True)
+    dernier_sf = db.Column(db.Float, nullable=False, default=0.0)       # SF de la dernière session
+    date_dernier_sf = db.Column(db.Date, nullable=True)                  # None : jamais pointée
+    entrees_depuis = db.Column(db.Float, nullable=False, default=0.0)   # livraisons après cette date
+
+    @property
+    def stock_theorique(self):
+        return self.dernier_sf + self.entrees_depuis
+
+# === AGRÉGATS (tableau de bord / exports) ===
+# Tenus à jour dans la même transaction que ventes() et le pointage bar ;
+# reconstruction complète : flask reconstruire-agregats
+
+class AgregatVenteJour(db.Model):
+    __tablename__ = "agregat_vente_jour"
+    jour = db.Column(db.Date, primary_key=True)
+    recette_id = db.Column(db.Integer, db.ForeignKey('recette.id'), primary_key=True)
+    quantite = db.Column(db.Integer, nullable=False, default=0)
+
+class AgregatVenteHeure(db.Model):
+    __tablename__ = "agregat_vente_heure"
+    jour = db.Column(db.Date, primary_key=True)
+    heure = db.Column(db.Integer, primary_key=True)  # 0..23
+    recette_id = db.Column(db.Integer, db.ForeignKey('recette.id'), primary_key=True)
+    quantite = db.Column(db.Integer, nullable=False, default=0)
+
+class AgregatBoissonJour(db.Model):
+    __tablename__ = "agregat_boisson_jour"
+    jour = db.Column(db.Date, primary_key=True)  # SessionCaisse.date
+    boisson_id = db.Column(db.Integer, db.ForeignKey('boisson.id'), primary_key=True)
+    quantite = db.Column(db.Float, nullable=False, default=0.0)  # Σ (SI + ACHAT - SF)
+    montant = db.Column(db.Float, nullable=False, default=0.0)   # Σ (SI + ACHAT - SF) × P.U
+
+def _upsert(modele, cles, lignes, maj, where=None, connexion=None):
+    """
+    INSERT ... ON CONFLICT (cles) DO UPDATE (SQLite / PostgreSQL).
+    maj(excluded) -> {colonne: expression} ; where(excluded) -> condition de mise à jour.
+    Exécuté dans la session courante, ou sur `connexion` si elle est fournie.
+    """
+    if not lignes:
+        return
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(modele).values(lignes)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(cles),
+        set_=maj(stmt.excluded),
+        where=where(stmt.excluded) if where is not None else None
+    )
+    (connexion or db.session).execute(stmt)
+
+def _incrementer(modele, cles, lignes):
+    """Upsert : ajoute les colonnes hors clé de chaque ligne à l'agrégat (créé si absent)."""
+    if not lignes:
+        return
+    increments = [c for c in lignes[0] if c not in cles]
+    _upsert(modele, cles, lignes,
+            lambda excluded: {c: getattr(modele, c) + getattr(excluded, c) for c in increments})
+
+def enregistrer_agregats_ventes(ventes):
+    """Répercute des ventes (objets Vente avec date) sur les agrégats jour/heure."""
+    par_jour, par_heure = {}, {}
+    for v in ventes:
+        k = (v.date.date(), v.recette_id)
+        par_jour[k] = par_jour.get(k, 0) + v.quantite
+        k = (v.date.date(), v.date.hour, v.recette_id)
+        par_heure[k] = par_heure.get(k, 0) + v.quantite
+    _incrementer(AgregatVenteJour, ('jour', 'recette_id'),
+                 [dict(jour=j, recette_id=r, quantite=q) for (j, r), q in par_jour.items()])
+    _incrementer(AgregatVenteHeure, ('jour', 'heure', 'recette_id'),
+                 [dict(jour=j, heure=h, recette_id=r, quantite=q) for (j, h, r), q in par_heure.items()])
+
+def enregistrer_agregats_session(session_caisse, lignes):
+    """Répercute les lignes (dicts) d'une session de caisse sur l'agrégat boissons du jour de clôture."""
+    par_boisson = {}
+    for l in lignes:
+        qte = l['stock_initial'] + l['entrees'] - l['stock_final']
+        q, m = par_boisson.get(l['boisson_id'], (0.0, 0.0))
+        par_boisson[l['boisson_id']] = (q + qte, m + qte * l['prix_unitaire_snap'])
+    _incrementer(AgregatBoissonJour, ('jour', 'boisson_id'),
+                 [dict(jour=session_caisse.date, boisson_id=b, quantite=q, montant=m)
+                  for b, (q, m) in par_boisson.items()])
+
+def enregistrer_stock_session(session_caisse, lignes):
+    """
+    Avance le registre des boissons pointées si la session est la plus récente
+    (une session antidatée ne change rien). Les livraisons postérieures à la
+    clôture sont relues en une requête bornée par l'index (boisson_id, date).
+    """
+    if not lignes:
+        return
+    ids = [l['boisson_id'] for l in lignes]
+    apres = dict(db.session.query(EntreeBoisson.boisson_id, func.sum(EntreeBoisson.quantite))
+                 .filter(EntreeBoisson.boisson_id.in_(ids),
+                         EntreeBoisson.date > session_caisse.date)
+                 .group_by(EntreeBoisson.boisson_id)
+                 .all())
+    _upsert(StockBoisson, ('boisson_id',),
+            [dict(boisson_id=l['boisson_id'], dernier_sf=l['stock_final'],
+                  date_dernier_sf=session_caisse.date,
+                  entrees_depuis=float(apres.get(l['boisson_id']) or 0.0))
+             for l in {l['boisson_id']: l for l in lignes}.values()],
+            lambda excluded: dict(dernier_sf=excluded.dernier_sf,
+                                  date_dernier_sf=excluded.date_dernier_sf,
+                                  entrees_depuis=excluded.entrees_depuis),
+            where=lambda excluded: StockBoisson.date_dernier_sf.is_(None)
+                                   | (StockBoisson.date_dernier_sf <= excluded.date_dernier_sf))
+
+def enregistrer_stock_entree(boisson_id, date_livraison, quantite):
+    """Ajoute une livraison au registre si elle est postérieure au dernier pointage."""
+    _upsert(StockBoisson, ('boisson_id',),
+            [dict(boisson_id=boisson_id, dernier_sf=0.0, date_dernier_sf=None, entrees_depuis=quantite)],
+            lambda excluded: dict(entrees_depuis=StockBoisson.entrees_depuis + excluded.entrees_depuis),
+            where=lambda excluded: StockBoisson.date_dernier_sf.is_(None)
+                                   | (StockBoisson.date_dernier_sf < date_livraison))
+
+def calculer_stock_bar():
+    """Registre recalculé depuis l'historique : {boisson_id: (dernier_sf, date, entrees_depuis)}."""
+    rang = func.row_number().over(
+        partition_by=SessionLigne.boisson_id,
+        order_by=(SessionCaisse.date.desc(), SessionLigne.id.desc())
+    ).label('rang')
+    sq = (db.session.query(SessionLigne.boisson_id, SessionLigne.stock_final,
+                           SessionCaisse.date.label('date'), rang)
+          .join(SessionCaisse, SessionLigne.session_id == SessionCaisse.id)
+          .subquery())
+    dernier = {bid: (float(sf or 0.0), d) for bid, sf, d in
+               db.session.query(sq.c.boisson_id, sq.c.stock_final, sq.c.date).filter(sq.c.rang == 1)}
+
+    entrees = {}
+    for bid, d, q in (db.session.query(EntreeBoisson.boisson_id, EntreeBoisson.date,
+                                       func.sum(EntreeBoisson.quantite))
+                      .group_by(EntreeBoisson.boisson_id, EntreeBoisson.date)):
+        date_sf = dernier.get(bid, (0.0, None))[1]
+        if date_sf is None or d > date_sf:
+            entrees[bid] = entrees.get(bid, 0.0) + float(q or 0.0)
+
+    return {bid: (dernier.get(bid, (0.0, None))[0], dernier.get(bid, (0.0, None))[1],
+                  entrees.get(bid, 0.0))
+            for bid in set(dernier) | set(entrees)}
+
+def reconstruire_stock_bar():
+    """Recalcule le registre ; renvoie le nombre de boissons dont le registre était faux."""
+    attendu = calculer_stock_bar()
+    actuel = {s.boisson_id: (s.dernier_sf, s.date_dernier_sf, s.entrees_depuis)
+              for s in StockBoisson.query}
+    ecarts = sum(1 for bid in set(attendu) | set(actuel)
+                 if bid not in attendu or bid not in actuel
+                 or attendu[bid][1] != actuel[bid][1]
+                 or abs(attendu[bid][0] - actuel[bid][0]) > 1e-6
+                 or abs(attendu[bid][2] - actuel[bid][2]) > 1e-6)
+
+    StockBoisson.query.delete()
+    db.session.add_all(StockBoisson(boisson_id=bid, dernier_sf=sf, date_dernier_sf=d, entrees_depuis=e)
+                       for bid, (sf, d, e) in attendu.items())
+    db.session.commit()
+    return ecarts
+
+def reconstruire_agregats():
+    """Recalcule intégralement les agrégats depuis Vente et SessionLigne (back-fill)."""
+    from sqlalchemy import insert, select, extract
+
+    AgregatVenteJour.query.delete()
+    AgregatVenteHeure.query.delete()
+    AgregatBoissonJour.query.delete()
+
+    jour = func.date(Vente.date)
+    db.session.execute(insert(AgregatVenteJour).from_select(
+        ['jour', 'recette_id', 'quantite'],
+        select(jour, Vente.recette_id, func.sum(Vente.quantite))
+        .group_by(jour, Vente.recette_id)
+    ))
+    heure = extract('hour', Vente.date)
+    db.session.execute(insert(AgregatVenteHeure).from_select(
+        ['jour', 'heure', 'recette_id', 'quantite'],
+        select(jour, heure, Vente.recette_id, func.sum(Vente.quantite))
+        .group_by(jour, heure, Vente.recette_id)
+    ))
+    qte = SessionLigne.stock_initial + SessionLigne.entrees - SessionLigne.stock_final
+    db.session.execute(insert(AgregatBoissonJour).from_select(
+        ['jour', 'boisson_id', 'quantite', 'montant'],
+        select(SessionCaisse.date, SessionLigne.boisson_id,
+               func.sum(qte), func.sum(qte * SessionLigne.prix_unitaire_snap))
+        .join(SessionCaisse, SessionCaisse.id == SessionLigne.session_id)
+        .group_by(SessionCaisse.date, SessionLigne.boisson_id)
+    ))
+    invalider_caches('ventes', 'bar')
+    db.session.commit()
+
+# === VERSIONS DES DONNÉES (caches : alertes stock, rapports) ===
+
+class VersionCache(db.Model):
+    """Tampon de version d'un cache applicatif, partagé par tous les workers via la base."""
+    __tablename__ = 'version_cache'
+    cle = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    modifie_le = db.Column(db.DateTime)  # dernière incrémentation (Last-Modified de l'API du tableau de bord)
+
+# Toute écriture ORM sur ces modèles incrémente la version de leur domaine
+# (clés des rapports mis en cache : voir cle_rapport)
+VERSIONS_PAR_MODELE = {
+    Vente: 'ventes',
+    Recette: 'recettes', RecetteIngredient: 'recettes', RecetteComposant: 'recettes',
+    HistoriqueTransfert: 'transferts',
+    Ingredient: 'ingredients',
+    Boisson: 'bar', SessionCaisse: 'bar', SessionLigne: 'bar', VenteBoisson: 'bar',
+}
+
+CLE_ALERTES = 'alertes_stock'
+# Colonnes d'Ingredient affichées ou utilisées par les alertes : toute modification invalide le cache
+CHAMPS_ALERTES = ('nom', 'unite', 'stock_cuisine', 'seuil_alerte')
+
+Alerte = namedtuple('Alerte', 'id nom unite stock_cuisine seuil_alerte')
+
+# Cache du worker : liste calculée pour une version donnée du tampon
+_cache_alertes = {'version': None, 'alertes': ()}
+
+def invalider_caches(*cles):
+    """
+    Marque les tampons à incrémenter ; à appeler après un INSERT/UPDATE SQL direct.
+    L'incrément n'est publié qu'au COMMIT (_publier_versions) : aucune ligne de
+    version_cache n'est verrouillée pendant la transaction d'une vente ou d'un transfert.
+    """
+    _marquer_caches(db.session, cles)
+
+def _marquer_caches(session, cles):
+    session.info.setdefault('caches_modifies', set()).update(cles)
+    if has_request_context():
+        if CLE_ALERTES in cles:
+            g.pop('alertes', None)
+        if 'recettes' in cles:
+            g.pop('fiches', None)
+
+def etat_caches(*cles):
+    """
+    ({cle: version}, dernière modification de l'un des tampons ou None) en une requête
+    (version 0 pour un tampon jamais incrémenté).
+    """
+    lignes = (db.session.query(VersionCache.cle, VersionCache.version, VersionCache.modifie_le)
+              .filter(VersionCache.cle.in_(cles)).all())
+    versions = {c: 0 for c in cles}
+    versions.update((c, v) for c, v, _m in lignes)
+    return versions, max((m for _c, _v, m in lignes if m is not None), default=None)
+
+def versions_caches(*cles):
+    """{cle: version} en une requête (0 pour un tampon jamais incrémenté)."""
+    return etat_caches(*cles)[0]
+
+@event.listens_for(SASession, 'before_flush')
+def _reperer_changements(session, flush_context, instances):
+    cles = set()
+    for obj in list(session.new) + list(session.deleted):
+        if type(obj) in VERSIONS_PAR_MODELE:
+            cles.add(VERSIONS_PAR_MODELE[type(obj)])
+        if isinstance(obj, Ingredient):
+            cles.add(CLE_ALERTES)
+    for obj in session.dirty:
+        if type(obj) not in VERSIONS_PAR_MODELE or not session.is_modified(obj):
+            continue
+        cles.add(VERSIONS_PAR_MODELE[type(obj)])
+        if isinstance(obj, Ingredient):
+            etat = sa_inspect(obj)
+            if any(etat.attrs[c].history.has_changes() for c in CHAMPS_ALERTES):
+                cles.add(CLE_ALERTES)
+    if cles:
+        _marquer_caches(session, cles)
+
+@event.listens_for(SASession, 'after_commit')
+def _valider_versions(session):
+    cles = session.info.pop('caches_modifies', None)
+    if cles:
+        session.info['versions_a_publier'] = cles
+
+@event.listens_for(SASession, 'after_transaction_end')
+def _publier_versions(session, transaction):
+    """
+    Incrémente une fois chaque tampon marqué pendant la transaction validée, en une
+    instruction autonome exécutée après le COMMIT des données : un worker ne peut
+    donc pas lire la nouvelle version avec les anciennes données. La session a déjà
+    rendu sa connexion au pool : l'incrément la reprend au lieu d'en bloquer une
+    seconde (pool épuisé quand tous les fils valident en même temps).
+    """
+    if transaction.parent is not None:
+        return
+    cles = session.info.pop('versions_a_publier', None)
+    if not cles:
+        return
+    maintenant = datetime.utcnow()
+    with db.engine.begin() as connexion:
+        _upsert(VersionCache, ['cle'], [dict(cle=c, version=1, modifie_le=maintenant) for c in sorted(cles)],
+                lambda excluded: {'version': VersionCache.version + excluded.version,
+                                  'modifie_le': excluded.modifie_le},
+                connexion=connexion)
+
+@event.listens_for(SASession, 'after_rollback')
+def _oublier_versions(session):
+    session.info.pop('caches_modifies', None)
+
+def alertes_stock():
+    """
+    Ingrédients sous leur seuil d'alerte (Alerte), triés par nom. Une lecture du
+    tampon par requête ; la liste n'est recalculée que si un worker l'a incrémenté.
+    """
+    global _cache_alertes
+    if has_request_context() and 'alertes' in g:
+        return g.alertes
+    version = db.session.query(VersionCache.version).filter_by(cle=CLE_ALERTES).scalar() or 0
+    cache = _cache_alertes
+    if cache['version'] != version:
+        alertes = tuple(Alerte(*row) for row in db.session.query(
+            Ingredient.id, Ingredient.nom, Ingredient.unite, Ingredient.stock_cuisine, Ingredient.seuil_alerte
+        ).filter(
+            Ingredient.seuil_alerte.isnot(None),
+            Ingredient.stock_cuisine < Ingredient.seuil_alerte
+        ).order_by(Ingredient.nom.asc()))
+        # Remplacement du dict en une affectation : pas de verrou entre threads
+        cache = _cache_alertes = {'version': version, 'alertes': alertes}
+    if has_request_context():
+        g.alertes = cache['alertes']
+    return cache['alertes']
+
+# === FICHES TECHNIQUES (sous-recettes) ===
+# Une recette peut utiliser d'autres recettes (bases). FicheAplatie garde pour chaque recette
+# les ingrédients d'une portion, sous-recettes développées : ventes, prévisions et rapports
+# la lisent telle quelle, quelle que soit la profondeur de l'arbre.
+
+class CycleRecettes(Exception):
+    """Une recette se retrouverait parmi ses propres sous-recettes (directement ou non)."""
+
+    def __init__(self, recette_ids):
+        super().__init__(recette_ids)
+        self.recette_ids = recette_ids
+
+def _graphe_composants():
+    """{sous_recette_id: {recette_id, …}} : recettes utilisant directement chaque sous-recette."""
+    utilisee_par = {}
+    for recette_id, sous_recette_id in db.session.query(RecetteComposant.recette_id,
+                                                        RecetteComposant.sous_recette_id):
+        utilisee_par.setdefault(sous_recette_id, set()).add(recette_id)
+    return utilisee_par
+
+def recettes_dependantes(recette_ids, utilisee_par=None):
+    """`recette_ids` et toutes les recettes qui les utilisent, directement ou non."""
+    if utilisee_par is None:
+        utilisee_par = _graphe_composants()
+    dependantes, pile = set(recette_ids), list(recette_ids)
+    while pile:
+        for parent in utilisee_par.get(pile.pop(), ()):
+            if parent not in dependantes:
+                dependantes.add(parent)
+                pile.append(parent)
+    return dependantes
+
+def aplatir_fiches(recette_ids):
+    """
+    Recalcule FicheAplatie pour `recette_ids` (recettes modifiées) et leurs seules
+    dépendantes, en ordre topologique : une base est développée avant les recettes qui
+    l'utilisent, et une base non modifiée est reprise de sa fiche aplatie. Lève
+    CycleRecettes si une recette se retrouve dans son propre arbre (l'appelant annule).
+    """
+    from sqlalchemy import insert
+
+    utilisee_par = _graphe_composants()
+    a_recalculer = recettes_dependantes(recette_ids, utilisee_par)
+    if not a_recalculer:
+        return
+
+    composants = {r: [] for r in a_recalculer}
+    for recette_id, sous_recette_id, quantite in (
+            db.session.query(RecetteComposant.recette_id, RecetteComposant.sous_recette_id,
+                             RecetteComposant.quantite)
+            .filter(RecetteComposant.recette_id.in_(a_recalculer))):
+        composants[recette_id].append((sous_recette_id, quantite))
+
+    # Ordre topologique (Kahn) restreint aux recettes à recalculer : un cycle passant par
+    # une recette modifiée n'est formé que de dépendantes, il laisse des recettes non placées
+    restantes = {r: len({s for s, _q in composants[r]} & a_recalculer) for r in a_recalculer}
+    ordre = [r for r, n in restantes.items() if n == 0]
+    for recette_id in ordre:
+        for parent in utilisee_par.get(recette_id, ()):
+            if parent in restantes:
+                restantes[parent] -= 1
+                if restantes[parent] == 0:
+                    ordre.append(parent)
+    if len(ordre) < len(a_recalculer):
+        raise CycleRecettes(sorted(a_recalculer - set(ordre)))
+
+    aplaties = {r: {} for r in a_recalculer}
+    bases = {s for r in a_recalculer for s, _q in composants[r]} - a_recalculer
+    for recette_id, ingredient_id, quantite in (
+            db.session.query(FicheAplatie.recette_id, FicheAplatie.ingredient_id, FicheAplatie.quantite)
+            .filter(FicheAplatie.recette_id.in_(bases))):
+        aplaties.setdefault(recette_id, {})[ingredient_id] = quantite
+    for recette_id, ingredient_id, quantite in (
+            db.session.query(RecetteIngredient.recette_id, RecetteIngredient.ingredient_id,
+                             RecetteIngredient.quantite)
+            .filter(RecetteIngredient.recette_id.in_(a_recalculer))):
+        fiche = aplaties[recette_id]
+        fiche[ingredient_id] = fiche.get(ingredient_id, 0) + quantite
+    for recette_id in ordre:
+        fiche = aplaties[recette_id]
+        for sous_recette_id, portions in composants[recette_id]:
+            for ingredient_id, quantite in aplaties.get(sous_recette_id, {}).items():
+                fiche[ingredient_id] = fiche.get(ingredient_id, 0) + quantite * portions
+
+    # Recettes supprimées comprises : leurs lignes disparaissent
+    FicheAplatie.query.filter(FicheAplatie.recette_id.in_(a_recalculer)).delete(synchronize_session=False)
+    lignes = [dict(recette_id=r, ingredient_id=i, quantite=q)
+              for r in ordre for i, q in aplaties[r].items()]
+    if lignes:
+        db.session.execute(insert(FicheAplatie), lignes)
+    invalider_caches('recettes')
+
+def reconstruire_fiches_aplaties():
+    """Recalcule FicheAplatie pour toutes les recettes (back-fill, import de données)."""
+    aplatir_fiches([r for (r,) in db.session.query(Recette.id)])
+    db.session.commit()
+
+# === MOUVEMENTS DE STOCK (ingrédients) ===
+
+class StockInsuffisant(Exception):
+    """Un décrément conditionnel n'a touché aucune ligne : stock insuffisant (ou ingrédient absent)."""
+
+    def __init__(self, ingredient_id):
+        super().__init__(ingredient_id)
+        self.ingredient_id = ingredient_id
+
+class FicheCompilee(namedtuple('FicheCompilee', 'ingredient_ids quantites')):
+    """Fiche aplatie d'une recette en tableaux compacts : ids d'ingrédients (triés) et quantités par portion."""
+    __slots__ = ()
+
+    def lignes(self):
+        """Couples (ingredient_id, quantité par portion)."""
+        return zip(self.ingredient_ids, self.quantites)
+
+    def besoins(self, portions):
+        """{ingredient_id: quantité} consommée par `portions` portions."""
+        return {i: q * portions for i, q in zip(self.ingredient_ids, self.quantites)}
+
+# Cache du worker : fiches de toutes les recettes pour une version du tampon 'recettes'
+_cache_fiches = {'version': None, 'fiches': {}}
+
+def fiches_compilees(version=None):
+    """
+    {recette_id: FicheCompilee} de toutes les recettes (sans ingrédient comprises). Une
+    lecture du tampon 'recettes' par requête (sauf `version` déjà lue par l'appelant) ;
+    les fiches ne sont relues (FicheAplatie) que si un worker a modifié une recette.
+    """
+    global _cache_fiches
+    if has_request_context() and 'fiches' in g:
+        return g.fiches
+    # Version lue avant les fiches : au pire, des fiches plus récentes que leur version (relues ensuite)
+    if version is None:
+        version = db.session.query(VersionCache.version).filter_by(cle='recettes').scalar() or 0
+    cache = _cache_fiches
+    if cache['version'] != version:
+        brutes = {}
+        for recette_id, ingredient_id, quantite in (
+                db.session.query(Recette.id, FicheAplatie.ingredient_id, FicheAplatie.quantite)
+                .outerjoin(FicheAplatie, FicheAplatie.recette_id == Recette.id)):
+            fiche = brutes.setdefault(recette_id, {})
+            if ingredient_id is not None:
+                fiche[ingredient_id] = fiche.get(ingredient_id, 0) + quantite
+        fiches = {recette_id: FicheCompilee(array('q', sorted(fiche)), array('d', (fiche[i] for i in sorted(fiche))))
+                  for recette_id, fiche in brutes.items()}
+        # Remplacement du dict en une affectation : pas de verrou entre threads
+        cache = _cache_fiches = {'version': version, 'fiches': fiches}
+    if has_request_context():
+        g.fiches = cache['fiches']
+    return cache['fiches']
+
+def fiches_techniques(recette_ids):
+    """{recette_id: FicheCompilee} des recettes demandées qui existent (cache du worker)."""
+    fiches = fiches_compilees()
+    return {r: fiches[r] for r in set(recette_ids) if r in fiches}
+
+def retirer_stock(colonne, quantites):
+    """
+    Décrémente `colonne` ('stock_cuisine' ou 'stock_magasin') de chaque ingrédient
+    {ingredient_id: quantité} par un UPDATE … SET s = s - :q WHERE id = :id AND s >= :q.
+    Contrôle et écriture tiennent en une instruction : deux workers ne peuvent ni perdre
+    une mise à jour ni vendre au-delà du stock. Lève StockInsuffisant au premier refus,
+    à charge pour l'appelant d'annuler la transaction (rollback).
+    """
+    stock = getattr(Ingredient, colonne)
+    # Ordre fixe des verrous de ligne (PostgreSQL) : pas d'interblocage entre deux ventes
+    for ingredient_id, quantite in sorted(quantites.items()):
+        resultat = db.session.execute(
+            db.update(Ingredient)
+            .where(Ingredient.id == ingredient_id, stock >= quantite)
+            .values({colonne: stock - quantite})
+            .execution_options(synchronize_session=False))
+        if resultat.rowcount != 1:
+            raise StockInsuffisant(ingredient_id)
+    invalider_caches('ingredients', CLE_ALERTES)
+
+def ajouter_stock(colonne, quantites):
+    """Incrémente `colonne` de chaque ingrédient {ingredient_id: quantité} (UPDATE … SET s = s + :q)."""
+    stock = getattr(Ingredient, colonne)
+    for ingredient_id, quantite in sorted(quantites.items()):
+        db.session.execute(
+            db.update(Ingredient)
+            .where(Ingredient.id == ingredient_id)
+            .values({colonne: stock + quantite})
+            .execution_options(synchronize_session=False))
+    invalider_caches('ingredients', CLE_ALERTES)
+
+# === PRÉVISIONS DE STOCK (jours de couverture) ===
+# Consommation journalière de chaque ingrédient = ventes (jour × recette) @ fiches
+# techniques (recette × ingrédient), en NumPy sur AgregatVenteJour ; le profil par jour
+# de semaine est ensuite projeté sur les stocks actuels, tous les ingrédients à la fois.
+
+# Historique pris en compte (jours entiers, aujourd'hui exclu) et horizon de la projection
+PREVISION_JOURS_HISTORIQUE = 56
+PREVISION_HORIZON_JOURS = 90
+# Ruptures les plus proches affichées sur le tableau de bord (liste complète : export CSV)
+PREVISIONS_TABLEAU_DE_BORD = 10
+
+Prevision = namedtuple('Prevision', 'id nom unite stock_cuisine stock_magasin conso_jour '
+                                    'jours_cuisine rupture_cuisine jours_total')
+
+# Cache du worker : profil de consommation calculé pour (versions ventes / recettes, jour)
+_cache_profil_conso = {'cle': None, 'profil': None}
+
+def _profil_consommation(aujourdhui):
+    """
+    (ingredient_ids, profil 7 × I) : consommation moyenne de chaque ingrédient par jour
+    de semaine (lundi = 0) sur les PREVISION_JOURS_HISTORIQUE jours précédant `aujourdhui`.
+    Recalculé seulement quand des ventes ou des fiches techniques ont changé.
+    """
+    global _cache_profil_conso
+    versions = versions_caches('ventes', 'recettes')
+    cle = (tuple(sorted(versions.items())), aujourdhui)
+    cache = _cache_profil_conso
+    if cache['cle'] == cle:
+        return cache['profil']
+
+    import numpy as np
+
+    debut = aujourdhui - timedelta(days=PREVISION_JOURS_HISTORIQUE)
+    ventes = (db.session.query(AgregatVenteJour.jour, AgregatVenteJour.recette_id, AgregatVenteJour.quantite)
+              .filter(AgregatVenteJour.jour >= debut, AgregatVenteJour.jour < aujourdhui)
+              .all())
+    fiches = [(r, i, q) for r, fiche in fiches_compilees(versions['recettes']).items()
+              for i, q in fiche.lignes()]
+    ingredient_ids = np.array(sorted({i for _r, i, _q in fiches}), dtype=np.int64)
+    profil = np.zeros((7, len(ingredient_ids)))
+
+    if ventes and fiches:
+        jours, r_ventes, q_ventes = zip(*ventes)
+        r_fiches, i_fiches, q_fiches = zip(*fiches)
+        recettes, rangs = np.unique(np.array(r_ventes + r_fiches), return_inverse=True)
+        # Historique à partir du premier jour vendu (base récente) : les jours sans vente comptent 0
+        premier = min(jours)
+        nb_jours = (aujourdhui - premier).days
+        matrice_ventes = np.zeros((nb_jours, len(recettes)))
+        np.add.at(matrice_ventes, ([(j - premier).days for j in jours], rangs[:len(ventes)]), q_ventes)
+        matrice_fiches = np.zeros((len(recettes), len(ingredient_ids)))
+        np.add.at(matrice_fiches, (rangs[len(ventes):], np.searchsorted(ingredient_ids, i_fiches)), q_fiches)
+        conso = matrice_ventes @ matrice_fiches          # jour × ingrédient
+
+        jours_semaine = (premier.weekday() + np.arange(nb_jours)) % 7
+        occurrences = np.bincount(jours_semaine, minlength=7)
+        np.add.at(profil, jours_semaine, conso)
+        profil /= np.maximum(occurrences, 1)[:, None]
+        # Jour de semaine absent de l'historique (moins d'une semaine) : moyenne de tous les jours
+        profil[occurrences == 0] = conso.mean(axis=0)
+
+    # Remplacement du dict en une affectation : pas de verrou entre threads
+    _cache_profil_conso = {'cle': cle, 'profil': (ingredient_ids, profil)}
+    return ingredient_ids, profil
+
+def previsions_stock(aujourdhui=None):
+    """
+    Prévision (Prevision) de chaque ingrédient, ruptures cuisine les plus proches d'abord :
+    consommation moyenne par jour et jours de couverture du stock cuisine, puis du stock
+    cuisine + magasin (None : aucune consommation ou au-delà de PREVISION_HORIZON_JOURS).
+    """
+    if has_request_context() and 'previsions' in g:
+        return g.previsions
+
+    import numpy as np
+
+    aujourdhui = aujourdhui or datetime.utcnow().date()
+    ingredient_ids, profil = _profil_consommation(aujourdhui)
+    ingredients = db.session.query(Ingredient.id, Ingredient.nom, Ingredient.unite,
+                                   Ingredient.stock_cuisine, Ingredient.stock_magasin).all()
+    if not ingredients:
+        return []
+    ids, noms, unites, cuisine, magasin = zip(*ingredients)
+    cuisine = np.array(cuisine, dtype=float)
+    magasin = np.array(magasin, dtype=float)
+
+    # Colonne du profil de chaque ingrédient ; hors fiches techniques : colonne nulle ajoutée en fin
+    position = {i: k for k, i in enumerate(ingredient_ids.tolist())}
+    colonnes = [position.get(i, len(ingredient_ids)) for i in ids]
+    profil = np.hstack([profil, np.zeros((7, 1))])[:, colonnes]      # 7 × N
+
+    # Consommation projetée jour par jour à partir d'aujourd'hui, puis cumulée (H × N)
+    projection = profil[(aujourdhui.weekday() + np.arange(PREVISION_HORIZON_JOURS)) % 7]
+    cumul = np.vstack([np.zeros((1, len(ids))), projection.cumsum(axis=0)])
+
+    # Cuisine, puis cuisine + magasin : jours entiers couverts + fraction du jour de rupture
+    stocks = np.maximum(np.vstack([cuisine, cuisine + magasin]), 0)      # 2 × N
+    entiers = (cumul[None, 1:, :] <= stocks[:, None, :]).sum(axis=1)    # 2 × N
+    epuise = entiers < PREVISION_HORIZON_JOURS
+    n = np.arange(len(ids))
+    besoin = projection[np.minimum(entiers, PREVISION_HORIZON_JOURS - 1), n]
+    couverture = entiers + np.divide(stocks - cumul[entiers, n], besoin,
+                                     out=np.zeros_like(stocks), where=besoin > 0)
+
+    conso_jour = profil.mean(axis=0)
+    previsions = []
+    for k in range(len(ids)):
+        jours_cuisine = round(float(couverture[0, k]), 1) if epuise[0, k] else None
+        previsions.append(Prevision(
+            ids[k], noms[k], unites[k], float(cuisine[k]), float(magasin[k]), round(float(conso_jour[k]), 3),
+            jours_cuisine,
+            aujourdhui + timedelta(days=int(couverture[0, k])) if epuise[0, k] else None,
+            round(float(couverture[1, k]), 1) if epuise[1, k] else None))
+    previsions.sort(key=lambda p: (p.jours_cuisine is None, p.jours_cuisine or 0, p.nom))
+    if has_request_context():
+        g.previsions = previsions
+    return previsions
+
 # === AUTHENTIFICATION ===
 
 class User(UserMixin, db.Model):
@@ -190,7 +1152,8 @@ def load_user(user_id):
     return db.session.get(User, int(user_id))
 
 # Les tables sont gérées via Flask-Migrate (Alembic).
-# Au premier déploiement, exécuter : flask db upgrade
+# Au premier déploiement, exécuter : flask db upgrade && flask creer-admin
+# (aucun accès à la base à l'import : chaque worker démarre sans requête)
 
 def _create_admin_if_needed():
     """Crée l'utilisateur admin si aucun User n'existe et que ADMIN_PASSWORD est défini."""
@@ -202,11 +1165,10 @@ def _create_admin_if_needed():
                 admin.set_password(pwd)
                 db.session.add(admin)
                 db.session.commit()
+                return True
     except Exception:
         db.session.rollback()
-
-with app.app_context():
-    _create_admin_if_needed()
+    return False
 
 # ========================
 #         ROUTES
@@ -241,6 +1203,69 @@ def logout():
     flash(_("Vous avez été déconnecté."), "info")
     return redirect(url_for('login'))
 
+def _saisie_float(saisies, cle):
+    """Valeur numérique saisie dans le formulaire, None si vide (0.0 si invalide)."""
+    raw = saisies.get(cle)
+    if raw in (None, ''):
+        return None
+    try:
+        return float(raw)
+    except ValueError:
+        return 0.0
+
+def cloturer_session(session_caisse, boisson_ids, date_debut, date_fin, saisies):
+    """
+    Crée les lignes de pointage d'une session sur [date_debut, date_fin] et calcule
+    l'attendu / l'écart. SI, ACHAT et P.U manquants sont lus pour toutes les boissons
+    en une requête ; les lignes sont insérées en un seul INSERT multi-lignes.
+    """
+    ids = []
+    for bid in boisson_ids:
+        try:
+            ids.append(int(bid))
+        except (TypeError, ValueError):
+            continue
+
+    auto = EntreeBoisson.pointage_auto(ids, date_debut, date_fin)
+
+    lignes = []
+    total_attendu = 0.0
+    for bid in ids:
+        si_auto, ach_auto, prix_snap = auto.get(bid, (0.0, 0.0, 0.0))
+
+        # 1) SI auto : dernier SF AVANT le début de période (si non saisi)
+        si = _saisie_float(saisies, f"stock_initial_{bid}")
+        if si is None:
+            si = si_auto
+
+        # 2) ACHAT auto : somme des entrées sur [date_debut, date_fin] si non saisi
+        ach = _saisie_float(saisies, f"entrees_{bid}")
+        if ach is None:
+            ach = ach_auto
+
+        # 3) SF : tel que saisi (sinon 0) — SF à la CLÔTURE de période
+        sf = _saisie_float(saisies, f"stock_final_{bid}") or 0.0
+
+        lignes.append(dict(
+            session_id=session_caisse.id,
+            boisson_id=bid,
+            stock_initial=si,
+            entrees=ach,
+            stock_final=sf,
+            prix_unitaire_snap=prix_snap
+        ))
+        total_attendu += max(0.0, si + ach - sf) * prix_snap
+
+    if lignes:
+        from sqlalchemy import insert
+        db.session.execute(insert(SessionLigne), lignes)
+
+    session_caisse.montant_attendu = total_attendu
+    session_caisse.ecart = session_caisse.montant_reel - total_attendu
+    enregistrer_agregats_session(session_caisse, lignes)
+    enregistrer_stock_session(session_caisse, lignes)
+    return lignes
+
 @app.route('/bar', methods=['GET', 'POST'])
 @login_required
 def pointage_bar():
@@ -291,59 +1316,9 @@ def pointage_bar():
         db.session.add(session)
         db.session.flush()
 
-        # Lignes de pointage
-        boisson_ids = request.form.getlist('boisson_ids')
-        total_attendu = 0.0
-
-        for bid in boisson_ids:
-            try:
-                bid_int = int(bid)
-            except (TypeError, ValueError):
-                continue
-
-            # 1) SI auto : dernier SF AVANT le début de période (si non saisi)
-            si_raw = request.form.get(f"stock_initial_{bid_int}")
-            if si_raw not in (None, ''):
-                try:
-                    si = float(si_raw)
-                except ValueError:
-                    si = 0.0
-            else:
-                si = EntreeBoisson.dernier_stock_final_avant(bid_int, date_debut)
-
-            # 2) ACHAT auto : somme des entrées sur [date_debut, date_fin] si non saisi
-            ach_raw = request.form.get(f"entrees_{bid_int}")
-            if ach_raw not in (None, ''):
-                try:
-                    ach = float(ach_raw)
-                except ValueError:
-                    ach = 0.0
-            else:
-                ach = EntreeBoisson.total_entrees_entre(bid_int, date_debut, date_fin)
-
-            # 3) SF : tel que saisi (sinon 0) — SF à la CLÔTURE de période
-            sf_raw = request.form.get(f"stock_final_{bid_int}")
-            try:
-                sf = float(sf_raw) if (sf_raw not in (None, '',)) else 0.0
-            except ValueError:
-                sf = 0.0
-
-            boisson = Boisson.query.get(bid_int)
-            prix_snap = boisson.prix_unitaire if boisson else 0.0
-
-            ligne = SessionLigne(
-                session_id=session.id,
-                boisson_id=bid_int,
-                stock_initial=si,
-                entrees=ach,
-                stock_final=sf,
-                prix_unitaire_snap=prix_snap
-            )
-            db.session.add(ligne)
-            total_attendu += ligne.montant_attendu_ligne
-
-        session.montant_attendu = total_attendu
-        session.ecart = session.montant_reel - total_attendu
+        # Lignes de pointage (SI / ACHAT auto calculés en lot)
+        cloturer_session(session, request.form.getlist('boisson_ids'),
+                         date_debut, date_fin, request.form)
 
         db.session.commit()
         flash(
@@ -366,18 +1341,28 @@ def pointage_bar():
     debut = datetime.fromisoformat(date_debut + ' 00:00')
     fin = datetime.fromisoformat(date_fin + ' 23:59')
 
-    requete = VenteBoisson.query.filter(VenteBoisson.date >= debut, VenteBoisson.date <= fin)
+    requete = (VenteBoisson.query
+               .options(joinedload(VenteBoisson.caissier), joinedload(VenteBoisson.boisson))
+               .filter(VenteBoisson.date >= debut, VenteBoisson.date <= fin))
     if caissier_id:
         requete = requete.filter(VenteBoisson.caissier_id == caissier_id)
     ventes_filtrees = requete.all()
 
     # Historique des sessions (bar)
-    page_sessions = request.args.get('page_sessions', 1, type=int)
-    sessions = SessionCaisse.query.order_by(SessionCaisse.date.desc()).paginate(page=page_sessions, per_page=20, error_out=False)
+    sessions = page_historique(SessionCaisse.query
+                               .options(joinedload(SessionCaisse.caissier),
+                                        selectinload(SessionCaisse.lignes).joinedload(SessionLigne.boisson)),
+                               SessionCaisse,
+                               apres=request.args.get('sessions_apres'), avant=request.args.get('sessions_avant'),
+                               total=total_approximatif(SessionCaisse))
+
+    # Stock théorique courant (registre) : dernier SF + livraisons depuis
+    stocks = {s.boisson_id: s for s in StockBoisson.query}
 
     return render_template(
         'bar.html',
         boissons=boissons,
+        stocks=stocks,
         caissiers=caissiers,
         ventes=ventes_filtrees,
         caissier_id=caissier_id,
@@ -410,11 +1395,29 @@ def modifier_boisson(id):
 @login_required
 def supprimer_boisson(id):
     boisson = Boisson.query.get_or_404(id)
+    StockBoisson.query.filter_by(boisson_id=boisson.id).delete()
     db.session.delete(boisson)
     db.session.commit()
     return redirect(url_for('pointage_bar'))
 
 # --- NOUVELLE PAGE : Livraisons / Entrées de boissons ---
+LivraisonsBoisson = namedtuple('LivraisonsBoisson', 'boisson_id nom nb quantite')
+
+def resume_livraisons(criteres):
+    """
+    Livraisons bar répondant à `criteres` (conditions sur EntreeBoisson), en une requête
+    groupée par boisson : [(boisson_id, nom, nb, quantite)] par nom, nombre de livraisons
+    et quantité totale (sommes des sous-totaux).
+    """
+    lignes = [LivraisonsBoisson(*l) for l in (
+        db.session.query(Boisson.id, Boisson.nom, func.count(EntreeBoisson.id),
+                         func.coalesce(func.sum(EntreeBoisson.quantite), 0.0))
+        .join(EntreeBoisson, EntreeBoisson.boisson_id == Boisson.id)
+        .filter(*criteres)
+        .group_by(Boisson.id, Boisson.nom)
+        .order_by(Boisson.nom))]
+    return lignes, sum(l.nb for l in lignes), float(sum(l.quantite for l in lignes))
+
 @app.route('/bar/entrees', methods=['GET', 'POST'])
 @login_required
 def entrees_boissons():
@@ -449,6 +1452,7 @@ def entrees_boissons():
             date=date_liv,
             note=note
         ))
+        enregistrer_stock_entree(boisson_id, date_liv, qte)
         db.session.commit()
         flash(_("Entrée enregistrée."), "success")
         return redirect(url_for('entrees_boissons'))
@@ -458,39 +1462,33 @@ def entrees_boissons():
     date_debut_str = request.args.get('date_debut', '')
     date_fin_str   = request.args.get('date_fin', '')
 
-    # Construire requête filtrée
-    q = EntreeBoisson.query
+    # Conditions du filtre, communes à la page et au résumé
+    criteres = []
 
     # Période
     try:
         if date_debut_str:
             d_deb = datetime.fromisoformat(date_debut_str).date()
-            q = q.filter(EntreeBoisson.date >= d_deb)
+            criteres.append(EntreeBoisson.date >= d_deb)
     except Exception:
         flash(_("Date de début invalide."), "warning")
 
     try:
         if date_fin_str:
             d_fin = datetime.fromisoformat(date_fin_str).date()
-            q = q.filter(EntreeBoisson.date <= d_fin)
+            criteres.append(EntreeBoisson.date <= d_fin)
     except Exception:
         flash(_("Date de fin invalide."), "warning")
 
     # Boisson
     if boisson_id_f:
-        q = q.filter(EntreeBoisson.boisson_id == boisson_id_f)
-
-    # Résultats
-    q = q.order_by(EntreeBoisson.date.desc(), EntreeBoisson.id.desc())
-    page = request.args.get('page', 1, type=int)
-    recent = q.paginate(page=page, per_page=20, error_out=False)
+        criteres.append(EntreeBoisson.boisson_id == boisson_id_f)
 
-    # Total filtré
-    total_filtre = (db.session.query(func.coalesce(func.sum(EntreeBoisson.quantite), 0.0))
-                    .filter(*(q._criterion,) if getattr(q, "_criterion", None) is not None else [])
-                    .scalar() if getattr(q, "_criterion", None) is not None else
-                    db.session.query(func.coalesce(func.sum(EntreeBoisson.quantite), 0.0)).scalar())
-    total_filtre = float(total_filtre or 0.0)
+    # Résultats : page de lignes, puis nombre, total et sous-totaux par boisson en une requête
+    recent = page_historique(EntreeBoisson.query.options(joinedload(EntreeBoisson.boisson)).filter(*criteres),
+                             EntreeBoisson,
+                             apres=request.args.get('apres'), avant=request.args.get('avant'))
+    par_boisson, nb_filtre, total_filtre = resume_livraisons(criteres)
 
     return render_template(
         'entrees.html',
@@ -499,144 +1497,433 @@ def entrees_boissons():
         boisson_id_f=boisson_id_f,
         date_debut=date_debut_str,
         date_fin=date_fin_str,
-        total_filtre=total_filtre
+        total_filtre=total_filtre,
+        nb_filtre=nb_filtre,
+        par_boisson=par_boisson
     )
 
 # --- Accueil / Rapports / Cuisine ---
 
-from flask import make_response  # déjà importé chez toi
-
-@app.route('/')
-@login_required
-def home():
-    # Période par défaut : les 30 derniers jours, journée entière
-    date_to = request.args.get('date_to', datetime.utcnow().date().isoformat())
-    date_from = request.args.get(
+def _lire_periode(args):
+    """
+    Période des rapports depuis la query string : par défaut les 30 derniers
+    jours, journée entière. Renvoie (date_from, date_to, heure_debut, heure_fin,
+    dt_from, dt_to).
+    """
+    date_to = args.get('date_to', datetime.utcnow().date().isoformat())
+    date_from = args.get(
         'date_from',
         (datetime.fromisoformat(date_to) - timedelta(days=30)).date().isoformat()
     )
-    heure_debut = request.args.get('heure_debut', '00:00')
-    heure_fin = request.args.get('heure_fin', '23:59')
-
-    # Fenêtre temporelle pour VENTES (cuisine) : datetimes
+    heure_debut = args.get('heure_debut', '00:00')
+    heure_fin = args.get('heure_fin', '23:59')
     dt_from = datetime.fromisoformat(f"{date_from} {heure_debut}")
-    dt_to   = datetime.fromisoformat(f"{date_to} {heure_fin}")
+    dt_to = datetime.fromisoformat(f"{date_to} {heure_fin}")
+    # Forme canonique (clés de cache, noms de fichiers)
+    date_from, heure_debut = dt_from.date().isoformat(), dt_from.strftime('%H:%M')
+    date_to, heure_fin = dt_to.date().isoformat(), dt_to.strftime('%H:%M')
+    return date_from, date_to, heure_debut, heure_fin, dt_from, dt_to
+
+# Nombre de lignes par page dans les panneaux « Détails par période »
+LIGNES_PAR_PAGE_DASHBOARD = 100
+
+def _curseur(ligne):
+    """Curseur de pagination (date, id) d'une ligne : '2025-08-01T12:30:00_42'."""
+    return f"{ligne.date.isoformat()}_{ligne.id}"
+
+def _lire_curseur(curseur):
+    """(date, id) depuis un curseur, None s'il est absent ou invalide."""
+    if not curseur:
+        return None
+    try:
+        d, i = curseur.rsplit('_', 1)
+        return datetime.fromisoformat(d), int(i)
+    except ValueError:
+        return None
 
-    # ---- KPIs globaux (existant) ----
-    count_ingredients = Ingredient.query.count()
-    count_recettes = Recette.query.count()
-    total_stock_cuisine = db.session.query(func.sum(Ingredient.stock_cuisine)).scalar() or 0
+def page_keyset(modele, relation, dt_from, dt_to, apres=None, limite=LIGNES_PAR_PAGE_DASHBOARD):
+    """
+    Lignes de `modele` sur [dt_from, dt_to], des plus récentes aux plus anciennes,
+    `relation` chargée par jointure. Pagination par curseur (date, id) : le coût
+    ne dépend pas de la largeur de la période. Renvoie (lignes, curseur_suivant).
+    """
+    from sqlalchemy import and_, or_
+
+    q = (modele.query
+         .options(joinedload(relation))
+         .filter(modele.date >= dt_from, modele.date <= dt_to))
+    position = _lire_curseur(apres)
+    if position:
+        d, i = position
+        q = q.filter(or_(modele.date < d, and_(modele.date == d, modele.id < i)))
+    lignes = q.order_by(modele.date.desc(), modele.id.desc()).limit(limite + 1).all()
+    suivant = _curseur(lignes[limite - 1]) if len(lignes) > limite else None
+    return lignes[:limite], suivant
+
+# Lignes par page des historiques (transferts, livraisons bar, sessions de caisse)
+LIGNES_PAR_PAGE_HISTORIQUE = 20
+
+PageHistorique = namedtuple('PageHistorique', 'items suivant precedent total')
+
+def page_historique(requete, modele, apres=None, avant=None, total=None,
+                    par_page=LIGNES_PAR_PAGE_HISTORIQUE):
+    """
+    Page de `requete` (lignes de `modele`, filtres et options déjà posés, sans tri),
+    des plus récentes aux plus anciennes. Pagination par curseur (date, id) dans les
+    deux sens : `apres` donne la page suivante, `avant` la précédente. Ni COUNT ni
+    OFFSET : la page 500 coûte comme la première.
+    """
+    from sqlalchemy import or_
+
+    position = _lire_curseur(avant or apres)
+    if position and modele.date.type.python_type is not datetime:
+        # Colonne Date : comparer une date, pas un horodatage (texte sous SQLite)
+        position = position[0].date(), position[1]
+
+    if position and avant:
+        d, i = position
+        lignes = (requete.filter(modele.date >= d, or_(modele.date > d, modele.id > i))
+                  .order_by(modele.date.asc(), modele.id.asc())
+                  .limit(par_page + 1).all())
+        if len(lignes) <= par_page:
+            # Retour en tête : première page complète (et lignes arrivées depuis)
+            return page_historique(requete, modele, total=total, par_page=par_page)
+        lignes = lignes[:par_page][::-1]
+        return PageHistorique(lignes, _curseur(lignes[-1]), _curseur(lignes[0]), total)
+
+    if position:
+        d, i = position
+        requete = requete.filter(modele.date <= d, or_(modele.date < d, modele.id < i))
+    lignes = (requete.order_by(modele.date.desc(), modele.id.desc())
+              .limit(par_page + 1).all())
+    suivant = _curseur(lignes[par_page - 1]) if len(lignes) > par_page else None
+    lignes = lignes[:par_page]
+    precedent = _curseur(lignes[0]) if position and lignes else None
+    return PageHistorique(lignes, suivant, precedent, total)
+
+def total_approximatif(modele):
+    """
+    Nombre approximatif de lignes de `modele`, sans COUNT(*) : statistiques du
+    planificateur sous PostgreSQL, étendue des id sous SQLite (lignes supprimées comprises).
+    """
+    if db.engine.dialect.name == 'postgresql':
+        n = db.session.execute(db.text("SELECT reltuples FROM pg_class WHERE oid = CAST(:t AS regclass)"),
+                               {'t': modele.__tablename__}).scalar()
+        if n and n > 0:     # -1 avant le premier ANALYZE
+            return int(n)
+    # min() et max() dans deux sous-requêtes : une lecture d'index chacune
+    plus_petit = db.session.query(func.min(modele.id)).scalar_subquery()
+    plus_grand = db.session.query(func.max(modele.id)).scalar_subquery()
+    return db.session.query(func.coalesce(plus_grand - plus_petit + 1, 0)).scalar()
+
+def _ventes_recettes_periode(dt_from, dt_to):
+    """
+    Sous-requête (recette_id, quantite) couvrant exactement [dt_from, dt_to].
+    Les jours entiers viennent de AgregatVenteJour, les heures entières des bords
+    de AgregatVenteHeure ; seules les minutes restantes sont lues dans Vente.
+    """
+    from sqlalchemy import select, union_all, and_, or_
 
-    # ---- Vue CUISINE : top plats vendus (quantités) ----
-    # SUM(Vente.quantite) groupé par recette dans la fenêtre [dt_from, dt_to]
-    top_recettes = (
-        db.session.query(
-            Recette.nom.label('recette'),
-            func.coalesce(func.sum(Vente.quantite), 0).label('qte')
+    def brut(debut, fin, fin_incluse):
+        borne = Vente.date <= fin if fin_incluse else Vente.date < fin
+        return select(Vente.recette_id, Vente.quantite).where(Vente.date >= debut, borne)
+
+    def heures(debut, fin):
+        t = AgregatVenteHeure
+        return select(t.recette_id, t.quantite).where(
+            or_(t.jour > debut.date(), and_(t.jour == debut.date(), t.heure >= debut.hour)),
+            or_(t.jour < fin.date(), and_(t.jour == fin.date(), t.heure < fin.hour)),
         )
-        .join(Recette, Recette.id == Vente.recette_id)
-        .filter(Vente.date >= dt_from, Vente.date <= dt_to)
+
+    def jours(debut, fin):
+        t = AgregatVenteJour
+        return select(t.recette_id, t.quantite).where(t.jour >= debut.date(), t.jour < fin.date())
+
+    h_lo = dt_from.replace(minute=0, second=0, microsecond=0)
+    if h_lo < dt_from:
+        h_lo += timedelta(hours=1)
+    h_hi = dt_to.replace(minute=0, second=0, microsecond=0)
+
+    if h_lo >= h_hi:
+        parts = [brut(dt_from, dt_to, True)]
+    else:
+        parts = [brut(dt_from, h_lo, False), brut(h_hi, dt_to, True)]
+        d_lo = datetime.combine(h_lo.date(), datetime.min.time())
+        if d_lo < h_lo:
+            d_lo += timedelta(days=1)
+        d_hi = datetime.combine(h_hi.date(), datetime.min.time())
+        if d_lo < d_hi:
+            parts += [heures(h_lo, d_lo), jours(d_lo, d_hi), heures(d_hi, h_hi)]
+        else:
+            parts.append(heures(h_lo, h_hi))
+    return union_all(*parts).subquery()
+
+def top_recettes_periode(dt_from, dt_to):
+    """Quantités vendues par recette sur [dt_from, dt_to], plus vendues d'abord."""
+    v = _ventes_recettes_periode(dt_from, dt_to)
+    qte = func.coalesce(func.sum(v.c.quantite), 0)
+    return (
+        db.session.query(Recette.nom.label('recette'), qte.label('qte'))
+        .join(Recette, Recette.id == v.c.recette_id)
         .group_by(Recette.nom)
-        .order_by(func.coalesce(func.sum(Vente.quantite), 0).desc())
+        .order_by(qte.desc())
         .all()
     )
-    # Transforme en listes simples pour le graph/table
-    recettes_labels = [r.recette for r in top_recettes]
-    recettes_qtes = [float(r.qte or 0) for r in top_recettes]
 
-    # ---- Vue CAISSE (BAR) : top boissons vendues ----
-    # On somme (SI + ACHAT - SF) par boisson sur la période, côté SessionCaisse.date
-    top_boissons = (
+def top_boissons_periode(d_from, d_to):
+    """Quantités (SI + ACHAT - SF) et montants par boisson, sessions closes entre d_from et d_to."""
+    qte = func.coalesce(func.sum(AgregatBoissonJour.quantite), 0)
+    return (
         db.session.query(
             Boisson.nom.label('boisson'),
-            func.coalesce(func.sum(SessionLigne.stock_initial + SessionLigne.entrees - SessionLigne.stock_final), 0).label('qte_vendue'),
-            func.coalesce(func.sum((SessionLigne.stock_initial + SessionLigne.entrees - SessionLigne.stock_final) * SessionLigne.prix_unitaire_snap), 0).label('montant')
+            qte.label('qte_vendue'),
+            func.coalesce(func.sum(AgregatBoissonJour.montant), 0).label('montant')
         )
-        .join(SessionCaisse, SessionCaisse.id == SessionLigne.session_id)
-        .join(Boisson, Boisson.id == SessionLigne.boisson_id)
-        .filter(SessionCaisse.date >= datetime.fromisoformat(date_from).date(),
-                SessionCaisse.date <= datetime.fromisoformat(date_to).date())
+        .join(Boisson, Boisson.id == AgregatBoissonJour.boisson_id)
+        .filter(AgregatBoissonJour.jour >= d_from, AgregatBoissonJour.jour <= d_to)
         .group_by(Boisson.nom)
-        .order_by(func.coalesce(func.sum(SessionLigne.stock_initial + SessionLigne.entrees - SessionLigne.stock_final), 0).desc())
+        .order_by(qte.desc())
         .all()
     )
-    boissons_labels = [b.boisson for b in top_boissons]
-    boissons_qtes = [float(b.qte_vendue or 0) for b in top_boissons]
 
-    # Données existantes si tu veux les réutiliser dans la page
-    ventes_mois = Vente.query.filter(Vente.date >= dt_from, Vente.date <= dt_to).all()
-    transferts_mois = HistoriqueTransfert.query.filter(HistoriqueTransfert.date >= dt_from, HistoriqueTransfert.date <= dt_to).all()
+from flask import make_response  # déjà importé chez toi
 
-    # Alertes stock : ingrédients sous leur seuil d'alerte
-    alertes = Ingredient.query.filter(
-        Ingredient.seuil_alerte.isnot(None),
-        Ingredient.stock_cuisine < Ingredient.seuil_alerte
-    ).order_by(Ingredient.nom.asc()).all()
+# Domaines lus par les KPIs, les graphiques et les alertes du tableau de bord
+DOMAINES_TABLEAU_DE_BORD = ('ventes', 'recettes', 'ingredients', 'bar', CLE_ALERTES)
 
-    return render_template(
-        'home.html',
-        # Filtres
-        date_from=date_from, date_to=date_to,
-        heure_debut=heure_debut, heure_fin=heure_fin,
+def donnees_tableau_de_bord(date_from, date_to, dt_from, dt_to):
+    """KPIs, séries des graphiques et alertes stock de la période (page d'accueil et API JSON)."""
+    # ---- KPIs globaux (existant) ----
+    count_ingredients = Ingredient.query.count()
+    count_recettes = Recette.query.count()
+    total_stock_cuisine = db.session.query(func.sum(Ingredient.stock_cuisine)).scalar() or 0
+
+    # ---- Vue CUISINE : top plats vendus (quantités) ----
+    # SUM(quantite) groupé par recette dans la fenêtre [dt_from, dt_to] (agrégats)
+    top_recettes = top_recettes_periode(dt_from, dt_to)
+
+    # ---- Vue CAISSE (BAR) : top boissons vendues ----
+    # On somme (SI + ACHAT - SF) par boisson sur la période, côté SessionCaisse.date
+    top_boissons = top_boissons_periode(datetime.fromisoformat(date_from).date(),
+                                        datetime.fromisoformat(date_to).date())
+
+    return dict(
         # KPIs globaux
         count_ingredients=count_ingredients,
         count_recettes=count_recettes,
         total_stock_cuisine=total_stock_cuisine,
-        # Cuisine (plats)
-        recettes_labels=recettes_labels,
-        recettes_qtes=recettes_qtes,
+        # Cuisine (plats) : listes simples pour le graph/table
         top_recettes=top_recettes,
+        recettes_labels=[r.recette for r in top_recettes],
+        recettes_qtes=[float(r.qte or 0) for r in top_recettes],
         # Bar (boissons)
-        boissons_labels=boissons_labels,
-        boissons_qtes=boissons_qtes,
         top_boissons=top_boissons,
-        # Données brutes (si besoin ailleurs)
+        boissons_labels=[b.boisson for b in top_boissons],
+        boissons_qtes=[float(b.qte_vendue or 0) for b in top_boissons],
+        # Alertes stock : ingrédients sous leur seuil d'alerte (cache partagé avec le badge)
+        alertes=alertes_stock(),
+    )
+
+@app.route('/')
+@login_required
+def home():
+    # Période par défaut : les 30 derniers jours, journée entière
+    date_from, date_to, heure_debut, heure_fin, dt_from, dt_to = _lire_periode(request.args)
+
+    # KPIs, graphiques, alertes (mêmes données que /api/dashboard)
+    donnees = donnees_tableau_de_bord(date_from, date_to, dt_from, dt_to)
+
+    # Détails par période : première page seulement (suite via /dashboard/ventes|transferts)
+    ventes_mois, ventes_suivant = page_keyset(Vente, Vente.recette, dt_from, dt_to)
+    transferts_mois, transferts_suivant = page_keyset(
+        HistoriqueTransfert, HistoriqueTransfert.ingredient, dt_from, dt_to)
+
+    # Prévisions : ingrédients consommés dont le stock cuisine s'épuise le plus tôt
+    previsions = [p for p in previsions_stock() if p.jours_cuisine is not None][:PREVISIONS_TABLEAU_DE_BORD]
+
+    return render_template(
+        'home.html',
+        # Filtres
+        date_from=date_from, date_to=date_to,
+        heure_debut=heure_debut, heure_fin=heure_fin,
+        # KPIs, cuisine (plats), bar (boissons), alertes stock
+        **donnees,
+        # Détails (première page, plus récents d'abord)
         ventes_mois=ventes_mois,
+        ventes_suivant=ventes_suivant,
         transferts_mois=transferts_mois,
+        transferts_suivant=transferts_suivant,
         current_time=datetime.utcnow(),
-        # Alertes stock
-        alertes=alertes
+        # Prévisions de rupture
+        previsions=previsions,
+        prevision_jours_historique=PREVISION_JOURS_HISTORIQUE,
     )
 
+def reponse_json_conditionnelle(domaines, params, construire):
+    """
+    Réponse JSON `construire()` avec ETag (versions des domaines lus + paramètres) et
+    Last-Modified (dernière écriture sur ces domaines) : une requête conditionnelle sans
+    changement répond 304 après une seule lecture de version_cache, sans rien recalculer.
+    """
+    from werkzeug.http import is_resource_modified
+
+    versions, modifie_le = etat_caches(*domaines)
+    etag = empreinte_donnees(versions, params)
+    # Les périodes par défaut glissent à minuit : Last-Modified jamais antérieur au début du jour
+    debut_du_jour = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    derniere_modif = max(modifie_le or debut_du_jour, debut_du_jour)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=derniere_modif):
+        response = make_response('', 304)
+    else:
+        response = make_response(construire())
+    response.set_etag(etag)
+    response.last_modified = derniere_modif
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/api/dashboard')
+@login_required
+def api_dashboard():
+    """KPIs, séries des graphiques et alertes de la période (JSON), sans recharger la page."""
+    date_from, date_to, heure_debut, heure_fin, dt_from, dt_to = _lire_periode(request.args)
+    periode = dict(date_from=date_from, date_to=date_to, heure_debut=heure_debut, heure_fin=heure_fin)
+
+    def construire():
+        d = donnees_tableau_de_bord(date_from, date_to, dt_from, dt_to)
+        return {
+            'periode': periode,
+            'kpis': dict(ingredients=d['count_ingredients'], recettes=d['count_recettes'],
+                         stock_cuisine=float(d['total_stock_cuisine'])),
+            'recettes': dict(labels=d['recettes_labels'], qtes=d['recettes_qtes']),
+            'boissons': dict(labels=d['boissons_labels'], qtes=d['boissons_qtes'],
+                             montants=[float(b.montant or 0) for b in d['top_boissons']]),
+            'alertes': [a._asdict() for a in d['alertes']],
+        }
+
+    return reponse_json_conditionnelle(DOMAINES_TABLEAU_DE_BORD, periode, construire)
+
+# --- Fréquentation : ventes par heure × jour de semaine et par semaine (agrégats, en SQL) ---
+
+def _jour_semaine(colonne):
+    """Expression SQL : jour de semaine d'une colonne Date, 0 = dimanche (SQLite et PostgreSQL)."""
+    from sqlalchemy import extract
+
+    if db.engine.dialect.name == 'postgresql':
+        return func.cast(extract('dow', colonne), db.Integer)
+    return func.cast(func.strftime('%w', colonne), db.Integer)
+
+def frequentation(d_from, d_to):
+    """
+    Fréquentation de [d_from, d_to] en tableaux compacts, lundi = 0 : portions vendues par
+    jour de semaine × heure (7 × 24), par semaine, pointages bar par jour de semaine, et
+    nombre de chaque jour de semaine dans la période (moyennes). Groupement en base sur les
+    agrégats, d'abord par jour (ordre de l'index) puis par jour de semaine : le calcul du
+    jour de semaine porte sur quelques milliers de lignes, pas sur chaque vente.
+    """
+    from sqlalchemy import select
+
+    h = AgregatVenteHeure
+    par_heure = (select(h.jour, h.heure, func.sum(h.quantite).label('quantite'))
+                 .where(h.jour >= d_from, h.jour <= d_to)
+                 .group_by(h.jour, h.heure)
+                 .subquery())
+    grille = [[0] * 24 for _ in range(7)]
+    for jour_semaine, heure, quantite in db.session.execute(
+            select(_jour_semaine(par_heure.c.jour).label('jour_semaine'), par_heure.c.heure,
+                   func.sum(par_heure.c.quantite))
+            .group_by('jour_semaine', par_heure.c.heure)):
+        grille[(jour_semaine + 6) % 7][heure] = int(quantite)
+
+    v = AgregatVenteJour
+    par_jour = (select(v.jour, func.sum(v.quantite).label('quantite'))
+                .where(v.jour >= d_from, v.jour <= d_to)
+                .group_by(v.jour)
+                .subquery())
+    semaines = db.session.execute(
+        select(_debut_periode(par_jour.c.jour, 'semaine').label('semaine'), func.sum(par_jour.c.quantite))
+        .group_by('semaine')
+        .order_by('semaine')).all()
+
+    b = AgregatBoissonJour
+    bar_jour = (select(b.jour, func.sum(b.quantite).label('quantite'), func.sum(b.montant).label('montant'))
+                .where(b.jour >= d_from, b.jour <= d_to)
+                .group_by(b.jour)
+                .subquery())
+    bar_qtes, bar_montants = [0.0] * 7, [0.0] * 7
+    for jour_semaine, quantite, montant in db.session.execute(
+            select(_jour_semaine(bar_jour.c.jour).label('jour_semaine'),
+                   func.sum(bar_jour.c.quantite), func.sum(bar_jour.c.montant))
+            .group_by('jour_semaine')):
+        bar_qtes[(jour_semaine + 6) % 7] = round(float(quantite or 0), 2)
+        bar_montants[(jour_semaine + 6) % 7] = round(float(montant or 0), 2)
+
+    # Occurrences de chaque jour de semaine dans la période
+    nb_jours = [0] * 7
+    total = (d_to - d_from).days + 1
+    for i in range(min(total, 7)):
+        nb_jours[(d_from + timedelta(days=i)).weekday()] = (total - i + 6) // 7
+
+    return {
+        'ventes_heure': grille,
+        'semaines': dict(debuts=[str(s) for s, _q in semaines], qtes=[int(q) for _s, q in semaines]),
+        'bar_jour': dict(qtes=bar_qtes, montants=bar_montants),
+        'nb_jours': nb_jours,
+    }
+
+@app.route('/api/dashboard/frequentation')
+@login_required
+def api_frequentation():
+    """Fréquentation de la période (jours entiers) pour la carte de chaleur du tableau de bord (JSON)."""
+    date_from, date_to = _lire_periode(request.args)[:2]
+    periode = dict(date_from=date_from, date_to=date_to)
+    return reponse_json_conditionnelle(
+        ('ventes', 'bar'), periode,
+        lambda: dict(periode=periode, **frequentation(datetime.fromisoformat(date_from).date(),
+                                                       datetime.fromisoformat(date_to).date())))
+
+@app.route('/dashboard/ventes')
+@login_required
+def dashboard_ventes():
+    """Page suivante des ventes de la période (JSON, bouton « Charger plus »)."""
+    dt_from, dt_to = _lire_periode(request.args)[-2:]
+    ventes, suivant = page_keyset(Vente, Vente.recette, dt_from, dt_to, request.args.get('apres'))
+    return {
+        'lignes': [dict(date=v.date.strftime('%Y-%m-%d %H:%M'), recette=v.recette.nom if v.recette else '',
+                        quantite=v.quantite) for v in ventes],
+        'suivant': suivant,
+    }
+
+@app.route('/dashboard/transferts')
+@login_required
+def dashboard_transferts():
+    """Page suivante des transferts de la période (JSON, bouton « Charger plus »)."""
+    dt_from, dt_to = _lire_periode(request.args)[-2:]
+    transferts, suivant = page_keyset(HistoriqueTransfert, HistoriqueTransfert.ingredient,
+                                      dt_from, dt_to, request.args.get('apres'))
+    return {
+        'lignes': [dict(date=t.date.strftime('%Y-%m-%d %H:%M'), ingredient=t.ingredient.nom if t.ingredient else '',
+                        quantite=t.quantite, unite=t.unite,
+                        sens=_('Magasin → Cuisine') if t.sens == 'magasin_vers_cuisine' else _('Cuisine → Magasin'))
+                   for t in transferts],
+        'suivant': suivant,
+    }
 
 @app.route('/export/cuisine.csv')
 @login_required
 def export_cuisine_csv():
     """Export CSV du point Cuisine (ventes par recette) sur une période."""
-    date_to = request.args.get('date_to', datetime.utcnow().date().isoformat())
-    date_from = request.args.get(
-        'date_from',
-        (datetime.fromisoformat(date_to) - timedelta(days=30)).date().isoformat()
-    )
-    heure_debut = request.args.get('heure_debut', '00:00')
-    heure_fin = request.args.get('heure_fin', '23:59')
-
-    dt_from = datetime.fromisoformat(f"{date_from} {heure_debut}")
-    dt_to   = datetime.fromisoformat(f"{date_to} {heure_fin}")
+    date_from, date_to, heure_debut, heure_fin, dt_from, dt_to = _lire_periode(request.args)
+    cle = cle_rapport(('ventes', 'recettes'), date_from=date_from, date_to=date_to,
+                      heure_debut=heure_debut, heure_fin=heure_fin)
 
-    rows = (
-        db.session.query(
-            Recette.nom.label('recette'),
-            func.coalesce(func.sum(Vente.quantite), 0).label('quantite')
-        )
-        .join(Recette, Recette.id == Vente.recette_id)
-        .filter(Vente.date >= dt_from, Vente.date <= dt_to)
-        .group_by(Recette.nom)
-        .order_by(func.coalesce(func.sum(Vente.quantite), 0).desc())
-        .all()
-    )
+    def lignes():
+        for r in top_recettes_periode(dt_from, dt_to):
+            yield [r.recette, int(r.qte or 0), f"{date_from} -> {date_to}", heure_debut, heure_fin]
 
-    # Génération CSV en mémoire
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Recette", "Quantité vendue", "Période", "Heure début", "Heure fin"])
-    for r in rows:
-        writer.writerow([r.recette, int(r.quantite or 0), f"{date_from} -> {date_to}", heure_debut, heure_fin])
-
-    resp = make_response(output.getvalue())
-    resp.headers["Content-Type"] = "text/csv; charset=utf-8"
-    resp.headers["Content-Disposition"] = f"attachment; filename=point_cuisine_{date_from}_to_{date_to}.csv"
-    return resp
+    return _reponse_csv(cle, f"point_cuisine_{date_from}_to_{date_to}.csv",
+                        ["Recette", "Quantité vendue", "Période", "Heure début", "Heure fin"], lignes())
 
 @app.route('/export/bar.csv')
 @login_required
@@ -650,34 +1937,217 @@ def export_bar_csv():
         'date_from',
         (datetime.fromisoformat(date_to) - timedelta(days=30)).date().isoformat()
     )
+    date_from = datetime.fromisoformat(date_from).date().isoformat()
+    date_to = datetime.fromisoformat(date_to).date().isoformat()
 
-    # Agrégat sur SessionCaisse.date (par jour de clôture de période)
-    rows = (
-        db.session.query(
-            Boisson.nom.label('boisson'),
-            func.coalesce(func.sum(SessionLigne.stock_initial + SessionLigne.entrees - SessionLigne.stock_final), 0).label('quantite'),
-            func.coalesce(func.sum((SessionLigne.stock_initial + SessionLigne.entrees - SessionLigne.stock_final) * SessionLigne.prix_unitaire_snap), 0).label('montant')
-        )
-        .join(SessionCaisse, SessionCaisse.id == SessionLigne.session_id)
-        .join(Boisson, Boisson.id == SessionLigne.boisson_id)
-        .filter(SessionCaisse.date >= datetime.fromisoformat(date_from).date(),
-                SessionCaisse.date <= datetime.fromisoformat(date_to).date())
-        .group_by(Boisson.nom)
-        .order_by(func.coalesce(func.sum(SessionLigne.stock_initial + SessionLigne.entrees - SessionLigne.stock_final), 0).desc())
-        .all()
+    cle = cle_rapport(('bar',), date_from=date_from, date_to=date_to)
+
+    def lignes():
+        # Agrégat sur SessionCaisse.date (par jour de clôture de période)
+        for r in top_boissons_periode(datetime.fromisoformat(date_from).date(),
+                                      datetime.fromisoformat(date_to).date()):
+            yield [r.boisson, f"{float(r.qte_vendue or 0):.2f}", f"{float(r.montant or 0):.2f}", f"{date_from} -> {date_to}"]
+
+    return _reponse_csv(cle, f"point_boissons_{date_from}_to_{date_to}.csv",
+                        ["Boisson", "Quantité vendue", "Montant (F)", "Période"], lignes())
+
+@app.route('/export/previsions.csv')
+@login_required
+def export_previsions_csv():
+    """Export CSV des prévisions de stock (jours de couverture) de tous les ingrédients."""
+    aujourdhui = datetime.utcnow().date()
+    cle = cle_rapport(('ventes', 'recettes', 'ingredients'), jour=aujourdhui.isoformat())
+
+    def lignes():
+        for p in previsions_stock(aujourdhui):
+            yield [p.nom, p.unite, f"{p.stock_cuisine:.2f}", f"{p.stock_magasin:.2f}", f"{p.conso_jour:.3f}",
+                   '' if p.jours_cuisine is None else p.jours_cuisine,
+                   p.rupture_cuisine.isoformat() if p.rupture_cuisine else '',
+                   '' if p.jours_total is None else p.jours_total]
+
+    return _reponse_csv(cle, f"previsions_stock_{aujourdhui.isoformat()}.csv",
+                        ["Ingrédient", "Unité", "Stock cuisine", "Stock magasin", "Consommation / jour",
+                         "Jours de couverture cuisine", "Rupture cuisine", "Jours de couverture cuisine + magasin"],
+                        lignes())
+
+
+# --- Rapprochement : consommation théorique (ventes × fiches techniques) / sorties du magasin ---
+
+# Écart relatif au-delà duquel une ligne est signalée (perte, gaspillage, fiche technique à revoir)
+RAPPROCHEMENT_TOLERANCE = 0.10
+GRANULARITES_RAPPROCHEMENT = ('semaine', 'jour')
+
+Rapprochement = namedtuple('Rapprochement', 'periode ingredient_id nom unite theorique transfere '
+                                            'ecart ecart_relatif signale')
+
+def _debut_periode(colonne, granularite):
+    """Expression SQL : jour (ou lundi de la semaine) d'une colonne Date / DateTime."""
+    if db.engine.dialect.name == 'postgresql':
+        return func.cast(func.date_trunc('week' if granularite == 'semaine' else 'day', colonne), db.Date)
+    if granularite == 'semaine':
+        return func.date(colonne, 'weekday 0', '-6 days')
+    return func.date(colonne)
+
+def _rapprocher(periode, ingredient_id, nom, unite, theorique, transfere):
+    theorique, transfere = float(theorique or 0), float(transfere or 0)
+    ecart = transfere - theorique
+    relatif = ecart / theorique if theorique else None
+    signale = abs(ecart) > RAPPROCHEMENT_TOLERANCE * theorique if theorique else abs(ecart) > 1e-9
+    return Rapprochement(periode, ingredient_id, nom, unite, theorique, transfere, ecart, relatif, signale)
+
+def rapprochement_consommation(d_from, d_to, granularite='semaine'):
+    """
+    Rapprochement par ingrédient et par jour / semaine sur [d_from, d_to], en une requête :
+    consommation théorique = Σ ventes du jour (AgregatVenteJour) × quantité de la fiche
+    technique, comparée aux transferts nets magasin → cuisine (HistoriqueTransfert).
+    Écart > 0 : plus de marchandise sortie que les ventes n'en justifient.
+    """
+    from sqlalchemy import select, union_all, literal, case
+
+    agr, fiche, tr = AgregatVenteJour, FicheAplatie, HistoriqueTransfert
+    # Portions vendues par recette et par période d'abord : la jointure aux fiches porte
+    # sur (périodes × recettes) lignes, pas sur (jours × recettes)
+    portions = (select(agr.recette_id, _debut_periode(agr.jour, granularite).label('periode'),
+                       func.sum(agr.quantite).label('quantite'))
+                .where(agr.jour >= d_from, agr.jour <= d_to)
+                .group_by(agr.recette_id, 'periode')
+                .subquery())
+    theorique = (select(fiche.ingredient_id, portions.c.periode,
+                        (portions.c.quantite * fiche.quantite).label('theorique'), literal(0.0).label('transfere'))
+                 .join(fiche, fiche.recette_id == portions.c.recette_id))
+    transferts = (select(tr.ingredient_id, _debut_periode(tr.date, granularite).label('periode'), literal(0.0),
+                         func.sum(case((tr.sens == 'magasin_vers_cuisine', tr.quantite), else_=-tr.quantite)))
+                  .where(tr.date >= datetime.combine(d_from, datetime.min.time()),
+                         tr.date < datetime.combine(d_to + timedelta(days=1), datetime.min.time()))
+                  .group_by(tr.ingredient_id, 'periode'))
+    mouvements = union_all(theorique, transferts).subquery()
+    lignes = db.session.execute(
+        select(mouvements.c.periode, Ingredient.id, Ingredient.nom, Ingredient.unite,
+               func.sum(mouvements.c.theorique), func.sum(mouvements.c.transfere))
+        .join(Ingredient, Ingredient.id == mouvements.c.ingredient_id)
+        .group_by(mouvements.c.periode, Ingredient.id, Ingredient.nom, Ingredient.unite)
+        .order_by(mouvements.c.periode, Ingredient.nom)
+    )
+    # Date (PostgreSQL) ou texte ISO (SQLite)
+    return [_rapprocher(str(p), *reste) for p, *reste in lignes]
+
+def totaux_rapprochement(lignes):
+    """Une ligne par ingrédient sur toute la période, plus grands écarts (en valeur absolue) d'abord."""
+    totaux = {}
+    for l in lignes:
+        t = totaux.setdefault(l.ingredient_id, [l.nom, l.unite, 0.0, 0.0])
+        t[2] += l.theorique
+        t[3] += l.transfere
+    return sorted((_rapprocher(None, i, *t) for i, t in totaux.items()), key=lambda l: (-abs(l.ecart), l.nom))
+
+def _lire_rapprochement(args):
+    """(date_from, date_to, granularite) : période des rapports (jours entiers), semaine par défaut."""
+    date_from, date_to = _lire_periode(args)[:2]
+    granularite = args.get('granularite')
+    if granularite not in GRANULARITES_RAPPROCHEMENT:
+        granularite = GRANULARITES_RAPPROCHEMENT[0]
+    return date_from, date_to, granularite
+
+@app.route('/rapport/rapprochement')
+@login_required
+def rapport_rapprochement():
+    """Consommation théorique des ventes / transferts nets par ingrédient, écarts signalés."""
+    date_from, date_to, granularite = _lire_rapprochement(request.args)
+    lignes = rapprochement_consommation(datetime.fromisoformat(date_from).date(),
+                                        datetime.fromisoformat(date_to).date(), granularite)
+    return render_template(
+        'rapprochement.html',
+        date_from=date_from, date_to=date_to, granularite=granularite,
+        totaux=totaux_rapprochement(lignes),
+        signalees=[l for l in lignes if l.signale],
+        tolerance=RAPPROCHEMENT_TOLERANCE,
+        current_time=datetime.utcnow(),
     )
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Boisson", "Quantité vendue", "Montant (F)", "Période"])
-    for r in rows:
-        writer.writerow([r.boisson, f"{float(r.quantite or 0):.2f}", f"{float(r.montant or 0):.2f}", f"{date_from} -> {date_to}"])
+@app.route('/export/rapprochement.csv')
+@login_required
+def export_rapprochement_csv():
+    """Export CSV du rapprochement, une ligne par ingrédient et par jour / semaine."""
+    date_from, date_to, granularite = _lire_rapprochement(request.args)
+    cle = cle_rapport(('ventes', 'recettes', 'transferts'), date_from=date_from, date_to=date_to,
+                      granularite=granularite)
+
+    def lignes():
+        for l in rapprochement_consommation(datetime.fromisoformat(date_from).date(),
+                                            datetime.fromisoformat(date_to).date(), granularite):
+            yield [l.periode, l.nom, l.unite, f"{l.theorique:.3f}", f"{l.transfere:.3f}", f"{l.ecart:.3f}",
+                   '' if l.ecart_relatif is None else f"{l.ecart_relatif * 100:.1f}", 'oui' if l.signale else '']
+
+    return _reponse_csv(cle, f"rapprochement_{granularite}_{date_from}_to_{date_to}.csv",
+                        ["Période", "Ingrédient", "Unité", "Consommation théorique", "Transferts nets",
+                         "Écart", "Écart (%)", "Signalé"], lignes())
+
+
+# --- Exports bruts (ligne à ligne) pour la comptabilité ---
+
+def _brut_ventes(dt_from, dt_to):
+    return (db.select(Vente.id, Vente.date, Recette.nom, Vente.quantite)
+            .outerjoin(Recette, Recette.id == Vente.recette_id)
+            .where(Vente.date >= dt_from, Vente.date <= dt_to)
+            .order_by(Vente.date, Vente.id))
+
+def _brut_transferts(dt_from, dt_to):
+    t = HistoriqueTransfert
+    return (db.select(t.id, t.date, Ingredient.nom, t.quantite, t.unite, t.sens)
+            .outerjoin(Ingredient, Ingredient.id == t.ingredient_id)
+            .where(t.date >= dt_from, t.date <= dt_to)
+            .order_by(t.date, t.id))
+
+def _brut_sessions(dt_from, dt_to):
+    l = SessionLigne
+    vendu = l.stock_initial + l.entrees - l.stock_final
+    return (db.select(SessionCaisse.date, SessionCaisse.id, Caissier.nom, Boisson.nom,
+                   l.stock_initial, l.entrees, l.stock_final, vendu,
+                   l.prix_unitaire_snap, vendu * l.prix_unitaire_snap)
+            .join(SessionCaisse, SessionCaisse.id == l.session_id)
+            .outerjoin(Caissier, Caissier.id == SessionCaisse.caissier_id)
+            .outerjoin(Boisson, Boisson.id == l.boisson_id)
+            .where(SessionCaisse.date >= dt_from.date(), SessionCaisse.date <= dt_to.date())
+            .order_by(SessionCaisse.date, SessionCaisse.id, l.id))
+
+def _brut_livraisons(dt_from, dt_to):
+    e = EntreeBoisson
+    return (db.select(e.id, e.date, Boisson.nom, e.quantite, e.note)
+            .outerjoin(Boisson, Boisson.id == e.boisson_id)
+            .where(e.date >= dt_from.date(), e.date <= dt_to.date())
+            .order_by(e.date, e.id))
+
+# nom -> (en-tête CSV, requête(dt_from, dt_to))
+EXPORTS_BRUTS = {
+    'ventes': (["ID", "Date", "Recette", "Quantité"], _brut_ventes),
+    'transferts': (["ID", "Date", "Ingrédient", "Quantité", "Unité", "Sens"], _brut_transferts),
+    'sessions': (["Date", "Session", "Caissier", "Boisson", "SI", "ACHAT", "SF", "Vendu",
+                  "P.U (F)", "Montant (F)"], _brut_sessions),
+    'livraisons': (["ID", "Date", "Boisson", "Quantité", "Note"], _brut_livraisons),
+}
+
+# Lignes lues par paquets (curseur serveur sous PostgreSQL) : mémoire constante
+LIGNES_PAR_PAQUET_EXPORT = 2000
+
+@app.route('/export/brut/<nom>.csv')
+@login_required
+def export_brut_csv(nom):
+    """
+    Export ligne à ligne (ventes, transferts, lignes de session, livraisons) sur une
+    période quelconque, envoyé en flux : premier octet immédiat, mémoire constante.
+    """
+    if nom not in EXPORTS_BRUTS:
+        abort(404)
+    entete, requete = EXPORTS_BRUTS[nom]
+    date_from, date_to, heure_debut, heure_fin, dt_from, dt_to = _lire_periode(request.args)
 
-    resp = make_response(output.getvalue())
-    resp.headers["Content-Type"] = "text/csv; charset=utf-8"
-    resp.headers["Content-Disposition"] = f"attachment; filename=point_boissons_{date_from}_to_{date_to}.csv"
-    return resp
+    def lignes():
+        resultat = db.session.execute(requete(dt_from, dt_to),
+                                      execution_options={'yield_per': LIGNES_PAR_PAQUET_EXPORT})
+        for ligne in resultat:
+            yield [v.isoformat(sep=' ') if isinstance(v, datetime) else v for v in ligne]
 
+    return _reponse_flux_csv(flux_csv(entete, lignes()), f"{nom}_{date_from}_to_{date_to}.csv")
 
 @app.route('/rapport/cuisine_periode/pdf')
 @login_required
@@ -687,19 +2157,16 @@ def rapport_cuisine_periode_pdf():
     mais sur [date_from, date_to] avec heures.
     Le nom de fichier reflète la période.
     """
-    date_to = request.args.get('date_to', datetime.utcnow().date().isoformat())
-    date_from = request.args.get(
-        'date_from',
-        (datetime.fromisoformat(date_to) - timedelta(days=30)).date().isoformat()
-    )
-    heure_debut = request.args.get('heure_debut', '00:00')
-    heure_fin = request.args.get('heure_fin', '23:59')
-
-    dt_debut = datetime.fromisoformat(f"{date_from} {heure_debut}")
-    dt_fin   = datetime.fromisoformat(f"{date_to} {heure_fin}")
-
-    ventes = Vente.query.filter(Vente.date >= dt_debut, Vente.date <= dt_fin).all()
-    transferts = HistoriqueTransfert.query.filter(HistoriqueTransfert.date >= dt_debut, HistoriqueTransfert.date <= dt_fin).all()
+    date_from, date_to, heure_debut, heure_fin, dt_debut, dt_fin = _lire_periode(request.args)
+    cle = cle_rapport(TABLES_RAPPORT_PDF, date_from=date_from, date_to=date_to,
+                      heure_debut=heure_debut, heure_fin=heure_fin)
+    if file_rapports.statut(cle) in (PRET, EN_COURS):
+        return redirect(url_for('rapport_pdf', job_id=cle))
+
+    ventes = (Vente.query.options(joinedload(Vente.recette))
+              .filter(Vente.date >= dt_debut, Vente.date <= dt_fin).all())
+    transferts = (HistoriqueTransfert.query.options(joinedload(HistoriqueTransfert.ingredient))
+                  .filter(HistoriqueTransfert.date >= dt_debut, HistoriqueTransfert.date <= dt_fin).all())
     ingredients = Ingredient.query.order_by(Ingredient.nom.asc()).all()
 
     # On réutilise le template existant 'rapport_pdf.html'
@@ -714,16 +2181,8 @@ def rapport_cuisine_periode_pdf():
         ingredients=ingredients
     )
 
-    result = io.BytesIO()
-    pisa_status = pisa.CreatePDF(io.StringIO(html), dest=result)
-    if pisa_status.err:
-        return f"Erreur de génération PDF : {pisa_status.err}", 500
-
     fname = f"point_cuisine_{date_from}_{heure_debut.replace(':','')}_to_{date_to}_{heure_fin.replace(':','')}.pdf"
-    response = make_response(result.getvalue())
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename={fname}'
-    return response
+    return _soumettre_rapport_pdf(cle, html, fname)
 
 @app.route('/rapport/journalier/pdf')
 @login_required
@@ -734,9 +2193,15 @@ def rapport_journalier_pdf():
 
     dt_debut = datetime.fromisoformat(f"{date_str} {heure_debut}")
     dt_fin = datetime.fromisoformat(f"{date_str} {heure_fin}")
-
-    ventes = Vente.query.filter(Vente.date >= dt_debut, Vente.date <= dt_fin).all()
-    transferts = HistoriqueTransfert.query.filter(HistoriqueTransfert.date >= dt_debut, HistoriqueTransfert.date <= dt_fin).all()
+    date_str, heure_debut, heure_fin = dt_debut.date().isoformat(), dt_debut.strftime('%H:%M'), dt_fin.strftime('%H:%M')
+    cle = cle_rapport(TABLES_RAPPORT_PDF, date=date_str, heure_debut=heure_debut, heure_fin=heure_fin)
+    if file_rapports.statut(cle) in (PRET, EN_COURS):
+        return redirect(url_for('rapport_pdf', job_id=cle))
+
+    ventes = (Vente.query.options(joinedload(Vente.recette))
+              .filter(Vente.date >= dt_debut, Vente.date <= dt_fin).all())
+    transferts = (HistoriqueTransfert.query.options(joinedload(HistoriqueTransfert.ingredient))
+                  .filter(HistoriqueTransfert.date >= dt_debut, HistoriqueTransfert.date <= dt_fin).all())
     ingredients = Ingredient.query.order_by(Ingredient.nom.asc()).all()
 
     html = render_template(
@@ -749,17 +2214,116 @@ def rapport_journalier_pdf():
         ingredients=ingredients
     )
 
-    result = io.BytesIO()
-    pisa_status = pisa.CreatePDF(io.StringIO(html), dest=result)
+    return _soumettre_rapport_pdf(cle, html, f"rapport_{date_str}_{heure_debut}_{heure_fin}.pdf")
+
+# --- Rapports CSV / PDF : cache disque, rendu PDF en arrière-plan ---
 
-    if pisa_status.err:
-        return f"Erreur de génération PDF : {pisa_status.err}", 500
+cache_rapports = CacheDisque(app.config['RAPPORTS_DIR'], app.config['RAPPORTS_CACHE_MO'] * 1024 * 1024)
+file_rapports = FileRapports(cache_rapports, processus=app.config['PDF_PROCESSUS'])
 
-    response = make_response(result.getvalue())
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename=rapport_{date_str}_{heure_debut}_{heure_fin}.pdf'
+# Domaines lus par rapport_pdf.html : ventes, transferts, stock cuisine (+ noms des recettes)
+TABLES_RAPPORT_PDF = ('ventes', 'recettes', 'transferts', 'ingredients')
+
+def cle_rapport(domaines, **params):
+    """
+    Clé de cache d'un rapport : endpoint, paramètres normalisés, langue et versions
+    des domaines de données lus. Toute écriture sur ces domaines change la clé.
+    """
+    return empreinte_donnees(versions_caches(*domaines), params)
+
+def empreinte_donnees(versions, params):
+    """Empreinte (endpoint, paramètres, langue, versions {cle: version}) : clé de cache ou ETag."""
+    brut = json.dumps([request.endpoint, sorted(params.items()), get_locale(), sorted(versions.items())])
+    return hashlib.sha256(brut.encode('utf-8')).hexdigest()[:32]
+
+def _servir_rapport(chemin, cle, mimetype, nom_fichier):
+    """Fichier en pièce jointe, ETag = clé : un re-téléchargement inchangé répond 304."""
+    response = send_file(chemin, mimetype=mimetype, as_attachment=True,
+                         download_name=nom_fichier, etag=cle, conditional=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def flux_csv(entete, lignes, par_paquet=500):
+    """
+    Morceaux CSV (bytes) : l'en-tête part immédiatement, puis les lignes par paquets.
+    La mémoire reste bornée quel que soit le nombre de lignes (`lignes` est itéré paresseusement).
+    """
+    tampon = io.StringIO()
+    writer = csv.writer(tampon)
+    writer.writerow(entete)
+    yield tampon.getvalue().encode('utf-8')
+    tampon.seek(0)
+    tampon.truncate()
+    for i, ligne in enumerate(lignes, 1):
+        writer.writerow(ligne)
+        if i % par_paquet == 0:
+            yield tampon.getvalue().encode('utf-8')
+            tampon.seek(0)
+            tampon.truncate()
+    if tampon.tell():
+        yield tampon.getvalue().encode('utf-8')
+
+def _reponse_flux_csv(morceaux, nom_fichier):
+    response = Response(stream_with_context(morceaux), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename={nom_fichier}'
     return response
 
+def _reponse_csv(cle, nom_fichier, entete, lignes):
+    """
+    CSV depuis le cache disque ; sinon généré en flux (`lignes` n'est parcouru
+    qu'à ce moment-là) et écrit dans le cache au fil de l'envoi.
+    """
+    chemin = cache_rapports.lire(cle, 'csv')
+    if chemin is not None:
+        return _servir_rapport(chemin, cle, 'text/csv; charset=utf-8', nom_fichier)
+    if cle in request.if_none_match:
+        # Copie du client à jour mais entrée évincée : inutile de la régénérer
+        response = make_response('', 304)
+    else:
+        response = _reponse_flux_csv(
+            cache_rapports.ecrire_flux(cle, 'csv', flux_csv(entete, lignes)), nom_fichier)
+    response.set_etag(cle)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def _soumettre_rapport_pdf(cle, html, nom_fichier):
+    """Met le rendu xhtml2pdf en file et redirige vers la page d'attente / téléchargement."""
+    par_endpoint = (('endpoint', request.endpoint),)
+    file_rapports.soumettre(
+        html, nom_fichier, job_id=cle,
+        rappel=lambda duree: metriques.enregistrer(
+            histogrammes=[('stock_pdf_render_seconds', par_endpoint, duree)]))
+    return redirect(url_for('rapport_pdf', job_id=cle))
+
+@app.route('/rapport/pdf/<job_id>')
+@login_required
+def rapport_pdf(job_id):
+    """PDF terminé en pièce jointe ; sinon page d'attente (202) qui interroge le statut."""
+    statut = file_rapports.statut(job_id)
+    if statut == INCONNU:
+        abort(404)
+    if statut == ERREUR:
+        return file_rapports.erreur(job_id), 500
+    nom = file_rapports.meta(job_id).get('nom', f"{job_id}.pdf")
+    if statut == PRET:
+        chemin = cache_rapports.lire(job_id, 'pdf') or file_rapports.chemin(job_id, 'pdf')
+        return _servir_rapport(chemin, job_id, 'application/pdf', nom)
+    return render_template('rapport_attente.html', job_id=job_id, nom=nom), 202
+
+@app.route('/rapport/pdf/<job_id>/statut')
+@login_required
+def rapport_pdf_statut(job_id):
+    """Statut JSON d'un rapport : en_cours | pret | erreur | inconnu."""
+    statut = file_rapports.statut(job_id)
+    reponse = {'statut': statut}
+    if statut == PRET:
+        reponse['url'] = url_for('rapport_pdf', job_id=job_id)
+    elif statut == ERREUR:
+        reponse['erreur'] = file_rapports.erreur(job_id)
+    return reponse, 404 if statut == INCONNU else 200
+
 @app.route('/ajouter', methods=['GET', 'POST'])
 @login_required
 def ajouter():
@@ -829,10 +2393,16 @@ def recettes():
             qtes = quantites[i]
             if qtes.strip():
                 db.session.add(RecetteIngredient(recette_id=recette.id, ingredient_id=int(ingredients_ids[i]), quantite=float(qtes)))
+        aplatir_fiches([recette.id])
         db.session.commit()
         return redirect(url_for('recettes'))
 
-    return render_template('recettes.html', ingredients = Ingredient.query.order_by(Ingredient.nom.asc()).all(), recettes=Recette.query.all())
+    # Fiches aplaties du cache du worker ; noms et unités pris dans la liste des ingrédients du formulaire
+    ingredients = Ingredient.query.order_by(Ingredient.nom.asc()).all()
+    recettes = Recette.query.options(selectinload(Recette.composants)).all()
+    return render_template('recettes.html', ingredients=ingredients, recettes=recettes,
+                           fiches=fiches_compilees(), ingredients_par_id={i.id: i for i in ingredients},
+                           noms_recettes={r.id: r.nom for r in recettes})
 
 @app.route('/modifier_recette/<int:id>', methods=['GET', 'POST'])
 @login_required
@@ -841,6 +2411,9 @@ def modifier_recette(id):
     if request.method == 'POST':
         recette.nom = request.form['nom']
         RecetteIngredient.query.filter_by(recette_id=recette.id).delete()
+        RecetteComposant.query.filter_by(recette_id=recette.id).delete()
+        # DELETE en masse : hors du suivi de session, tampon incrémenté explicitement
+        invalider_caches('recettes')
 
         for ingr_id in request.form.getlist('ingredient_id'):
             qty_str = request.form.get(f'quantite_{ingr_id}', '0')
@@ -851,16 +2424,45 @@ def modifier_recette(id):
             except ValueError:
                 continue
 
+        for sous_recette_id in request.form.getlist('sous_recette_id'):
+            try:
+                qty = float(request.form.get(f'portions_{sous_recette_id}', '0'))
+                if qty > 0:
+                    db.session.add(RecetteComposant(recette_id=recette.id, sous_recette_id=int(sous_recette_id),
+                                                    quantite=qty))
+            except ValueError:
+                continue
+
+        try:
+            aplatir_fiches([recette.id])
+        except CycleRecettes:
+            db.session.rollback()
+            flash(_("Une recette ne peut pas se contenir elle-même (directement ou via ses sous-recettes)."), "danger")
+            return redirect(url_for('modifier_recette', id=id))
         db.session.commit()
         return redirect(url_for('recettes'))
 
     quantites = {ri.ingredient_id: ri.quantite for ri in recette.ingredients}
-    return render_template('modifier_recette.html', recette=recette, ingredients = Ingredient.query.order_by(Ingredient.nom.asc()).all(), quantites=quantites)
+    portions = {c.sous_recette_id: c.quantite for c in recette.composants}
+    # Sous-recettes possibles : toutes, sauf celle-ci et celles qui l'utilisent déjà (cycle)
+    exclues = recettes_dependantes([recette.id])
+    bases = Recette.query.filter(Recette.id.notin_(exclues)).order_by(Recette.nom.asc()).all()
+    return render_template('modifier_recette.html', recette=recette, ingredients = Ingredient.query.order_by(Ingredient.nom.asc()).all(),
+                           quantites=quantites, bases=bases, portions=portions)
 
 @app.route('/recette/supprimer/<int:id>', methods=['POST'])
 @login_required
 def supprimer_recette(id):
     recette = Recette.query.get_or_404(id)
+    utilisatrices = (db.session.query(Recette.nom)
+                     .join(RecetteComposant, RecetteComposant.recette_id == Recette.id)
+                     .filter(RecetteComposant.sous_recette_id == recette.id)
+                     .order_by(Recette.nom).all())
+    if utilisatrices:
+        flash(_("« %(nom)s » est une sous-recette de : %(noms)s. Retirez-la d'abord de ces recettes.",
+                nom=recette.nom, noms=', '.join(n for (n,) in utilisatrices)), "danger")
+        return redirect(url_for('recettes'))
+    FicheAplatie.query.filter_by(recette_id=recette.id).delete()
     db.session.delete(recette)
     db.session.commit()
     return redirect(url_for('recettes'))
@@ -868,7 +2470,8 @@ def supprimer_recette(id):
 @app.route('/recette/dupliquer/<int:id>', methods=['POST'])
 @login_required
 def dupliquer_recette(id):
-    recette_originale = Recette.query.get_or_404(id)
+    recette_originale = db.get_or_404(Recette, id, options=[selectinload(Recette.ingredients),
+                                                            selectinload(Recette.composants)])
     nouveau_nom = f"{recette_originale.nom} (copie)"
     nouvelle_recette = Recette(nom=nouveau_nom)
     db.session.add(nouvelle_recette)
@@ -881,7 +2484,12 @@ def dupliquer_recette(id):
             quantite=ingredient_assoc.quantite
         )
         db.session.add(copie_ingredient)
+    for composant in recette_originale.composants:
+        db.session.add(RecetteComposant(recette_id=nouvelle_recette.id,
+                                        sous_recette_id=composant.sous_recette_id,
+                                        quantite=composant.quantite))
 
+    aplatir_fiches([nouvelle_recette.id])
     db.session.commit()
     flash(_("Recette « %(nom)s » dupliquée avec succès.", nom=recette_originale.nom), "success")
     return redirect(url_for('recettes'))
@@ -889,57 +2497,206 @@ def dupliquer_recette(id):
 @app.route('/ventes', methods=['GET', 'POST'])
 @login_required
 def ventes():
-    recettes = Recette.query.all()
     message = ""
 
     if request.method == 'POST':
-        recette_id = request.form['recette_id']
+        recette_id = int(request.form['recette_id'])
         quantite_vendue = int(request.form['quantite'])
-        recette = Recette.query.get(recette_id)
+        fiche = fiches_techniques([recette_id]).get(recette_id)
 
-        if not recette:
+        if fiche is None:
             message = "Recette introuvable."
         else:
-            stock_suffisant = all(item.ingredient.stock_cuisine >= item.quantite * quantite_vendue for item in recette.ingredients)
-
-            if stock_suffisant:
-                db.session.add(Vente(recette_id=recette.id, quantite=quantite_vendue))
-                for item in recette.ingredients:
-                    item.ingredient.stock_cuisine -= item.quantite * quantite_vendue
+            try:
+                retirer_stock('stock_cuisine', fiche.besoins(quantite_vendue))
+            except StockInsuffisant:
+                db.session.rollback()
+                message = "❌ Stock insuffisant pour cette recette."
+            else:
+                vente = Vente(recette_id=recette_id, quantite=quantite_vendue, date=datetime.utcnow())
+                db.session.add(vente)
+                enregistrer_agregats_ventes([vente])
                 db.session.commit()
                 message = "✅ Vente enregistrée avec succès."
-            else:
-                message = "❌ Stock insuffisant pour cette recette."
 
+    # Chargées après le COMMIT, qui expirerait sinon chaque recette (une relecture par ligne du formulaire)
+    recettes = Recette.query.all()
     return render_template('ventes.html', recettes=recettes, message=message)
 
+# --- Ventes par lot (saisie de fin de service) ---
+
+# Au-delà, le lot est refusé en bloc (à découper côté caisse)
+VENTES_LOT_MAX = 5000
+
+def _lire_lot_ventes():
+    """
+    Lignes brutes [(numéro, dict)] d'un lot : corps JSON (liste, ou {"ventes": [...]})
+    ou fichier CSV `fichier` (colonnes recette_id, quantite, date ; séparateur , ou ;).
+    Le numéro est l'index dans la liste JSON, ou la ligne du fichier CSV.
+    """
+    if request.is_json:
+        donnees = request.get_json(silent=True)
+        if isinstance(donnees, dict):
+            donnees = donnees.get('ventes')
+        if not isinstance(donnees, list):
+            raise ValueError(_("Corps JSON attendu : liste de ventes ou objet {\"ventes\": [...]}."))
+        lignes = [(i, l if isinstance(l, dict) else {}) for i, l in enumerate(donnees, 1)]
+    else:
+        fichier = request.files.get('fichier')
+        if not fichier:
+            raise ValueError(_("Aucun fichier CSV reçu."))
+        try:
+            texte = fichier.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise ValueError(_("Le fichier CSV doit être encodé en UTF-8."))
+        try:
+            dialecte = csv.Sniffer().sniff(texte.split('\n', 1)[0], delimiters=',;')
+        except csv.Error:
+            dialecte = csv.excel
+        lecteur = csv.DictReader(io.StringIO(texte), dialect=dialecte)
+        lignes = [(lecteur.line_num, ligne) for ligne in lecteur]
+    if len(lignes) > VENTES_LOT_MAX:
+        raise ValueError(_("Lot trop volumineux (%(n)s lignes, maximum %(max)s).", n=len(lignes), max=VENTES_LOT_MAX))
+    return lignes
+
+def _valider_ligne_vente(brute, maintenant):
+    """(recette_id, quantite, date UTC naïve) d'une ligne brute ; ValueError avec un message lisible sinon."""
+    try:
+        recette_id = int(str(brute.get('recette_id')).strip())
+    except ValueError:
+        raise ValueError(_("recette_id manquant ou invalide"))
+    try:
+        quantite = int(str(brute.get('quantite') or 1).strip())
+    except ValueError:
+        raise ValueError(_("quantité invalide"))
+    if quantite < 1:
+        raise ValueError(_("quantité invalide"))
+    date = str(brute.get('date') or '').strip()
+    if not date:
+        return recette_id, quantite, maintenant
+    try:
+        date = datetime.fromisoformat(date)
+    except ValueError:
+        raise ValueError(_("date invalide (format attendu AAAA-MM-JJ HH:MM)"))
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return recette_id, quantite, date
+
+# Un lot concurrent peut consommer le stock entre la lecture et les décréments : nouvel essai
+ESSAIS_VENTES_LOT = 3
+
+def enregistrer_ventes_lot(lignes):
+    """
+    Enregistre un lot de ventes en une seule transaction : fiches techniques de toutes
+    les recettes du lot lues en une requête, stocks cuisine lus une fois, besoins cumulés
+    ligne après ligne, puis insertion des ventes et décréments conditionnels en bloc.
+    Une ligne invalide ou sans stock suffisant est rejetée sans bloquer les autres.
+    Renvoie (nombre de ventes enregistrées, [{'ligne', 'erreur'}]) ; lève StockInsuffisant
+    si d'autres mouvements ont entamé le stock à chacun des essais.
+    """
+    maintenant = datetime.utcnow()
+    erreurs, valides = [], []
+    for numero, brute in lignes:
+        try:
+            valides.append((numero, *_valider_ligne_vente(brute, maintenant)))
+        except ValueError as e:
+            erreurs.append(dict(ligne=numero, erreur=str(e)))
+
+    fiches = fiches_techniques(recette_id for _n, recette_id, _q, _d in valides)
+    for essai in range(ESSAIS_VENTES_LOT):
+        try:
+            ventes, rejets = _appliquer_lot_ventes(valides, fiches)
+            break
+        except StockInsuffisant:
+            db.session.rollback()
+            if essai == ESSAIS_VENTES_LOT - 1:
+                raise
+    return len(ventes), sorted(erreurs + rejets, key=lambda e: e['ligne'])
+
+def _appliquer_lot_ventes(valides, fiches):
+    """Répartit le stock lu entre les lignes, puis écrit ventes et décréments ; (ventes, rejets)."""
+    ingredient_ids = {i for fiche in fiches.values() for i in fiche.ingredient_ids}
+    ingredients = {i.id: i for i in Ingredient.query.filter(Ingredient.id.in_(ingredient_ids))}
+    disponible = {i: ingredient.stock_cuisine for i, ingredient in ingredients.items()}
+
+    erreurs, ventes, consomme = [], [], {}
+    for numero, recette_id, quantite, date in valides:
+        if recette_id not in fiches:
+            erreurs.append(dict(ligne=numero, erreur=_("Recette introuvable (id %(id)s)", id=recette_id)))
+            continue
+        besoin = fiches[recette_id].besoins(quantite)
+        inconnus = sorted(i for i in besoin if i not in ingredients)
+        if inconnus:
+            erreurs.append(dict(ligne=numero, erreur=_("Ingrédient introuvable (id %(id)s)", id=inconnus[0])))
+            continue
+        manquants = sorted(ingredients[i].nom for i, q in besoin.items() if disponible[i] < q)
+        if manquants:
+            erreurs.append(dict(ligne=numero, erreur=_("Stock insuffisant : %(noms)s", noms=', '.join(manquants))))
+            continue
+        for i, q in besoin.items():
+            disponible[i] -= q
+            consomme[i] = consomme.get(i, 0) + q
+        ventes.append(Vente(recette_id=recette_id, quantite=quantite, date=date))
+
+    if not ventes:
+        return ventes, erreurs
+    retirer_stock('stock_cuisine', consomme)
+    db.session.add_all(ventes)
+    enregistrer_agregats_ventes(ventes)
+    db.session.commit()
+    return ventes, erreurs
+
+@app.route('/ventes/lot', methods=['POST'])
+@login_required
+def ventes_lot():
+    """
+    Saisie de fin de service : lot de ventes (recette_id, quantite, date) en JSON ou
+    fichier CSV. Réponse JSON {enregistrees, erreurs} pour un client JSON, page Ventes sinon.
+    """
+    repondre_json = request.is_json or request.accept_mimetypes.best == 'application/json'
+    try:
+        nb, erreurs = enregistrer_ventes_lot(_lire_lot_ventes())
+    except (ValueError, StockInsuffisant) as e:
+        if isinstance(e, StockInsuffisant):
+            erreur, statut = _("Stock modifié pendant l'import : lot non enregistré, veuillez réessayer."), 409
+        else:
+            erreur, statut = str(e), 400
+        if repondre_json:
+            return {'erreur': erreur}, statut
+        return render_template('ventes.html', recettes=Recette.query.all(), message="",
+                               erreur_lot=erreur, erreurs_lot=[]), statut
+
+    if repondre_json:
+        return {'enregistrees': nb, 'erreurs': erreurs}
+    return render_template('ventes.html', recettes=Recette.query.all(),
+                           message=_("✅ %(n)s vente(s) enregistrée(s), %(e)s ligne(s) rejetée(s).", n=nb, e=len(erreurs)),
+                           erreurs_lot=erreurs)
+
 @app.route('/transfert', methods=['GET', 'POST'])
 @login_required
 def transfert():
-    page = request.args.get('page', 1, type=int)
-    ingredients = Ingredient.query.order_by(Ingredient.nom.asc()).all()
-    transferts = HistoriqueTransfert.query.order_by(HistoriqueTransfert.date.desc()).paginate(page=page, per_page=20, error_out=False)
-
     if request.method == 'POST':
         try:
             ingredient_id = int(request.form['ingredient'])
             quantite = float(request.form['quantite'])
             sens = request.form['sens']
-            ingredient = Ingredient.query.get(ingredient_id)
+            ingredient = db.session.get(Ingredient, ingredient_id)
+            source, destination = (('stock_magasin', 'stock_cuisine') if sens == 'magasin_vers_cuisine'
+                                   else ('stock_cuisine', 'stock_magasin'))
 
             if not ingredient:
                 flash(_("Ingrédient introuvable"), "error")
-            elif sens == 'magasin_vers_cuisine' and ingredient.stock_magasin < quantite:
-                flash(_("Stock magasin insuffisant"), "error")
-            elif sens == 'cuisine_vers_magasin' and ingredient.stock_cuisine < quantite:
-                flash(_("Stock cuisine insuffisant"), "error")
+            elif quantite <= 0:
+                flash(_("Quantité invalide"), "error")
             else:
-                if sens == 'magasin_vers_cuisine':
-                    ingredient.stock_magasin -= quantite
-                    ingredient.stock_cuisine += quantite
-                else:
-                    ingredient.stock_cuisine -= quantite
-                    ingredient.stock_magasin += quantite
+                try:
+                    retirer_stock(source, {ingredient.id: quantite})
+                except StockInsuffisant:
+                    db.session.rollback()
+                    flash(_("Stock magasin insuffisant") if sens == 'magasin_vers_cuisine'
+                          else _("Stock cuisine insuffisant"), "error")
+                    return redirect(url_for('transfert'))
+                ajouter_stock(destination, {ingredient.id: quantite})
 
                 db.session.add(HistoriqueTransfert(
                     ingredient_id=ingredient.id,
@@ -952,10 +2709,29 @@ def transfert():
                 flash(_("Transfert effectué avec succès"), "success")
                 return redirect(url_for('transfert'))
         except Exception as e:
+            db.session.rollback()
             flash(_("Erreur : %(e)s", e=str(e)), "error")
 
+    # Page rendue seulement (GET, ou POST en erreur) : un transfert réussi redirige sans les lire
+    ingredients = Ingredient.query.order_by(Ingredient.nom.asc()).all()
+    transferts = page_historique(HistoriqueTransfert.query.options(joinedload(HistoriqueTransfert.ingredient)),
+                                 HistoriqueTransfert,
+                                 apres=request.args.get('apres'), avant=request.args.get('avant'),
+                                 total=total_approximatif(HistoriqueTransfert))
     return render_template('transfert.html', ingredients=ingredients, transferts=transferts)
 
+@app.route('/metrics')
+def metrics():
+    """Compteurs et histogrammes de latence par endpoint (format texte Prometheus)."""
+    jeton = app.config['METRICS_TOKEN']
+    if jeton:
+        fourni = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(fourni.encode(), f"Bearer {jeton}".encode()):
+            abort(401)
+    elif not (app.config.get('LOGIN_DISABLED') or current_user.is_authenticated):
+        return login_manager.unauthorized()
+    return Response(metriques.exporter(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.context_processor
 def inject_request():
     return dict(request=request)
@@ -963,13 +2739,227 @@ def inject_request():
 @app.context_processor
 def inject_nb_alertes():
     try:
-        nb_alertes = Ingredient.query.filter(
-            Ingredient.seuil_alerte.isnot(None),
-            Ingredient.stock_cuisine < Ingredient.seuil_alerte
-        ).count()
+        nb_alertes = len(alertes_stock())
     except Exception:
         nb_alertes = 0
     return dict(nb_alertes=nb_alertes, current_time=datetime.utcnow())
 
+# ========================
+#      COMMANDES CLI
+# ========================
+
+# Tables historiques qui grossissent avec le temps : aucune requête de rapport
+# ne doit les parcourir intégralement.
+TABLES_INDEXEES = ('vente', 'historique_transfert', 'session_caisse',
+                   'session_ligne', 'entree_boisson', 'vente_boisson',
+                   'agregat_vente_jour', 'agregat_vente_heure', 'agregat_boisson_jour')
+
+from contextlib import contextmanager
+
+@contextmanager
+def capturer_requetes():
+    """
+    Collecte (statement, paramètres) de chaque requête SQL exécutée dans le bloc,
+    routes appelées sans authentification (client de test).
+    """
+    capturees = []
+
+    def capturer(conn, cursor, statement, parameters, context, executemany):
+        capturees.append((statement, parameters))
+
+    login_disabled = app.config.get('LOGIN_DISABLED', False)
+    app.config['LOGIN_DISABLED'] = True
+    event.listen(db.engine, 'before_cursor_execute', capturer)
+    try:
+        yield capturees
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capturer)
+        app.config['LOGIN_DISABLED'] = login_disabled
+
+def _periode_verification():
+    today = datetime.utcnow().date()
+    return today, dict(date_from=(today - timedelta(days=30)).isoformat(), date_to=today.isoformat())
+
+@app.cli.command('verifier-index')
+def verifier_index():
+    """Vérifie via EXPLAIN QUERY PLAN (SQLite) que les rapports utilisent un index."""
+
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException("EXPLAIN QUERY PLAN n'est disponible que sous SQLite.")
+
+    today, periode = _periode_verification()
+    with app.test_request_context():
+        urls = [
+            ('Tableau de bord', url_for('home', **periode)),
+            ('Fréquentation', url_for('api_frequentation', **periode)),
+            ('Export CSV cuisine', url_for('export_cuisine_csv', **periode)),
+            ('Export CSV bar', url_for('export_bar_csv', **periode)),
+            ('Export CSV prévisions', url_for('export_previsions_csv')),
+            ('Rapprochement', url_for('rapport_rapprochement', **periode)),
+            ('Rapprochement (jour)', url_for('export_rapprochement_csv', granularite='jour', **periode)),
+            *((f'Export brut {nom}', url_for('export_brut_csv', nom=nom, **periode)) for nom in EXPORTS_BRUTS),
+            ('PDF cuisine période', url_for('rapport_cuisine_periode_pdf', **periode)),
+            ('PDF journalier', url_for('rapport_journalier_pdf', date=periode['date_to'])),
+            ('Bar', url_for('pointage_bar')),
+            # Pages profondes des historiques : curseur (date, id), pas d'OFFSET
+            ('Historique des transferts', url_for('transfert', apres=f"{periode['date_to']}T00:00:00_1")),
+            ('Livraisons bar', url_for('entrees_boissons', date_debut=periode['date_from'],
+                                       date_fin=periode['date_to'], apres=f"{periode['date_to']}_1")),
+            ('Historique des sessions bar', url_for('pointage_bar', sessions_avant=f"{periode['date_from']}_1")),
+        ]
+
+    capturees = []
+    client = app.test_client()
+    for label, url in urls:
+        capturees.append((f"-- {label}", None))
+        # Contexte neuf par page, comme une vraie requête : rien ne reste dans `g` d'une page à l'autre
+        with app.app_context(), capturer_requetes() as requetes:
+            client.get(url).get_data()
+        capturees.extend(requetes)
+    capturees.append(("-- Chaînage SI / ACHAT (pointage bar)", None))
+    with capturer_requetes() as requetes:
+        EntreeBoisson.dernier_stock_final_avant(1, today)
+        EntreeBoisson.total_entrees_entre(1, today - timedelta(days=2), today)
+    capturees.extend(requetes)
+    capturees = [(st, p) for st, p in capturees
+                 if p is None or st.lstrip().upper().startswith('SELECT')]
+
+    echecs = 0
+    deja_vues = set()
+    with db.engine.connect() as conn:
+        for statement, parameters in capturees:
+            if parameters is None:
+                click.echo(statement)
+                continue
+            if statement in deja_vues:
+                continue
+            deja_vues.add(statement)
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+            details = [row[-1] for row in plan
+                       if len(row[-1].split()) > 1 and row[-1].split()[1] in TABLES_INDEXEES]
+            scans = [d for d in details if d.startswith('SCAN ') and 'INDEX' not in d]
+            if scans:
+                echecs += 1
+                click.echo(f"  ECHEC  {' | '.join(scans)}")
+                click.echo(f"         {' '.join(statement.split())[:160]}")
+            elif details:
+                click.echo(f"  OK     {' | '.join(details)}")
+
+    if echecs:
+        raise click.ClickException(f"{echecs} requête(s) parcourent une table historique sans index.")
+    click.echo("Toutes les requêtes de rapport utilisent un index.")
+
+# Nombre maximal de requêtes SQL par page (GET), indépendant du volume de données :
+# une relation parcourue ligne à ligne dans un template (N+1) fait exploser le compte.
+# Mesuré comme une première visite : contexte neuf, cache de rapports vide
+# (la lecture du tampon des alertes, pour le badge du menu, est comprise).
+BUDGET_REQUETES = (
+    ('Tableau de bord',         'home',                        'periode', 13),
+    ('API tableau de bord',     'api_dashboard',               'periode', 8),
+    ('API fréquentation',       'api_frequentation',           'periode', 4),
+    ('Détails ventes (JSON)',   'dashboard_ventes',            'periode', 1),
+    ('Détails transferts (JSON)', 'dashboard_transferts',      'periode', 1),
+    ('Export CSV cuisine',      'export_cuisine_csv',          'periode', 2),
+    ('Export CSV bar',          'export_bar_csv',              'periode', 2),
+    ('Export CSV prévisions',   'export_previsions_csv',       None,      5),
+    ('Rapprochement',           'rapport_rapprochement',       'periode', 2),
+    ('Export CSV rapprochement', 'export_rapprochement_csv',   'periode', 2),
+    *((f'Export brut {nom}', 'export_brut_csv', f'brut_{nom}', 1) for nom in EXPORTS_BRUTS),
+    ('PDF cuisine période',     'rapport_cuisine_periode_pdf', 'periode', 5),
+    ('PDF journalier',          'rapport_journalier_pdf',      'jour',    5),
+    ('Bar',                     'pointage_bar',                'bar',     8),
+    ('Livraisons bar',          'entrees_boissons',            None,      4),
+    ('Ingrédients',             'ajouter',                     None,      2),
+    ('Recettes',                'recettes',                    None,      5),
+    ('Modifier une recette',    'modifier_recette',            'recette', 7),
+    ('Ventes',                  'ventes',                      None,      2),
+    ('Transferts',              'transfert',                   None,      4),
+)
+
+@app.cli.command('verifier-requetes')
+def verifier_requetes():
+    """Vérifie qu'aucune page ne dépasse son budget de requêtes SQL (régressions N+1)."""
+    import tempfile
+
+    today, periode = _periode_verification()
+    premiere_recette = db.session.query(Recette.id).order_by(Recette.id).limit(1).scalar()
+    arguments = {
+        None: {},
+        'periode': periode,
+        'jour': dict(date=periode['date_to']),
+        'bar': dict(date_debut=periode['date_from'], date_fin=periode['date_to']),
+        'recette': dict(id=premiere_recette),
+        **{f'brut_{nom}': dict(periode, nom=nom) for nom in EXPORTS_BRUTS},
+    }
+
+    depassements = 0
+    client = app.test_client()
+    # Cache de rapports vide le temps de la vérification : exports et PDF sont réellement calculés
+    repertoire_rapports = cache_rapports.repertoire
+    with tempfile.TemporaryDirectory() as repertoire:
+        cache_rapports.repertoire = repertoire
+        try:
+            for label, endpoint, args, budget in BUDGET_REQUETES:
+                if args == 'recette' and premiere_recette is None:
+                    click.echo(f"  --     {label:<28} (aucune recette en base)")
+                    continue
+                with app.test_request_context():
+                    url = url_for(endpoint, **arguments[args])
+                # Contexte neuf par page, comme une vraie requête : rien ne reste dans `g` d'une page à l'autre
+                with app.app_context(), capturer_requetes() as requetes:
+                    reponse = client.get(url)
+                    reponse.get_data()  # exports en flux : les requêtes partent pendant l'envoi
+                    statut = reponse.status_code
+                nb = len(requetes)
+                if statut >= 400 or nb > budget:
+                    depassements += 1
+                    click.echo(f"  ECHEC  {label:<28} {nb:>3} / {budget} requête(s)  [HTTP {statut}]  {url}")
+                    for statement, _params in requetes:
+                        click.echo(f"         {' '.join(statement.split())[:160]}")
+                else:
+                    click.echo(f"  OK     {label:<28} {nb:>3} / {budget} requête(s)")
+        finally:
+            file_rapports.arreter()
+            cache_rapports.repertoire = repertoire_rapports
+
+    if depassements:
+        raise click.ClickException(f"{depassements} page(s) dépassent leur budget de requêtes.")
+    click.echo("Toutes les pages respectent leur budget de requêtes.")
+
+@app.cli.command('reconstruire-agregats')
+def reconstruire_agregats_command():
+    """Recalcule les agrégats ventes/boissons à partir de l'historique complet."""
+    reconstruire_agregats()
+    click.echo(f"Agrégats reconstruits : {AgregatVenteJour.query.count()} jour(s)×recette, "
+               f"{AgregatVenteHeure.query.count()} heure(s)×recette, "
+               f"{AgregatBoissonJour.query.count()} jour(s)×boisson.")
+
+@app.cli.command('reconstruire-stock-bar')
+def reconstruire_stock_bar_command():
+    """Contrôle et recalcule le registre de stock des boissons depuis l'historique."""
+    ecarts = reconstruire_stock_bar()
+    click.echo(f"Registre reconstruit : {StockBoisson.query.count()} boisson(s), "
+               f"{ecarts} incohérence(s) corrigée(s).")
+
+@app.cli.command('reconstruire-fiches')
+def reconstruire_fiches_command():
+    """Recalcule les fiches techniques aplaties (sous-recettes développées) de toutes les recettes."""
+    try:
+        reconstruire_fiches_aplaties()
+    except CycleRecettes as e:
+        raise click.ClickException(f"Cycle de sous-recettes : recette(s) {', '.join(map(str, e.recette_ids))}.")
+    click.echo(f"Fiches aplaties reconstruites : {FicheAplatie.query.count()} ligne(s) "
+               f"pour {Recette.query.count()} recette(s).")
+
+@app.cli.command('creer-admin')
+def creer_admin_command():
+    """Crée l'utilisateur admin (mot de passe ADMIN_PASSWORD) si la base n'a aucun utilisateur."""
+    if User.query.count():
+        click.echo("Des utilisateurs existent déjà : rien à faire.")
+    elif _create_admin_if_needed():
+        click.echo("Utilisateur admin créé.")
+    else:
+        click.echo("ADMIN_PASSWORD non défini : aucun utilisateur créé.")
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=True)
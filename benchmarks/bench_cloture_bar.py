@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+bench_cloture_bar.py — Temps de clôture d'une session bar selon le nombre de boissons.
+
+Compare le calcul historique (3 requêtes par boisson : SI trié sur tout
+l'historique, ACHAT, P.U) au calcul en lot de cloturer_session() (registre
+stock_boisson), sur une base SQLite temporaire (la base de l'application
+n'est pas touchée).
+
+    python benchmarks/bench_cloture_bar.py --jours 365 --tailles 10,30,60,120,240
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event, insert
+
+from app import (db, Boisson, Caissier, SessionCaisse, SessionLigne, EntreeBoisson,
+                 cloturer_session, reconstruire_stock_bar)
+
+
+def peupler(nb_boissons, nb_jours):
+    """Historique : une session par jour avec une ligne par boisson, livraisons le lundi."""
+    random.seed(2025)
+    db.session.execute(insert(Boisson), [
+        dict(id=i, nom=f"Boisson {i}", prix_unitaire=float(random.choice((350, 500, 600, 1000))))
+        for i in range(1, nb_boissons + 1)
+    ])
+    db.session.add(Caissier(id=1, nom='Bench'))
+    debut = date.today() - timedelta(days=nb_jours)
+    db.session.execute(insert(SessionCaisse), [
+        dict(id=j + 1, date=debut + timedelta(days=j), caissier_id=1, montant_reel=0.0)
+        for j in range(nb_jours)
+    ])
+    for j in range(nb_jours):
+        db.session.execute(insert(SessionLigne), [
+            dict(session_id=j + 1, boisson_id=b, stock_initial=0.0,
+                 entrees=float(random.randint(0, 30)), stock_final=float(random.randint(0, 20)),
+                 prix_unitaire_snap=0.0)
+            for b in range(1, nb_boissons + 1)
+        ])
+    db.session.execute(insert(EntreeBoisson), [
+        dict(boisson_id=b, quantite=float(random.randint(10, 60)), date=debut + timedelta(days=j))
+        for j in range(0, nb_jours, 7) for b in range(1, nb_boissons + 1)
+    ])
+    db.session.commit()
+    reconstruire_stock_bar()
+
+
+def cloture_historique(ids, date_debut, date_fin):
+    """Reproduction de l'ancienne boucle : 3 allers-retours par boisson."""
+    total = 0.0
+    for bid in ids:
+        si = EntreeBoisson._dernier_stock_final_historique(bid, date_debut)
+        ach = EntreeBoisson.total_entrees_entre(bid, date_debut, date_fin)
+        boisson = db.session.get(Boisson, bid)
+        total += max(0.0, si + ach) * (boisson.prix_unitaire if boisson else 0.0)
+    return total
+
+
+def mesurer(fn, repetitions):
+    """Meilleur temps (ms) et nombre de requêtes SQL d'une exécution."""
+    compteur = [0]
+
+    def compter(*args):
+        compteur[0] += 1
+
+    meilleur = None
+    for _ in range(repetitions):
+        compteur[0] = 0
+        event.listen(db.engine, 'before_cursor_execute', compter)
+        t0 = time.perf_counter()
+        try:
+            fn()
+        finally:
+            ecoule = (time.perf_counter() - t0) * 1000
+            event.remove(db.engine, 'before_cursor_execute', compter)
+            db.session.rollback()
+            db.session.expunge_all()
+        meilleur = ecoule if meilleur is None else min(meilleur, ecoule)
+    return meilleur, compteur[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--jours', type=int, default=365, help="jours d'historique")
+    parser.add_argument('--tailles', default='10,30,60,120,240', help="nombres de boissons testés")
+    parser.add_argument('--repetitions', type=int, default=5)
+    args = parser.parse_args()
+    tailles = [int(t) for t in args.tailles.split(',')]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bench = Flask(__name__)
+        bench.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        db.init_app(bench)
+        with bench.app_context():
+            db.create_all()
+            peupler(max(tailles), args.jours)
+
+            # Période qui suit la dernière session de l'historique (cas courant)
+            date_debut = date.today()
+            date_fin = date_debut + timedelta(days=2)
+
+            print(f"Historique : {args.jours} jours, {max(tailles)} boissons")
+            print(f"{'boissons':>8} | {'historique (ms)':>15} {'req.':>5} | {'en lot (ms)':>11} {'req.':>5} | {'gain':>5}")
+            for n in tailles:
+                ids = list(range(1, n + 1))
+
+                def en_lot():
+                    s = SessionCaisse(date=date_fin, caissier_id=1, montant_reel=0.0)
+                    db.session.add(s)
+                    db.session.flush()
+                    cloturer_session(s, ids, date_debut, date_fin, {})
+
+                t_old, q_old = mesurer(lambda: cloture_historique(ids, date_debut, date_fin), args.repetitions)
+                t_new, q_new = mesurer(en_lot, args.repetitions)
+                print(f"{n:>8} | {t_old:>15.1f} {q_old:>5} | {t_new:>11.1f} {q_new:>5} | {t_old / t_new:>4.1f}x")
+
+
+if __name__ == '__main__':
+    main()
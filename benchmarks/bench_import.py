@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+bench_import.py — Temps d'import de l'application, tel que le paie chaque worker gunicorn au démarrage.
+
+`python -X importtime -c "import app"` est lancé --repetitions fois dans un
+processus neuf (cache de bytecode chaud). Relevés : durée de l'import de `app`
+(médiane), modules les plus coûteux (temps propre), et modules interdits au
+démarrage : dépendances du rendu PDF (xhtml2pdf, reportlab, PIL, lxml…),
+importées par pdf_jobs seulement à la génération d'un rapport, et Alembic,
+réservé aux commandes `flask db`.
+
+Code de sortie 1 si un module interdit est chargé ou si --budget-ms est dépassé.
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --budget-ms 600 --top 15
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+INTERDITS = ('xhtml2pdf', 'reportlab', 'PIL', 'lxml', 'html5lib', 'pypdf', 'weasyprint',
+             'alembic', 'flask_migrate')
+
+LIGNE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| *(\S+)")
+
+
+def mesurer():
+    """{module: (propre µs, cumulé µs)} pour un import de `app` dans un processus neuf."""
+    # Ni contexte click ni variables de la CLI : comme sous gunicorn
+    env = {k: v for k, v in os.environ.items() if k not in ('FLASK_APP', 'FLASK_RUN_FROM_CLI')}
+    fini = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                          cwd=RACINE, env=env, capture_output=True, text=True)
+    if fini.returncode:
+        sys.exit(f"Échec de l'import :\n{fini.stderr[-2000:]}")
+    modules = {}
+    for ligne in fini.stderr.splitlines():
+        m = LIGNE.match(ligne)
+        if m:
+            modules[m.group(3)] = (int(m.group(1)), int(m.group(2)))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repetitions', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help="modules les plus coûteux à afficher")
+    parser.add_argument('--budget-ms', type=float, help="durée maximale de l'import de app (médiane)")
+    args = parser.parse_args()
+
+    # Premier import hors mesure : compile le bytecode (__pycache__)
+    mesurer()
+    runs = [mesurer() for _ in range(args.repetitions)]
+    totaux = [run['app'][1] / 1000 for run in runs]
+    mediane = statistics.median(totaux)
+    dernier = runs[-1]
+
+    print(f"import app : médiane {mediane:.0f} ms (min {min(totaux):.0f}, max {max(totaux):.0f}, "
+          f"{args.repetitions} processus), {len(dernier)} modules")
+    print(f"\n{'module':<40} | {'propre (ms)':>11} {'cumulé (ms)':>11}")
+    for nom, (propre, cumule) in sorted(dernier.items(), key=lambda m: -m[1][0])[:args.top]:
+        print(f"{nom:<40} | {propre / 1000:>11.1f} {cumule / 1000:>11.1f}")
+
+    charges = sorted({nom for nom in dernier if nom.split('.')[0] in INTERDITS})
+    echecs = []
+    if charges:
+        echecs.append("modules interdits au démarrage : " + ", ".join(charges))
+    if args.budget_ms is not None and mediane > args.budget_ms:
+        echecs.append(f"import de app en {mediane:.0f} ms > budget {args.budget_ms:.0f} ms")
+    if echecs:
+        sys.exit("\nÉCHEC : " + " ; ".join(echecs))
+    print("\nOK : aucune dépendance PDF ni Alembic chargée à l'import"
+          + (f", sous le budget de {args.budget_ms:.0f} ms." if args.budget_ms is not None else "."))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+bench_routes.py — Latence, requêtes SQL et mémoire des routes principales selon la taille de la base.
+
+Pour chaque taille (années d'historique), une base SQLite temporaire est générée
+par demo_init.py (même graine), puis chaque route est appelée par le client de
+test Flask avec des paramètres réalistes (les 30 derniers jours de données).
+Relevés par route : p50 / p95 (ms), requêtes SQL par appel, pic mémoire Python
+(tracemalloc, appel séparé). Les exports CSV et PDF sont mesurés cache vide ; pour
+les PDF, la requête (rendu HTML + mise en file) puis le rendu complet.
+
+Chaque taille tourne dans un sous-processus (DATABASE_URL propre). Les résultats
+sont écrits en JSON ; --comparer affiche l'écart avec un run précédent.
+
+    python benchmarks/bench_routes.py --annees 0.5,2,5 --sortie bench_routes.json
+    python benchmarks/bench_routes.py --annees 0.5,2,5 --sortie nouveau.json --comparer bench_routes.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+
+
+def percentile(valeurs, p):
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(len(valeurs) * p))]
+
+
+def routes_mesurees(url_for, periode, jour, recette_id, ingredient_id):
+    """(nom, méthode, url, données POST, cache vidé avant l'appel, rapport PDF)."""
+    return [
+        ('tableau de bord',     'GET',  url_for('home', **periode), None, False, False),
+        ('bar',                 'GET',  url_for('pointage_bar', date_debut=periode['date_from'],
+                                                date_fin=periode['date_to']), None, False, False),
+        ('ventes (page)',       'GET',  url_for('ventes'), None, False, False),
+        ('ventes (vente)',      'POST', url_for('ventes'), dict(recette_id=recette_id, quantite=1), False, False),
+        ('transfert (page)',    'GET',  url_for('transfert'), None, False, False),
+        ('transfert (envoi)',   'POST', url_for('transfert'), dict(ingredient=ingredient_id, quantite=0.1,
+                                                                  sens='magasin_vers_cuisine'), False, False),
+        ('CSV cuisine',         'GET',  url_for('export_cuisine_csv', **periode), None, True, False),
+        ('CSV bar',             'GET',  url_for('export_bar_csv', **periode), None, True, False),
+        ('CSV détaillé ventes', 'GET',  url_for('export_brut_csv', nom='ventes', **periode), None, False, False),
+        ('PDF cuisine période', 'GET',  url_for('rapport_cuisine_periode_pdf', **periode), None, True, True),
+        ('PDF journalier',      'GET',  url_for('rapport_journalier_pdf', date=jour), None, True, True),
+    ]
+
+
+def mesurer_taille(args):
+    """Sous-processus : génère la base (DATABASE_URL) puis mesure chaque route ; JSON sur stdout."""
+    from sqlalchemy import event, func
+    from flask import url_for
+
+    # demo_init et app affichent sur stdout : réservé au JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        import demo_init
+        from app import (app, db, file_rapports, Ingredient, Recette, Vente, SessionLigne,
+                         HistoriqueTransfert, PRET, ERREUR)
+        fin = date.fromisoformat(args.fin)
+        debut = fin - timedelta(days=round(365.25 * args.taille)) + timedelta(days=1)
+        t0 = time.perf_counter()
+        demo_init.seed(debut, fin, args.points_de_vente, 8, 16, args.echelle)
+        generation = time.perf_counter() - t0
+
+    app.config['LOGIN_DISABLED'] = True
+    with app.app_context():
+        # Stocks illimités : les ventes et transferts mesurés aboutissent
+        db.session.execute(db.update(Ingredient).values(stock_cuisine=1e9, stock_magasin=1e9))
+        db.session.commit()
+        lignes = {m.__tablename__: db.session.query(func.count()).select_from(m).scalar()
+                  for m in (Vente, SessionLigne, HistoriqueTransfert)}
+        recette_id = db.session.query(func.min(Recette.id)).scalar()
+        ingredient_id = db.session.query(func.min(Ingredient.id)).scalar()
+        compteur = [0]
+
+        def compter(*_args):
+            compteur[0] += 1
+
+        event.listen(db.engine, 'before_cursor_execute', compter)
+
+    periode = dict(date_from=(fin - timedelta(days=29)).isoformat(), date_to=fin.isoformat())
+    with app.test_request_context():
+        routes = routes_mesurees(url_for, periode, fin.isoformat(), recette_id, ingredient_id)
+
+    client = app.test_client()
+    rapports = app.config['RAPPORTS_DIR']
+
+    def appeler(methode, url, donnees, vider_cache, pdf):
+        """Durée de la requête (s), requêtes SQL, durée jusqu'au PDF prêt (s) ou None."""
+        if vider_cache:
+            shutil.rmtree(rapports, ignore_errors=True)
+        compteur[0] = 0
+        t0 = time.perf_counter()
+        reponse = client.open(url, method=methode, data=donnees)
+        reponse.get_data()
+        reponse.close()
+        duree = time.perf_counter() - t0
+        if reponse.status_code >= 400:
+            raise SystemExit(f"{methode} {url} : HTTP {reponse.status_code}")
+        nb_sql = compteur[0]
+        rendu = None
+        if pdf:
+            job_id = reponse.headers['Location'].rstrip('/').rsplit('/', 1)[-1]
+            while file_rapports.statut(job_id) not in (PRET, ERREUR):
+                if time.perf_counter() - t0 > 600:
+                    raise SystemExit(f"{url} : rendu PDF non terminé après 600 s")
+                time.sleep(0.02)
+            rendu = time.perf_counter() - t0
+        return duree, nb_sql, rendu
+
+    resultats = {}
+    for nom, methode, url, donnees, vider_cache, pdf in routes:
+        repetitions = args.repetitions_pdf if pdf else args.repetitions
+        for _ in range(args.echauffement):
+            appeler(methode, url, donnees, vider_cache, pdf)
+        durees, requetes, rendus = [], [], []
+        for _ in range(repetitions):
+            duree, nb_sql, rendu = appeler(methode, url, donnees, vider_cache, pdf)
+            durees.append(duree * 1000)
+            requetes.append(nb_sql)
+            if rendu is not None:
+                rendus.append(rendu * 1000)
+
+        # Pic mémoire sur un appel séparé (tracemalloc ralentit l'exécution)
+        tracemalloc.start()
+        avant = tracemalloc.get_traced_memory()[0]
+        appeler(methode, url, donnees, vider_cache, False)
+        pic = tracemalloc.get_traced_memory()[1] - avant
+        tracemalloc.stop()
+
+        resultats[nom] = dict(
+            methode=methode, url=url,
+            p50_ms=round(percentile(durees, 0.50), 2),
+            p95_ms=round(percentile(durees, 0.95), 2),
+            requetes_sql=percentile(requetes, 0.50),
+            memoire_pic_kio=round(pic / 1024),
+        )
+        if rendus:
+            resultats[nom]['rendu_p50_ms'] = round(percentile(rendus, 0.50), 2)
+
+    json.dump(dict(lignes=lignes, generation_s=round(generation, 2), routes=resultats), sys.stdout)
+
+
+def afficher(taille, mesure, precedent=None):
+    print(f"\n== {taille} an(s) : " + ", ".join(f"{t} {n}" for t, n in mesure['lignes'].items())
+          + f" (base générée en {mesure['generation_s']} s)")
+    print(f"{'route':<22} | {'p50 (ms)':>9} {'p95 (ms)':>9} | {'SQL':>4} | {'mémoire (Kio)':>13}"
+          + (f" | {'p50 préc.':>9} {'écart':>7}" if precedent else ""))
+    for nom, r in mesure['routes'].items():
+        ligne = (f"{nom:<22} | {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} | {r['requetes_sql']:>4} | "
+                 f"{r['memoire_pic_kio']:>13}")
+        ancien = (precedent or {}).get('routes', {}).get(nom)
+        if ancien:
+            ligne += f" | {ancien['p50_ms']:>9.1f} {(r['p50_ms'] / ancien['p50_ms'] - 1) * 100:>+6.0f}%"
+        print(ligne)
+        if 'rendu_p50_ms' in r:
+            print(f"{'  └ rendu complet':<22} | {r['rendu_p50_ms']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--annees', default='0.5,2,5', help="tailles de base (années d'historique)")
+    parser.add_argument('--points-de-vente', type=int, default=1)
+    parser.add_argument('--echelle', type=float, default=1.0)
+    parser.add_argument('--fin', default='2026-01-31', help="dernier jour de l'historique généré")
+    parser.add_argument('--repetitions', type=int, default=20)
+    parser.add_argument('--repetitions-pdf', type=int, default=3)
+    parser.add_argument('--echauffement', type=int, default=2)
+    parser.add_argument('--sortie', default='bench_routes.json')
+    parser.add_argument('--comparer', help="JSON d'un run précédent")
+    parser.add_argument('--taille', type=float, help=argparse.SUPPRESS)   # sous-processus
+    args = parser.parse_args()
+
+    if args.taille is not None:
+        mesurer_taille(args)
+        return
+
+    precedent = {}
+    if args.comparer:
+        with open(args.comparer, encoding='utf-8') as f:
+            precedent = json.load(f)['tailles']
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RACINE,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    sortie = dict(date=datetime.now().isoformat(timespec='seconds'), commit=commit,
+                  python=platform.python_version(), parametres=vars(args), tailles={})
+
+    for taille in args.annees.split(','):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'),
+                       RAPPORTS_DIR=os.path.join(tmp, 'rapports'))
+            commande = [sys.executable, os.path.abspath(__file__), '--taille', taille,
+                        '--points-de-vente', str(args.points_de_vente), '--echelle', str(args.echelle),
+                        '--fin', args.fin, '--repetitions', str(args.repetitions),
+                        '--repetitions-pdf', str(args.repetitions_pdf), '--echauffement', str(args.echauffement)]
+            fini = subprocess.run(commande, env=env, cwd=RACINE, stdout=subprocess.PIPE, text=True)
+            if fini.returncode:
+                sys.exit(f"Échec de la mesure pour {taille} an(s).")
+        mesure = json.loads(fini.stdout)
+        sortie['tailles'][taille] = mesure
+        afficher(taille, mesure, precedent.get(taille))
+
+    with open(args.sortie, 'w', encoding='utf-8') as f:
+        json.dump(sortie, f, indent=2, ensure_ascii=False)
+    print(f"\nRésultats écrits dans {args.sortie}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+stress_stock.py — Ventes et transferts concurrents contre une instance locale, puis contrôle des stocks.
+
+Des fils envoient en parallèle des ventes (POST /ventes) d'une même recette et des
+transferts (POST /transfert) sur ses ingrédients, répartis sur une ou plusieurs
+instances de l'application (workers gunicorn, ou plusieurs `flask run` sur la même
+base). À la fin, le stock de chaque ingrédient doit valoir exactement le stock de
+départ, moins les ventes enregistrées, plus ou moins les transferts enregistrés,
+et n'être jamais négatif (pas de mise à jour perdue, pas de survente).
+
+Les stocks des ingrédients de la recette sont d'abord remis à --portions fois leur
+quantité par portion (cuisine et magasin) : les premières ventes passent, les
+suivantes se disputent un stock qui s'épuise. Une exécution sans aucune vente
+enregistrée est un échec (le contrôle de survente n'aurait rien vérifié).
+
+Le contrôle lit la base de l'application (--base) : à lancer sur une base de
+démonstration, les ventes et transferts envoyés y restent.
+
+    gunicorn app:app --workers 2 --bind 127.0.0.1:8000 &
+    python benchmarks/stress_stock.py --url http://127.0.0.1:8000 --requetes 400 --fils 16 --portions 60
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from sqlalchemy import create_engine, text
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def instantane(conn, recette_id):
+    """
+    Fiche aplatie de la recette (ingrédients réellement décrémentés, sous-recettes
+    développées), stocks de ces ingrédients et derniers identifiants enregistrés.
+    """
+    fiche = dict(conn.execute(text(
+        "SELECT ingredient_id, quantite FROM fiche_aplatie WHERE recette_id = :r"),
+        dict(r=recette_id)).all())
+    stocks = {i: (c, m) for i, c, m in conn.execute(text(
+        "SELECT id, stock_cuisine, stock_magasin FROM ingredient WHERE id IN (%s)" % ','.join(map(str, fiche))))}
+    max_vente = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM vente")).scalar()
+    max_transfert = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM historique_transfert")).scalar()
+    return fiche, stocks, max_vente, max_transfert
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000',
+                        help="instance(s) de l'application, séparées par des virgules")
+    parser.add_argument('--utilisateur', default='admin')
+    parser.add_argument('--mot-de-passe', default=os.environ.get('ADMIN_PASSWORD', 'admin'))
+    parser.add_argument('--base', default=os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(RACINE, 'stock.db'),
+                        help="URL SQLAlchemy de la base de l'application (contrôle)")
+    parser.add_argument('--recette', type=int, help="recette vendue (défaut : celle qui a le plus d'ingrédients, sous-recettes développées)")
+    parser.add_argument('--requetes', type=int, default=400)
+    parser.add_argument('--fils', type=int, default=16)
+    parser.add_argument('--part-transferts', type=float, default=0.3)
+    parser.add_argument('--portions', type=float, default=60,
+                        help="remet d'abord les stocks cuisine et magasin de chaque ingrédient à ce nombre "
+                             "de portions de la recette (0 : stocks laissés tels quels)")
+    parser.add_argument('--stock', type=float,
+                        help="remet plutôt les stocks cuisine et magasin des ingrédients à cette valeur "
+                             "(une valeur basse force les refus pour stock insuffisant)")
+    args = parser.parse_args()
+    urls = [u.rstrip('/') for u in args.url.split(',')]
+
+    engine = create_engine(args.base)
+    with engine.begin() as conn:
+        recette_id = args.recette or conn.execute(text(
+            "SELECT recette_id FROM fiche_aplatie GROUP BY recette_id "
+            "ORDER BY COUNT(*) DESC, recette_id LIMIT 1")).scalar()
+        if recette_id is None:
+            sys.exit("Aucune recette avec ingrédients en base (python demo_init.py).")
+        if args.stock is not None:
+            conn.execute(text(
+                "UPDATE ingredient SET stock_cuisine = :s, stock_magasin = :s WHERE id IN "
+                "(SELECT ingredient_id FROM fiche_aplatie WHERE recette_id = :r)"),
+                dict(s=args.stock, r=recette_id))
+        elif args.portions:
+            # Dimensionné sur la fiche : 125 unités par portion comme 0,01 kg laissent autant de ventes
+            conn.execute(text(
+                "UPDATE ingredient SET stock_cuisine = :p * f.quantite, stock_magasin = :p * f.quantite "
+                "FROM fiche_aplatie AS f WHERE f.ingredient_id = ingredient.id AND f.recette_id = :r"),
+                dict(p=args.portions, r=recette_id))
+    with engine.connect() as conn:
+        fiche, depart, max_vente, max_transfert = instantane(conn, recette_id)
+
+    local = threading.local()
+    rang = itertools.count()
+
+    def client():
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+            local.url = urls[next(rang) % len(urls)]
+            r = local.session.post(f"{local.url}/login",
+                                   data=dict(username=args.utilisateur, password=args.mot_de_passe))
+            if r.url.rstrip('/').endswith('/login'):
+                raise SystemExit(f"Connexion refusée sur {local.url} ({args.utilisateur}).")
+        return local.session, local.url
+
+    def operation(n):
+        session, url = client()
+        rng = random.Random(n)
+        if rng.random() < args.part_transferts:
+            ingredient_id = rng.choice(list(fiche))
+            # Quantité à l'échelle de la fiche (0,5 à 3 portions) quelle que soit l'unité
+            r = session.post(f"{url}/transfert", allow_redirects=False, data=dict(
+                ingredient=ingredient_id, quantite=round(fiche[ingredient_id] * rng.uniform(0.5, 3), 3),
+                sens=rng.choice(('magasin_vers_cuisine', 'cuisine_vers_magasin'))))
+            return 'transfert', r.status_code
+        r = session.post(f"{url}/ventes", data=dict(recette_id=recette_id, quantite=rng.randint(1, 3)))
+        return 'vente', r.status_code
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.fils) as pool:
+        statuts = Counter(pool.map(operation, range(args.requetes)))
+    duree = time.perf_counter() - t0
+
+    with engine.connect() as conn:
+        _fiche, fin, _v, _t = instantane(conn, recette_id)
+        vendu = conn.execute(text(
+            "SELECT COALESCE(SUM(quantite), 0) FROM vente WHERE id > :m AND recette_id = :r"),
+            dict(m=max_vente, r=recette_id)).scalar()
+        transferts = conn.execute(text(
+            "SELECT ingredient_id, sens, SUM(quantite) FROM historique_transfert WHERE id > :m "
+            "GROUP BY ingredient_id, sens"), dict(m=max_transfert)).all()
+
+    vers_cuisine = Counter()
+    for ingredient_id, sens, quantite in transferts:
+        vers_cuisine[ingredient_id] += quantite if sens == 'magasin_vers_cuisine' else -quantite
+
+    print(f"{args.requetes} requêtes, {args.fils} fils, {len(urls)} instance(s) : {duree:.1f} s "
+          f"({args.requetes / duree:.0f} req/s)")
+    for (genre, statut), nb in sorted(statuts.items()):
+        print(f"  {genre:<9} HTTP {statut} : {nb}")
+    print(f"Recette {recette_id} : {vendu} portion(s) vendue(s) enregistrée(s)")
+    print(f"{'ingrédient':>10} | {'cuisine attendu':>15} {'obtenu':>12} | {'magasin attendu':>15} {'obtenu':>12}")
+
+    ecarts = 0
+    for i in sorted(fiche):
+        cuisine = depart[i][0] - fiche[i] * vendu + vers_cuisine[i]
+        magasin = depart[i][1] - vers_cuisine[i]
+        ok = all(abs(a - b) <= 1e-6 * max(1.0, abs(a)) and b >= -1e-9
+                 for a, b in ((cuisine, fin[i][0]), (magasin, fin[i][1])))
+        ecarts += not ok
+        print(f"{i:>10} | {cuisine:>15.3f} {fin[i][0]:>12.3f} | {magasin:>15.3f} {fin[i][1]:>12.3f}"
+              f"{'' if ok else '  <-- ÉCART'}")
+
+    erreurs = sum(nb for (_g, statut), nb in statuts.items() if statut >= 500)
+    if ecarts or erreurs:
+        sys.exit(f"ÉCHEC : {ecarts} ingrédient(s) en écart, {erreurs} réponse(s) en erreur serveur.")
+    if not vendu:
+        sys.exit("ÉCHEC : aucune vente enregistrée, les ventes concurrentes n'ont pas été éprouvées "
+                 "(stock insuffisant pour une portion : augmenter --portions ou --stock).")
+    print("OK : stocks finaux = stocks de départ + mouvements enregistrés.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+cache_rapports.py — Cache disque des rapports générés (CSV, PDF).
+
+Chaque fichier est nommé d'après sa clé (empreinte des paramètres normalisés
+et des versions des tables lues) : une clé ne désigne jamais deux contenus
+différents, il n'y a donc rien à invalider. Les entrées obsolètes sont
+simplement les moins récemment servies, et l'éviction LRU (mtime rafraîchi à
+chaque lecture) borne la taille du répertoire.
+"""
+import os
+import threading
+import time
+
+
+def ecrire_atomique(chemin, octets):
+    """Écriture atomique (fichier temporaire puis renommage)."""
+    tmp = f"{chemin}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(octets)
+    os.replace(tmp, chemin)
+
+
+class CacheDisque:
+    """Répertoire de rapports partagé par les workers, borné à `taille_max` octets."""
+
+    # Seuls les résultats sont évincés ; les fichiers annexes (.json, .err) partent avec eux
+    EXTENSIONS = ('pdf', 'csv')
+
+    def __init__(self, repertoire, taille_max):
+        self.repertoire = repertoire
+        self.taille_max = taille_max
+        self._derniere_eviction = 0.0
+
+    def chemin(self, cle, extension):
+        return os.path.join(self.repertoire, f"{cle}.{extension}")
+
+    def lire(self, cle, extension):
+        """Chemin de l'entrée si elle existe (et la marque comme récemment utilisée), sinon None."""
+        chemin = self.chemin(cle, extension)
+        try:
+            os.utime(chemin)
+        except FileNotFoundError:
+            return None
+        return chemin
+
+    def ecrire(self, cle, extension, octets):
+        os.makedirs(self.repertoire, exist_ok=True)
+        chemin = self.chemin(cle, extension)
+        ecrire_atomique(chemin, octets)
+        self.evincer()
+        return chemin
+
+    def ecrire_flux(self, cle, extension, morceaux):
+        """
+        Générateur : relaie les morceaux (bytes) au client tout en les écrivant dans
+        l'entrée, publiée seulement une fois le flux complet (client parti : rien n'est gardé).
+        """
+        os.makedirs(self.repertoire, exist_ok=True)
+        chemin = self.chemin(cle, extension)
+        tmp = f"{chemin}.{os.getpid()}-{threading.get_ident()}.tmp"
+        complet = False
+        try:
+            with open(tmp, 'wb') as f:
+                for morceau in morceaux:
+                    f.write(morceau)
+                    yield morceau
+            complet = True
+        finally:
+            if complet:
+                os.replace(tmp, chemin)
+                self.evincer()
+            else:
+                try:
+                    os.remove(tmp)
+                except FileNotFoundError:
+                    pass
+
+    def evincer(self, forcer=False):
+        """Supprime les entrées les moins récemment utilisées au-delà de taille_max (au plus toutes les 10 s)."""
+        maintenant = time.time()
+        if not forcer and maintenant - self._derniere_eviction < 10:
+            return
+        self._derniere_eviction = maintenant
+        try:
+            noms = os.listdir(self.repertoire)
+        except FileNotFoundError:
+            return
+
+        entrees, total = [], 0
+        for nom in noms:
+            cle, _, extension = nom.partition('.')
+            try:
+                st = os.stat(os.path.join(self.repertoire, nom))
+            except FileNotFoundError:
+                continue
+            if nom.endswith('.tmp') and maintenant - st.st_mtime > 3600:
+                # Écriture interrompue (processus tué en plein flux)
+                try:
+                    os.remove(os.path.join(self.repertoire, nom))
+                except FileNotFoundError:
+                    pass
+                continue
+            if extension not in self.EXTENSIONS:
+                continue
+            entrees.append((st.st_mtime, st.st_size, cle, nom))
+            total += st.st_size
+
+        for _mtime, taille, cle, nom in sorted(entrees):
+            if total <= self.taille_max:
+                break
+            for annexe in (nom, f"{cle}.json", f"{cle}.err"):
+                try:
+                    os.remove(os.path.join(self.repertoire, annexe))
+                except FileNotFoundError:
+                    pass
+            total -= taille
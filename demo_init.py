@@ -2,20 +2,35 @@
 """
 demo_init.py — Initialise la base de données pour le déploiement Render.
 Exécuté à chaque démarrage : crée les tables et peuple la DB si elle est vide.
+
+Générateur de charge : la même graine produit des années d'historique, écrites
+par INSERT en lot (executemany), sur la base désignée par DATABASE_URL :
+
+    DATABASE_URL=sqlite:////tmp/charge.db python demo_init.py --annees 5 --points-de-vente 3 \
+        --recettes 40 --boissons 60 --echelle 8
 """
-import os, random
+import argparse, os, random, time
 from datetime import date, timedelta, datetime
-from collections import defaultdict
+from collections import Counter, defaultdict
 from dotenv import load_dotenv
 
 load_dotenv()
 random.seed(2025)
 
-from app import app, db
+from sqlalchemy import func, insert
+
+from app import app, db, reconstruire_agregats, reconstruire_fiches_aplaties, reconstruire_stock_bar
 from app import (User, Ingredient, Recette, RecetteIngredient, Boisson, Caissier,
                   Vente, SessionCaisse, SessionLigne, EntreeBoisson, HistoriqueTransfert)
 
-def seed():
+# Période de démonstration par défaut
+DEBUT, FIN = date(2025, 8, 1), date(2026, 1, 31)
+
+# Lignes par INSERT (executemany) ; les tampons sont vidés ensemble, parents d'abord
+TAILLE_LOT = 20_000
+
+def seed(debut=DEBUT, fin=FIN, points_de_vente=1, nb_recettes=8, nb_boissons=16, echelle=1.0,
+         taille_lot=TAILLE_LOT):
     with app.app_context():
         # Crée les tables si elles n'existent pas
         db.create_all()
@@ -186,6 +201,14 @@ def seed():
             # Chawarma
             RecetteIngredient(recette_id=8, ingredient_id=20, quantite=1.0),
         ]
+        # Recettes supplémentaires (générateur de charge) : 4 à 9 ingrédients tirés au hasard
+        ids_ingredients = [i.id for i in ingredients]
+        for rid in range(len(recettes) + 1, nb_recettes + 1):
+            recettes.append(Recette(id=rid, nom=f'Plat {rid} → {random.choice((1000, 1500, 2000, 2500))}'))
+            for ingr_id in random.sample(ids_ingredients, random.randint(4, 9)):
+                ris.append(RecetteIngredient(recette_id=rid, ingredient_id=ingr_id,
+                                             quantite=round(random.uniform(0.05, 1.0), 2)))
+        db.session.add_all(recettes[8:])
         db.session.add_all(ris)
 
         # ── 5. BOISSONS ─────────────────────────────────────────────
@@ -207,67 +230,129 @@ def seed():
             Boisson(id=15, nom='Desperados bouteille',prix_unitaire=2000.0),
             Boisson(id=16, nom='Doppel Energy',       prix_unitaire=600.0),
         ]
+        # Boissons supplémentaires (générateur de charge)
+        prix_possibles = (350.0, 500.0, 600.0, 800.0, 1000.0, 1500.0)
+        boissons_data += [Boisson(id=bid, nom=f'Boisson {bid}', prix_unitaire=random.choice(prix_possibles))
+                          for bid in range(len(boissons_data) + 1, nb_boissons + 1)]
         db.session.add_all(boissons_data)
 
-        # ── 6. CAISSIER ─────────────────────────────────────────────
-        caissier = Caissier(id=1, nom='Archange')
-        db.session.add(caissier)
+        # ── 6. CAISSIERS (un par point de vente) ────────────────────
+        caissiers = [Caissier(id=1, nom='Archange')]
+        caissiers += [Caissier(id=k, nom=f'Caisse {k}') for k in range(2, points_de_vente + 1)]
+        db.session.add_all(caissiers)
         db.session.commit()
 
-        # ── 7. DONNÉES HISTORIQUES (Aug 2025 – Jan 2026) ────────────
-        boissons_map = {b.id: b for b in Boisson.query.all()}
+        # ── 7. DONNÉES HISTORIQUES ──────────────────────────────────
+        unites = {i.id: i.unite for i in ingredients}
         compositions = defaultdict(list)
-        for ri in RecetteIngredient.query.all():
-            compositions[ri.recette_id].append(
-                (ri.ingredient_id, ri.quantite, ri.ingredient.unite)
-            )
-
-        spagh  = Recette.query.filter(Recette.nom.ilike('%spaghetti%')).all()
-        legumes= Recette.query.filter(Recette.nom.ilike('%légume%')).all()
-        chaw   = Recette.query.filter(Recette.nom.ilike('%chawarma%')).first()
-
-        bprops_raw = {
-            1: 0.22, 2: 0.18, 5: 0.13, 9: 0.09, 6: 0.08, 7: 0.08,
-            10: 0.07, 11: 0.05, 12: 0.04, 8: 0.03, 14: 0.02, 13: 0.01,
-        }
-        tot = sum(bprops_raw.values())
-        bprops = {k: v/tot for k, v in bprops_raw.items()}
-
-        def distribute(recette_list, total_qty):
-            if not recette_list or total_qty <= 0:
-                return []
-            weights = [random.uniform(0.6, 1.4) for _ in recette_list]
-            s = sum(weights)
-            return [(r.id, max(0, round(total_qty * w / s)))
-                    for r, w in zip(recette_list, weights) if round(total_qty * w / s) > 0]
-
-        ventes_par_jour = defaultdict(list)
-        start, end = date(2025, 8, 1), date(2026, 1, 31)
-        current = start
-
-        nb_v = nb_s = nb_t = nb_e = 0
-
-        while current <= end:
-            dow = current.weekday()
-            if dow == 5:
-                food_min, food_max = 130_000, 200_000
-                bar_min,  bar_max  = 420_000, 700_000
-                chaw_pct = 0.13
-            elif dow == 4:
-                food_min, food_max =  55_000, 100_000
-                bar_min,  bar_max  = 180_000, 300_000
-                chaw_pct = 0.09
-            elif dow == 6:
-                food_min, food_max =  70_000, 130_000
-                bar_min,  bar_max  = 220_000, 380_000
-                chaw_pct = 0.09
-            else:
-                food_min, food_max =  20_000,  40_000
-                bar_min,  bar_max  =  60_000, 150_000
-                chaw_pct = 0.04
-
-            food_target = random.uniform(food_min, food_max)
-            bar_target  = random.uniform(bar_min,  bar_max)
+        for ri in ris:
+            compositions[ri.recette_id].append((ri.ingredient_id, ri.quantite, unites[ri.ingredient_id]))
+
+        debut_chrono = time.perf_counter()
+        totaux = generer_historique(
+            debut, fin, recettes, compositions,
+            {b.id: b.prix_unitaire for b in boissons_data}, [c.id for c in caissiers],
+            echelle=echelle, taille_lot=taille_lot)
+
+        # ── Agrégats du tableau de bord, fiches aplaties & registre stock bar ──
+        reconstruire_agregats()
+        reconstruire_fiches_aplaties()
+        reconstruire_stock_bar()
+
+        print(f"Initialisation terminée ({debut} → {fin}, {points_de_vente} point(s) de vente, "
+              f"{time.perf_counter() - debut_chrono:.1f} s) :")
+        print(f"  Ventes cuisine   : {totaux[Vente]}")
+        print(f"  Sessions bar     : {totaux[SessionCaisse]} ({totaux[SessionLigne]} lignes)")
+        print(f"  Transferts       : {totaux[HistoriqueTransfert]}")
+        print(f"  Livraisons bar   : {totaux[EntreeBoisson]}")
+
+
+class Lots:
+    """Tampons d'INSERT Core par table, écrits par executemany de `taille` lignes."""
+
+    # Ordre d'écriture : une ligne n'est jamais écrite avant la ligne qu'elle référence
+    ORDRE = (Vente, SessionCaisse, SessionLigne, HistoriqueTransfert, EntreeBoisson)
+
+    def __init__(self, taille):
+        self.taille = taille
+        self.tampons = {m: [] for m in self.ORDRE}
+        self.totaux = Counter()
+
+    def ajouter(self, modele, **ligne):
+        tampon = self.tampons[modele]
+        tampon.append(ligne)
+        if len(tampon) >= self.taille:
+            self.vider()
+
+    def vider(self):
+        for modele in self.ORDRE:
+            tampon = self.tampons[modele]
+            if tampon:
+                db.session.execute(insert(modele.__table__), tampon)
+                self.totaux[modele] += len(tampon)
+                self.tampons[modele] = []
+        db.session.commit()
+
+
+def generer_historique(debut, fin, recettes, compositions, prix_boissons, caissiers,
+                       echelle=1.0, taille_lot=TAILLE_LOT):
+    """
+    Ventes (tickets de 1 à 3 portions), sessions bar quotidiennes, transferts
+    magasin → cuisine et livraisons bar de `debut` à `fin` inclus, pour chaque
+    point de vente (caissier). Rien n'est relu en base : les consommations sont
+    cumulées en mémoire, semaine par semaine. `echelle` multiplie le volume du jour.
+    Renvoie le nombre de lignes écrites par modèle.
+    """
+    spagh   = [r for r in recettes if 'spaghetti' in r.nom.lower()]
+    chaw    = next((r for r in recettes if 'chawarma' in r.nom.lower()), None)
+    legumes = [r for r in recettes if r not in spagh and r is not chaw]
+    unites  = {i: u for lignes in compositions.values() for i, _q, u in lignes}
+
+    bprops_raw = {
+        1: 0.22, 2: 0.18, 5: 0.13, 9: 0.09, 6: 0.08, 7: 0.08,
+        10: 0.07, 11: 0.05, 12: 0.04, 8: 0.03, 14: 0.02, 13: 0.01,
+    }
+    for bid in prix_boissons:
+        if bid > 16:
+            bprops_raw[bid] = random.uniform(0.01, 0.05)
+    tot = sum(bprops_raw.values())
+    bprops = {k: v/tot for k, v in bprops_raw.items() if k in prix_boissons}
+
+    def distribute(recette_list, total_qty):
+        if not recette_list or total_qty <= 0:
+            return []
+        weights = [random.uniform(0.6, 1.4) for _ in recette_list]
+        s = sum(weights)
+        return [(r.id, max(0, round(total_qty * w / s)))
+                for r, w in zip(recette_list, weights) if round(total_qty * w / s) > 0]
+
+    lots = Lots(taille_lot)
+    session_id = (db.session.query(func.max(SessionCaisse.id)).scalar() or 0)
+    conso_semaine = defaultdict(float)   # boisson_id -> quantité de la semaine en cours
+    current = debut
+
+    while current <= fin:
+        dow = current.weekday()
+        if dow == 5:
+            food_min, food_max = 130_000, 200_000
+            bar_min,  bar_max  = 420_000, 700_000
+            chaw_pct = 0.13
+        elif dow == 4:
+            food_min, food_max =  55_000, 100_000
+            bar_min,  bar_max  = 180_000, 300_000
+            chaw_pct = 0.09
+        elif dow == 6:
+            food_min, food_max =  70_000, 130_000
+            bar_min,  bar_max  = 220_000, 380_000
+            chaw_pct = 0.09
+        else:
+            food_min, food_max =  20_000,  40_000
+            bar_min,  bar_max  =  60_000, 150_000
+            chaw_pct = 0.04
+
+        for caissier_id in caissiers:
+            food_target = random.uniform(food_min, food_max) * echelle
+            bar_target  = random.uniform(bar_min,  bar_max) * echelle
             if random.random() < 0.05:
                 food_target *= random.uniform(0.3, 0.6)
                 bar_target  *= random.uniform(0.3, 0.5)
@@ -281,110 +366,82 @@ def seed():
                            + distribute(legumes, legume_qty)
                            + ([(chaw.id, chaw_qty)] if chaw and chaw_qty > 0 else []))
 
-            day_ventes = []
+            # Ventes cuisine : un ticket de 1 à 3 portions à la fois
+            besoins = defaultdict(float)
             for rid, qty in assignments:
-                if qty > 0:
-                    dt = datetime(current.year, current.month, current.day,
-                                  random.randint(11, 21), random.randint(0, 59))
-                    v = Vente(recette_id=rid, quantite=qty, date=dt)
-                    db.session.add(v)
-                    day_ventes.append((rid, qty))
-                    nb_v += 1
-            ventes_par_jour[current] = day_ventes
+                for ingr_id, qty_pp, _unite in compositions.get(rid, []):
+                    besoins[ingr_id] += qty * qty_pp
+                while qty > 0:
+                    portions = min(qty, random.randint(1, 3))
+                    lots.ajouter(Vente, recette_id=rid, quantite=portions,
+                                 date=datetime(current.year, current.month, current.day,
+                                               random.randint(11, 21), random.randint(0, 59)))
+                    qty -= portions
+
+            # Transferts magasin → cuisine du matin
+            for ingr_id, qty_total in besoins.items():
+                lots.ajouter(HistoriqueTransfert, ingredient_id=ingr_id,
+                             quantite=round(qty_total * random.uniform(1.05, 1.15), 2),
+                             unite=unites[ingr_id],
+                             date=datetime(current.year, current.month, current.day,
+                                           random.randint(6, 9), random.randint(0, 59)),
+                             sens='magasin_vers_cuisine')
 
             # Session caisse bar
+            session_id += 1
             montant_reel = round(bar_target)
-            sess = SessionCaisse(date=current, caissier_id=1,
-                                  montant_reel=montant_reel,
-                                  montant_attendu=0.0, ecart=0.0)
-            db.session.add(sess)
-            db.session.flush()
-
             montant_attendu = 0.0
+            lignes = []
             for bid, prop in bprops.items():
-                b = boissons_map.get(bid)
-                if not b or b.prix_unitaire <= 0:
+                prix = prix_boissons[bid]
+                if prix <= 0:
                     continue
-                qte = round(bar_target * prop / b.prix_unitaire)
+                qte = round(bar_target * prop / prix)
                 if qte <= 0:
                     continue
-                db.session.add(SessionLigne(
-                    session_id=sess.id, boisson_id=bid,
-                    stock_initial=0.0, entrees=float(qte), stock_final=0.0,
-                    prix_unitaire_snap=b.prix_unitaire
-                ))
-                montant_attendu += qte * b.prix_unitaire
-
-            sess.montant_attendu = round(montant_attendu, 2)
-            sess.ecart = round(montant_reel - montant_attendu, 2)
-            nb_s += 1
-            current += timedelta(days=1)
-
-        db.session.commit()
-
-        # ── Transferts magasin → cuisine ────────────────────────────
-        for jour, day_v in sorted(ventes_par_jour.items()):
-            besoins = defaultdict(float)
-            ingr_unite = {}
-            for rid, qte_vendue in day_v:
-                for ingr_id, qty_pp, unite in compositions.get(rid, []):
-                    besoins[ingr_id] += qte_vendue * qty_pp
-                    ingr_unite[ingr_id] = unite
-            for ingr_id, qty_total in besoins.items():
-                qty = round(qty_total * random.uniform(1.05, 1.15), 2)
-                dt = datetime(jour.year, jour.month, jour.day,
-                              random.randint(6, 9), random.randint(0, 59))
-                db.session.add(HistoriqueTransfert(
-                    ingredient_id=ingr_id, quantite=qty,
-                    unite=ingr_unite[ingr_id], date=dt,
-                    sens='magasin_vers_cuisine'
-                ))
-                nb_t += 1
-
-        db.session.commit()
-
-        # ── Entrées boissons (livraisons bar) ───────────────────────
-        conso = defaultdict(lambda: defaultdict(float))
-        for sl in SessionLigne.query.all():
-            sess = db.session.get(SessionCaisse, sl.session_id)
-            if sess:
-                conso[sess.date][sl.boisson_id] += sl.entrees
-
-        par_semaine = defaultdict(lambda: defaultdict(float))
-        for d, bids in conso.items():
-            lundi = d - timedelta(days=d.weekday())
-            for bid, qty in bids.items():
-                par_semaine[lundi][bid] += qty
-
-        for lundi in sorted(par_semaine):
+                lignes.append(dict(session_id=session_id, boisson_id=bid,
+                                   stock_initial=0.0, entrees=float(qte), stock_final=0.0,
+                                   prix_unitaire_snap=prix))
+                montant_attendu += qte * prix
+                conso_semaine[bid] += qte
+            lots.ajouter(SessionCaisse, id=session_id, date=current, caissier_id=caissier_id,
+                         montant_reel=montant_reel, montant_attendu=round(montant_attendu, 2),
+                         ecart=round(montant_reel - montant_attendu, 2))
+            for ligne in lignes:
+                lots.ajouter(SessionLigne, **ligne)
+
+        # Livraisons bar de la semaine écoulée (lundi, puis réappro du jeudi)
+        if dow == 6 or current == fin:
+            lundi = current - timedelta(days=dow)
             jeudi = lundi + timedelta(days=3)
-            for bid, qty_sem in par_semaine[lundi].items():
-                b = boissons_map.get(bid)
-                if not b:
-                    continue
+            for bid, qty_sem in conso_semaine.items():
                 pct = random.uniform(0.60, 0.70)
                 qty_lun = max(1, round(qty_sem * pct * random.uniform(1.05, 1.10)))
-                db.session.add(EntreeBoisson(
-                    boisson_id=bid, quantite=float(qty_lun), date=lundi,
-                    note=f"Livraison sem. {lundi.strftime('%d/%m/%Y')}"
-                ))
-                nb_e += 1
+                lots.ajouter(EntreeBoisson, boisson_id=bid, quantite=float(qty_lun), date=lundi,
+                             note=f"Livraison sem. {lundi.strftime('%d/%m/%Y')}")
                 if random.random() < 0.85:
                     qty_jeu = max(1, round(qty_sem * (1 - pct) * random.uniform(1.05, 1.10)))
-                    db.session.add(EntreeBoisson(
-                        boisson_id=bid, quantite=float(qty_jeu), date=jeudi,
-                        note=f"Réappro {jeudi.strftime('%d/%m/%Y')}"
-                    ))
-                    nb_e += 1
+                    lots.ajouter(EntreeBoisson, boisson_id=bid, quantite=float(qty_jeu), date=jeudi,
+                                 note=f"Réappro {jeudi.strftime('%d/%m/%Y')}")
+            conso_semaine.clear()
 
-        db.session.commit()
+        current += timedelta(days=1)
 
-        print(f"Initialisation terminée :")
-        print(f"  Ventes cuisine   : {nb_v}")
-        print(f"  Sessions bar     : {nb_s}")
-        print(f"  Transferts       : {nb_t}")
-        print(f"  Livraisons bar   : {nb_e}")
+    lots.vider()
+    return lots.totaux
 
 
 if __name__ == '__main__':
-    seed()
+    parser = argparse.ArgumentParser(description="Initialise la base (démonstration ou générateur de charge).")
+    parser.add_argument('--annees', type=float, help="années d'historique se terminant à --fin (remplace --debut)")
+    parser.add_argument('--debut', type=date.fromisoformat, default=DEBUT)
+    parser.add_argument('--fin', type=date.fromisoformat, default=FIN)
+    parser.add_argument('--points-de-vente', type=int, default=1, help="caisses (une session bar par jour chacune)")
+    parser.add_argument('--recettes', type=int, default=8, help="nombre de recettes (8 réelles + plats générés)")
+    parser.add_argument('--boissons', type=int, default=16, help="nombre de boissons (16 réelles + générées)")
+    parser.add_argument('--echelle', type=float, default=1.0, help="multiplicateur du volume journalier")
+    parser.add_argument('--taille-lot', type=int, default=TAILLE_LOT)
+    args = parser.parse_args()
+    debut = args.fin - timedelta(days=round(365.25 * args.annees)) + timedelta(days=1) if args.annees else args.debut
+    seed(debut, args.fin, max(1, args.points_de_vente), max(8, args.recettes), max(16, args.boissons),
+         args.echelle, args.taille_lot)
@@ -0,0 +1,56 @@
+"""add composite indexes for report queries
+
+Revision ID: 2e524bb7c0d0
+Revises: e002b731e99a
+Create Date: 2026-10-18 10:02:41.316720
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = '2e524bb7c0d0'
+down_revision = 'e002b731e99a'
+branch_labels = None
+depends_on = None
+
+
+# (nom de l'index, table, colonnes)
+INDEXES = [
+    ('ix_vente_date_recette_id_quantite', 'vente', ['date', 'recette_id', 'quantite']),
+    ('ix_historique_transfert_date_ingredient_id', 'historique_transfert', ['date', 'ingredient_id']),
+    ('ix_vente_boisson_date', 'vente_boisson', ['date']),
+    ('ix_session_caisse_date', 'session_caisse', ['date']),
+    ('ix_session_ligne_session_id', 'session_ligne', ['session_id']),
+    ('ix_session_ligne_boisson_id_session_id', 'session_ligne', ['boisson_id', 'session_id']),
+    ('ix_entree_boisson_boisson_id_date', 'entree_boisson', ['boisson_id', 'date']),
+    ('ix_recette_ingredient_recette_id', 'recette_ingredient', ['recette_id']),
+]
+
+
+def _table_exists(table_name):
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def _index_exists(table_name, index_name):
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return index_name in [ix['name'] for ix in inspector.get_indexes(table_name)]
+
+
+def upgrade():
+    # Les tables peuvent avoir été créées par db.create_all() (demo_init.py),
+    # qui pose déjà les index déclarés sur les modèles.
+    for index_name, table_name, columns in INDEXES:
+        if _table_exists(table_name) and not _index_exists(table_name, index_name):
+            op.create_index(index_name, table_name, columns, unique=False)
+
+
+def downgrade():
+    for index_name, table_name, columns in reversed(INDEXES):
+        if _table_exists(table_name) and _index_exists(table_name, index_name):
+            op.drop_index(index_name, table_name=table_name)
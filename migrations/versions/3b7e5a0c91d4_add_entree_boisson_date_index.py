@@ -0,0 +1,39 @@
+"""add entree_boisson.date index (raw deliveries export)
+
+Revision ID: 3b7e5a0c91d4
+Revises: f183d3d45bdb
+Create Date: 2026-10-18 15:21:09.442871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7e5a0c91d4'
+down_revision = 'f183d3d45bdb'
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(table_name):
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def _index_exists(table_name, index_name):
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return index_name in [ix['name'] for ix in inspector.get_indexes(table_name)]
+
+
+def upgrade():
+    if _table_exists('entree_boisson') and not _index_exists('entree_boisson', 'ix_entree_boisson_date'):
+        op.create_index('ix_entree_boisson_date', 'entree_boisson', ['date'], unique=False)
+
+
+def downgrade():
+    if _table_exists('entree_boisson') and _index_exists('entree_boisson', 'ix_entree_boisson_date'):
+        op.drop_index('ix_entree_boisson_date', table_name='entree_boisson')
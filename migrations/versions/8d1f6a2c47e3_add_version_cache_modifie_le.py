@@ -0,0 +1,42 @@
+"""add version_cache.modifie_le (Last-Modified of the dashboard API)
+
+Revision ID: 8d1f6a2c47e3
+Revises: 3b7e5a0c91d4
+Create Date: 2026-10-18 16:40:12.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = '8d1f6a2c47e3'
+down_revision = '3b7e5a0c91d4'
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(table_name):
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def _column_exists(table_name, column_name):
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    cols = [c['name'] for c in inspector.get_columns(table_name)]
+    return column_name in cols
+
+
+def upgrade():
+    if _table_exists('version_cache') and not _column_exists('version_cache', 'modifie_le'):
+        with op.batch_alter_table('version_cache', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('modifie_le', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    if _table_exists('version_cache') and _column_exists('version_cache', 'modifie_le'):
+        with op.batch_alter_table('version_cache', schema=None) as batch_op:
+            batch_op.drop_column('modifie_le')
@@ -0,0 +1,65 @@
+"""add stock_boisson ledger
+
+Revision ID: 95142a6e61c3
+Revises: f2a9ef1b5f1e
+Create Date: 2026-10-18 12:47:13.551208
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = '95142a6e61c3'
+down_revision = 'f2a9ef1b5f1e'
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(table_name):
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def upgrade():
+    if not _table_exists('stock_boisson'):
+        op.create_table('stock_boisson',
+        sa.Column('boisson_id', sa.Integer(), nullable=False),
+        sa.Column('dernier_sf', sa.Float(), nullable=False),
+        sa.Column('date_dernier_sf', sa.Date(), nullable=True),
+        sa.Column('entrees_depuis', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['boisson_id'], ['boisson.id'], ),
+        sa.PrimaryKeyConstraint('boisson_id')
+        )
+
+    # Back-fill depuis l'historique (équivalent de : flask reconstruire-stock-bar)
+    if not _table_exists('session_ligne') or not _table_exists('entree_boisson'):
+        return
+
+    op.execute('DELETE FROM stock_boisson')
+    op.execute("""
+        INSERT INTO stock_boisson (boisson_id, dernier_sf, date_dernier_sf, entrees_depuis)
+        SELECT b.id,
+               COALESCE(d.stock_final, 0.0),
+               d.date,
+               COALESCE((SELECT SUM(e.quantite) FROM entree_boisson e
+                         WHERE e.boisson_id = b.id AND (d.date IS NULL OR e.date > d.date)), 0.0)
+        FROM boisson b
+        LEFT JOIN (
+            SELECT boisson_id, stock_final, date FROM (
+                SELECT l.boisson_id, l.stock_final, s.date,
+                       ROW_NUMBER() OVER (PARTITION BY l.boisson_id
+                                          ORDER BY s.date DESC, l.id DESC) AS rang
+                FROM session_ligne l JOIN session_caisse s ON s.id = l.session_id
+            ) t WHERE rang = 1
+        ) d ON d.boisson_id = b.id
+        WHERE d.boisson_id IS NOT NULL
+           OR EXISTS (SELECT 1 FROM entree_boisson e WHERE e.boisson_id = b.id)
+    """)
+
+
+def downgrade():
+    if _table_exists('stock_boisson'):
+        op.drop_table('stock_boisson')
@@ -0,0 +1,70 @@
+"""add sub-recipes (recette_composant) and flattened bill of materials (fiche_aplatie)
+
+Revision ID: c5e81f0d2a96
+Revises: 8d1f6a2c47e3
+Create Date: 2026-10-18 19:05:37.204118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e81f0d2a96'
+down_revision = '8d1f6a2c47e3'
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(table_name):
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def upgrade():
+    if not _table_exists('recette_composant'):
+        op.create_table('recette_composant',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('recette_id', sa.Integer(), nullable=False),
+        sa.Column('sous_recette_id', sa.Integer(), nullable=False),
+        sa.Column('quantite', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['recette_id'], ['recette.id'], ),
+        sa.ForeignKeyConstraint(['sous_recette_id'], ['recette.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_recette_composant_recette_id', 'recette_composant', ['recette_id'])
+        op.create_index('ix_recette_composant_sous_recette_id', 'recette_composant', ['sous_recette_id'])
+
+    if not _table_exists('fiche_aplatie'):
+        op.create_table('fiche_aplatie',
+        sa.Column('recette_id', sa.Integer(), nullable=False),
+        sa.Column('ingredient_id', sa.Integer(), nullable=False),
+        sa.Column('quantite', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['recette_id'], ['recette.id'], ),
+        sa.ForeignKeyConstraint(['ingredient_id'], ['ingredient.id'], ),
+        sa.PrimaryKeyConstraint('recette_id', 'ingredient_id')
+        )
+
+    # Back-fill : aucune sous-recette encore, fiche aplatie = fiche directe
+    # (équivalent de : flask reconstruire-fiches)
+    if not _table_exists('recette_ingredient'):
+        return
+
+    recette_ingredient = sa.table('recette_ingredient', sa.column('recette_id'),
+                                  sa.column('ingredient_id'), sa.column('quantite'))
+    op.execute('DELETE FROM fiche_aplatie')
+    op.execute(sa.table('fiche_aplatie', sa.column('recette_id'), sa.column('ingredient_id'),
+                        sa.column('quantite')).insert().from_select(
+        ['recette_id', 'ingredient_id', 'quantite'],
+        sa.select(recette_ingredient.c.recette_id, recette_ingredient.c.ingredient_id,
+                  sa.func.sum(recette_ingredient.c.quantite))
+        .group_by(recette_ingredient.c.recette_id, recette_ingredient.c.ingredient_id)
+    ))
+
+
+def downgrade():
+    for tbl in ('fiche_aplatie', 'recette_composant'):
+        if _table_exists(tbl):
+            op.drop_table(tbl)
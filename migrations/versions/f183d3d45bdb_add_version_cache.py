@@ -0,0 +1,37 @@
+"""add version_cache (stock alert cache stamp)
+
+Revision ID: f183d3d45bdb
+Revises: 95142a6e61c3
+Create Date: 2026-10-18 14:02:37.184410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = 'f183d3d45bdb'
+down_revision = '95142a6e61c3'
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(table_name):
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def upgrade():
+    if not _table_exists('version_cache'):
+        op.create_table('version_cache',
+        sa.Column('cle', sa.String(length=50), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('cle')
+        )
+
+
+def downgrade():
+    if _table_exists('version_cache'):
+        op.drop_table('version_cache')
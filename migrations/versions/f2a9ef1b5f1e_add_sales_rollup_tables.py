@@ -0,0 +1,99 @@
+"""add daily/hourly sales rollup tables
+
+Revision ID: f2a9ef1b5f1e
+Revises: 2e524bb7c0d0
+Create Date: 2026-10-18 11:24:05.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a9ef1b5f1e'
+down_revision = '2e524bb7c0d0'
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(table_name):
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def upgrade():
+    if not _table_exists('agregat_vente_jour'):
+        op.create_table('agregat_vente_jour',
+        sa.Column('jour', sa.Date(), nullable=False),
+        sa.Column('recette_id', sa.Integer(), nullable=False),
+        sa.Column('quantite', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['recette_id'], ['recette.id'], ),
+        sa.PrimaryKeyConstraint('jour', 'recette_id')
+        )
+
+    if not _table_exists('agregat_vente_heure'):
+        op.create_table('agregat_vente_heure',
+        sa.Column('jour', sa.Date(), nullable=False),
+        sa.Column('heure', sa.Integer(), nullable=False),
+        sa.Column('recette_id', sa.Integer(), nullable=False),
+        sa.Column('quantite', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['recette_id'], ['recette.id'], ),
+        sa.PrimaryKeyConstraint('jour', 'heure', 'recette_id')
+        )
+
+    if not _table_exists('agregat_boisson_jour'):
+        op.create_table('agregat_boisson_jour',
+        sa.Column('jour', sa.Date(), nullable=False),
+        sa.Column('boisson_id', sa.Integer(), nullable=False),
+        sa.Column('quantite', sa.Float(), nullable=False),
+        sa.Column('montant', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['boisson_id'], ['boisson.id'], ),
+        sa.PrimaryKeyConstraint('jour', 'boisson_id')
+        )
+
+    # Back-fill depuis l'historique (équivalent de : flask reconstruire-agregats)
+    if not _table_exists('vente') or not _table_exists('session_ligne'):
+        return
+
+    vente = sa.table('vente', sa.column('recette_id'), sa.column('quantite'), sa.column('date'))
+    session_caisse = sa.table('session_caisse', sa.column('id'), sa.column('date'))
+    session_ligne = sa.table('session_ligne', sa.column('session_id'), sa.column('boisson_id'),
+                             sa.column('stock_initial'), sa.column('entrees'),
+                             sa.column('stock_final'), sa.column('prix_unitaire_snap'))
+
+    op.execute('DELETE FROM agregat_vente_jour')
+    op.execute('DELETE FROM agregat_vente_heure')
+    op.execute('DELETE FROM agregat_boisson_jour')
+
+    jour = sa.func.date(vente.c.date)
+    heure = sa.extract('hour', vente.c.date)
+    op.execute(sa.table('agregat_vente_jour', sa.column('jour'), sa.column('recette_id'),
+                        sa.column('quantite')).insert().from_select(
+        ['jour', 'recette_id', 'quantite'],
+        sa.select(jour, vente.c.recette_id, sa.func.sum(vente.c.quantite))
+        .group_by(jour, vente.c.recette_id)
+    ))
+    op.execute(sa.table('agregat_vente_heure', sa.column('jour'), sa.column('heure'),
+                        sa.column('recette_id'), sa.column('quantite')).insert().from_select(
+        ['jour', 'heure', 'recette_id', 'quantite'],
+        sa.select(jour, heure, vente.c.recette_id, sa.func.sum(vente.c.quantite))
+        .group_by(jour, heure, vente.c.recette_id)
+    ))
+    qte = session_ligne.c.stock_initial + session_ligne.c.entrees - session_ligne.c.stock_final
+    op.execute(sa.table('agregat_boisson_jour', sa.column('jour'), sa.column('boisson_id'),
+                        sa.column('quantite'), sa.column('montant')).insert().from_select(
+        ['jour', 'boisson_id', 'quantite', 'montant'],
+        sa.select(session_caisse.c.date, session_ligne.c.boisson_id,
+                  sa.func.sum(qte), sa.func.sum(qte * session_ligne.c.prix_unitaire_snap))
+        .select_from(session_ligne.join(session_caisse,
+                                        session_caisse.c.id == session_ligne.c.session_id))
+        .group_by(session_caisse.c.date, session_ligne.c.boisson_id)
+    ))
+
+
+def downgrade():
+    for tbl in ('agregat_boisson_jour', 'agregat_vente_heure', 'agregat_vente_jour'):
+        if _table_exists(tbl):
+            op.drop_table(tbl)
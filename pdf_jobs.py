@@ -0,0 +1,155 @@
+"""
+pdf_jobs.py — Rendu des rapports PDF hors de la requête HTTP.
+
+Le HTML du rapport est rendu dans la requête (base + Jinja, rapide) ; la
+conversion xhtml2pdf, longue, part dans un pool de processus local. L'état
+d'un travail est porté par des fichiers dans un répertoire partagé, si bien
+que n'importe quel worker gunicorn peut répondre au statut / téléchargement
+d'un travail soumis par un autre :
+
+    <id>.json     métadonnées (nom du fichier téléchargé, date de soumission)
+    <id>.encours  travail soumis, pas encore terminé
+    <id>.pdf      résultat
+    <id>.err      message d'erreur
+
+Le répertoire est un CacheDisque (cache_rapports.py) : l'identifiant d'un
+travail est sa clé de cache, et un rapport déjà rendu est resservi tel quel
+jusqu'à son éviction (LRU, taille bornée).
+
+Ce module n'importe pas app.py : les processus du pool (démarrés en « spawn »)
+ne chargent que xhtml2pdf.
+"""
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from cache_rapports import ecrire_atomique as _ecrire
+
+EN_COURS, PRET, ERREUR, INCONNU = 'en_cours', 'pret', 'erreur', 'inconnu'
+
+_ID_VALIDE = re.compile(r'[0-9a-f]{32}')
+
+
+def rendre_pdf(html, chemin_pdf, chemin_err, chemin_encours):
+    """Exécuté dans un processus du pool : HTML -> PDF sur disque. Renvoie la durée (s)."""
+    from xhtml2pdf import pisa
+
+    debut = time.perf_counter()
+    try:
+        result = io.BytesIO()
+        pisa_status = pisa.CreatePDF(io.StringIO(html), dest=result)
+        if pisa_status.err:
+            _ecrire(chemin_err, f"Erreur de génération PDF : {pisa_status.err}".encode('utf-8'))
+        else:
+            _ecrire(chemin_pdf, result.getvalue())
+    except Exception as e:
+        _ecrire(chemin_err, f"Erreur de génération PDF : {e}".encode('utf-8'))
+    finally:
+        _supprimer(chemin_encours)
+    return time.perf_counter() - debut
+
+
+def _supprimer(chemin):
+    try:
+        os.remove(chemin)
+    except FileNotFoundError:
+        pass
+
+
+class FileRapports:
+    """
+    File de travaux PDF d'un worker. Le pool est créé à la première soumission,
+    donc après le fork des workers gunicorn (jamais hérité d'un processus parent).
+    """
+
+    def __init__(self, cache, processus=1, delai_max=600):
+        self.cache = cache
+        self.processus = processus
+        self.delai_max = delai_max      # au-delà, un travail « en cours » est considéré perdu (s)
+        self._pool = None
+        self._pid = None
+
+    def _executeur(self):
+        if self._pool is None or self._pid != os.getpid():
+            self._pool = ProcessPoolExecutor(max_workers=self.processus,
+                                             mp_context=multiprocessing.get_context('spawn'))
+            self._pid = os.getpid()
+        return self._pool
+
+    def chemin(self, job_id, extension):
+        return self.cache.chemin(job_id, extension)
+
+    def arreter(self):
+        """Attend la fin des travaux soumis et libère le pool (recréé à la soumission suivante)."""
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=True)
+        self._pool = None
+
+    def soumettre(self, html, nom_fichier, rappel=None, job_id=None):
+        """
+        Met le rendu de `html` en file et renvoie l'identifiant du travail
+        (`job_id` : clé de cache du rapport ; par défaut l'empreinte du HTML).
+        `rappel(duree)` est appelé dans le worker à la fin du rendu.
+        """
+        os.makedirs(self.cache.repertoire, exist_ok=True)
+        self.cache.evincer()
+
+        job_id = job_id or hashlib.sha256(html.encode('utf-8')).hexdigest()[:32]
+        if self.statut(job_id) in (PRET, EN_COURS):
+            return job_id
+
+        _supprimer(self.chemin(job_id, 'err'))
+        _ecrire(self.chemin(job_id, 'json'),
+                json.dumps(dict(nom=nom_fichier, soumis=time.time())).encode('utf-8'))
+        _ecrire(self.chemin(job_id, 'encours'), b'')
+        args = (html, self.chemin(job_id, 'pdf'), self.chemin(job_id, 'err'), self.chemin(job_id, 'encours'))
+        try:
+            future = self._executeur().submit(rendre_pdf, *args)
+        except BrokenProcessPool:
+            self._pool = None
+            future = self._executeur().submit(rendre_pdf, *args)
+
+        def termine(f):
+            if f.exception() is not None:
+                # Processus du pool mort (mémoire, signal…) : le travail ne doit pas rester « en cours »
+                _ecrire(self.chemin(job_id, 'err'),
+                        f"Erreur de génération PDF : {f.exception()!r}".encode('utf-8'))
+                _supprimer(self.chemin(job_id, 'encours'))
+            elif rappel is not None:
+                rappel(f.result())
+
+        future.add_done_callback(termine)
+        return job_id
+
+    def statut(self, job_id):
+        if not _ID_VALIDE.fullmatch(job_id or ''):
+            return INCONNU
+        if os.path.exists(self.chemin(job_id, 'pdf')):
+            return PRET
+        if os.path.exists(self.chemin(job_id, 'err')):
+            return ERREUR
+        try:
+            age = time.time() - os.path.getmtime(self.chemin(job_id, 'encours'))
+        except FileNotFoundError:
+            return INCONNU
+        return EN_COURS if age < self.delai_max else ERREUR
+
+    def meta(self, job_id):
+        try:
+            with open(self.chemin(job_id, 'json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def erreur(self, job_id):
+        try:
+            with open(self.chemin(job_id, 'err'), encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return "Erreur de génération PDF : travail interrompu."